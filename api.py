@@ -0,0 +1,406 @@
+#----------------------------------------------------------------------------#
+# JSON API, version 1.
+#
+# Mirrors the html pages under /api/v1:
+#
+#   GET /api/v1/venues                  ?after=<id>&limit=&fields=
+#   GET /api/v1/venues/<id>             ?fields=
+#   GET /api/v1/venues/search?q=
+#   GET /api/v1/venues/near?lat=&lng=   &radius_km=&k=&fields=
+#   GET /api/v1/venues/available?city=&state=&date=   (or &start=&end=) &after=<id>&limit=
+#   GET /api/v1/venues/<id>/availability?date=   (or ?start=&end=) &min_gap_minutes=
+#   GET /api/v1/artists                 ?after=<id>&limit=&fields=
+#   GET /api/v1/artists/<id>            ?fields=
+#   GET /api/v1/artists/search?q=
+#   GET /api/v1/artists/available?date=   (or ?start=&end=) &min_gap_minutes=&unbooked=1&after=<id>&limit=
+#   GET /api/v1/artists/<id>/availability?date=   (or ?start=&end=) &min_gap_minutes=
+#   GET /api/v1/shows                   ?after=<cursor>&upcoming=1&limit=&fields=
+#
+# Collections are streamed: rows are fetched with yield_per and written out
+# as they arrive, and the body ends with the cursor of the next page
+# ({"data": [...], "next_cursor": ...}). fields= selects a subset of columns,
+# and only those columns are queried.
+#
+# venues/near returns the k (default 100) venues closest to lat/lng, closest
+# first with their distance_km, and with radius_km only those within it.
+#
+# The availability endpoints take a window: a whole day (date=YYYY-MM-DD) or
+# start= and end= datetimes, at most AVAILABILITY_MAX_DAYS long (see
+# availability.py). venues/available lists the venues of a city with
+# nothing booked in it; artists/available lists artists with their free
+# gaps of at least min_gap_minutes (unbooked=1: only those free throughout);
+# <id>/availability gives one venue's or artist's busy intervals and gaps.
+#
+# Every response carries an ETag derived from the data it depends on (see
+# conditional()), so a matching If-None-Match is answered with 304 after
+# one small validator query, without running the view.
+#----------------------------------------------------------------------------#
+
+import json
+import hashlib
+import functools
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, Response, current_app, request, abort, jsonify, stream_with_context
+
+from models import *
+from queries import *
+from booking import show_duration
+from availability import day_window, free_venues, busy_times, unbooked
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+
+VENUE_FIELDS = {
+  'id': Venue.id,
+  'name': Venue.name,
+  'city': Venue.city,
+  'state': Venue.state,
+  'address': Venue.address,
+  'phone': Venue.phone,
+  'website': Venue.website,
+  'image_link': Venue.image_link,
+  'facebook_link': Venue.facebook_link,
+  'seeking_talent': Venue.seeking_talent,
+  'seeking_description': Venue.seeking_description,
+  'latitude': Venue.latitude,
+  'longitude': Venue.longitude,
+  'num_upcoming_shows': Venue.upcoming_shows_count,
+  'version': Venue.version,
+}
+
+ARTIST_FIELDS = {
+  'id': Artist.id,
+  'name': Artist.name,
+  'city': Artist.city,
+  'state': Artist.state,
+  'phone': Artist.phone,
+  'website': Artist.website,
+  'image_link': Artist.image_link,
+  'facebook_link': Artist.facebook_link,
+  'seeking_venue': Artist.seeking_venue,
+  'seeking_description': Artist.seeking_description,
+  'num_upcoming_shows': Artist.upcoming_shows_count,
+  'version': Artist.version,
+}
+
+SHOW_FIELDS = ('id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link')
+
+
+def to_json(value):
+  return json.dumps(value, default=json_default, separators=(',', ':'))
+
+
+def json_default(value):
+  if isinstance(value, date):
+    return value.isoformat()
+  if hasattr(value, '_asdict'):
+    return value._asdict()
+  raise TypeError('%r is not JSON serializable' % value)
+
+
+def requested_fields(available):
+  # ?fields=a,b - unknown names are a client error; id always comes along for cursors and links
+  fields = request.args.get('fields')
+  if not fields:
+    return list(available)
+  names = [name.strip() for name in fields.split(',') if name.strip()]
+  unknown = [name for name in names if name not in available]
+  if unknown:
+    abort(400, 'unknown fields: %s' % ', '.join(unknown))
+  if 'id' in available and 'id' not in names:
+    names.insert(0, 'id')
+  return names
+
+
+def requested_limit():
+  try:
+    limit = int(request.args.get('limit', DEFAULT_LIMIT))
+  except ValueError:
+    abort(400, 'limit must be a number')
+  return max(1, min(limit, MAX_LIMIT))
+
+
+def conditional(validator):
+  # ETag from the data the response depends on. validator takes the view arguments and returns
+  # values that change whenever the response would (listing_state, or an entity's last modified
+  # time - see queries.py), or None for a missing entity (404). they come from the database, so
+  # every worker, cli command and restart agrees on them. a matching If-None-Match gets a 304
+  # without running the view
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      state = validator(**kwargs)
+      if state is None:
+        abort(404)
+      etag = hashlib.sha1(('%s|%r' % (request.full_path, state)).encode('utf-8')).hexdigest()
+      if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+      response = view(**kwargs)
+      if response.status_code == 200:
+        response.set_etag(etag)
+      return response
+    return wrapper
+  return decorator
+
+
+def stream_collection(rows, limit, fields, cursor_of):
+  # writes {"data": [...], "next_cursor": ...} as rows arrive. rows must yield up to limit + 1
+  # items; the extra one only tells us there is another page
+  def generate():
+    # the query runs here, after the view has returned, so it is marked read-only again
+    with reading():
+      yield '{"data":['
+      count = 0
+      last = None
+      next_cursor = None
+      for row in rows:
+        if count == limit:
+          next_cursor = cursor_of(last)
+          break
+        record = row._asdict()
+        yield (',' if count else '') + to_json(dict((name, record[name]) for name in fields))
+        last = row
+        count += 1
+      yield '],"next_cursor":%s}' % to_json(next_cursor)
+  return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def coordinate(name, bound):
+  try:
+    value = float(request.args[name])
+  except KeyError:
+    abort(400, '%s is required' % name)
+  except ValueError:
+    abort(400, '%s must be a number' % name)
+  if not -bound <= value <= bound:
+    abort(400, '%s must be between -%d and %d' % (name, bound, bound))
+  return value
+
+
+def requested_after():
+  after = request.args.get('after')
+  if not after:
+    return None
+  if not after.isdigit():
+    abort(400, 'after must be an id')
+  return int(after)
+
+
+def requested_window():
+  # ?date= for a whole day, or ?start=&end=
+  try:
+    if request.args.get('date'):
+      start, end = day_window(date.fromisoformat(request.args['date']))
+    else:
+      start, end = datetime.fromisoformat(request.args['start']), datetime.fromisoformat(request.args['end'])
+  except KeyError:
+    abort(400, 'date, or start and end, are required')
+  except ValueError:
+    abort(400, 'dates must be in ISO 8601 format')
+  if end <= start:
+    abort(400, 'end must be after start')
+  if end - start > timedelta(days=current_app.config['AVAILABILITY_MAX_DAYS']):
+    abort(400, 'the window can be at most %d days long' % current_app.config['AVAILABILITY_MAX_DAYS'])
+  return start, end
+
+
+def requested_min_gap():
+  try:
+    return timedelta(minutes=max(0, int(request.args.get('min_gap_minutes', 0))))
+  except ValueError:
+    abort(400, 'min_gap_minutes must be a number')
+
+
+def entity_collection(columns, model):
+  fields = requested_fields(columns)
+  limit = requested_limit()
+  query = db.session.query(*[columns[name].label(name) for name in fields])
+  after = requested_after()
+  if after is not None:
+    query = query.filter(model.id > after)
+  rows = query.order_by(model.id).limit(limit + 1).yield_per(1000)
+  return stream_collection(rows, limit, fields, lambda row: str(row.id))
+
+
+def sparse(record):
+  fields = requested_fields(record)
+  return dict((name, record[name]) for name in fields)
+
+
+def json_response(value, status=200):
+  return Response(to_json(value), status=status, mimetype='application/json')
+
+
+def page_of(rows, limit):
+  # rows holds up to limit + 1 items; the extra one only tells us there is another page
+  return rows[:limit], (str(rows[limit - 1].id) if len(rows) > limit else None)
+
+
+def entity_availability(model, column, entity_id):
+  start, end = requested_window()
+  if db.session.query(model.id).filter(model.id == entity_id).first() is None:
+    abort(404)
+  timeline = busy_times(column, [entity_id], start, end, show_duration(current_app.config))[entity_id]
+  return json_response({"id": entity_id, "start": start, "end": end, "busy": timeline.intervals(),
+    "gaps": timeline.gaps(start, end, requested_min_gap())})
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@api.route('/venues')
+@conditional(lambda: listing_state(Venue))
+@read_only_view
+def venues():
+  return entity_collection(VENUE_FIELDS, Venue)
+
+@api.route('/venues/search')
+@conditional(lambda: listing_state(Venue))
+@read_only_view
+def search_venues():
+  results = current_app.extensions['search']['venues'].search(request.args.get('q', ''))
+  return json_response({"count": results.count, "data": results.data})
+
+@api.route('/venues/near')
+@conditional(lambda: listing_state(Venue))
+@read_only_view
+def venues_near():
+  lat, lng = coordinate('lat', 90), coordinate('lng', 180)
+  radius_km = None
+  if request.args.get('radius_km'):
+    try:
+      radius_km = float(request.args['radius_km'])
+    except ValueError:
+      abort(400, 'radius_km must be a number')
+    if radius_km <= 0:
+      abort(400, 'radius_km must be positive')
+  try:
+    k = max(1, min(int(request.args.get('k', DEFAULT_LIMIT)), MAX_LIMIT))
+  except ValueError:
+    abort(400, 'k must be a number')
+  fields = requested_fields(VENUE_FIELDS)
+
+  # ids and distances from the proximity index, then one query for the requested columns
+  matches = current_app.extensions['geo'].nearest(lat, lng, k, radius_km)
+  rows = {}
+  if matches:
+    query = db.session.query(*[VENUE_FIELDS[name].label(name) for name in fields]) \
+      .filter(Venue.id.in_([venue_id for venue_id, distance in matches]))
+    rows = dict((row.id, row) for row in query)
+  data = []
+  for venue_id, distance in matches:
+    if venue_id in rows:
+      record = rows[venue_id]._asdict()
+      record['distance_km'] = round(distance, 3)
+      data.append(record)
+  return json_response({"count": len(data), "data": data})
+
+@api.route('/venues/available')
+@conditional(lambda: listing_state(Venue, Show))
+@read_only_view
+def available_venues():
+  city, state = request.args.get('city', '').strip(), request.args.get('state', '').strip().upper()
+  if not city or not state:
+    abort(400, 'city and state are required')
+  start, end = requested_window()
+  limit = requested_limit()
+  rows = free_venues(city, state, start, end, show_duration(current_app.config), requested_after(), limit + 1).all()
+  page, next_cursor = page_of(rows, limit)
+  return json_response({"start": start, "end": end, "data": [row._asdict() for row in page], "next_cursor": next_cursor})
+
+@api.route('/venues/<int:venue_id>/availability')
+@conditional(venue_last_modified)
+@read_only_view
+def venue_availability(venue_id):
+  return entity_availability(Venue, Show.venue_id, venue_id)
+
+@api.route('/venues/<int:venue_id>')
+@conditional(venue_last_modified)
+@read_only_view
+def show_venue(venue_id):
+  venue = venue_detail(venue_id)
+  if venue is None:
+    abort(404)
+  return json_response(sparse(venue._asdict()))
+
+#  Artists
+#  ----------------------------------------------------------------
+
+@api.route('/artists')
+@conditional(lambda: listing_state(Artist))
+@read_only_view
+def artists():
+  return entity_collection(ARTIST_FIELDS, Artist)
+
+@api.route('/artists/search')
+@conditional(lambda: listing_state(Artist))
+@read_only_view
+def search_artists():
+  results = current_app.extensions['search']['artists'].search(request.args.get('q', ''))
+  return json_response({"count": results.count, "data": results.data})
+
+@api.route('/artists/available')
+@conditional(lambda: listing_state(Artist, Show))
+@read_only_view
+def available_artists():
+  start, end = requested_window()
+  min_gap = requested_min_gap()
+  limit = requested_limit()
+  duration = show_duration(current_app.config)
+  query = db.session.query(Artist.id, Artist.name)
+  if request.args.get('unbooked') == '1':
+    query = query.filter(unbooked(Artist, Show.artist_id, start, end, duration))
+  after = requested_after()
+  if after is not None:
+    query = query.filter(Artist.id > after)
+  page, next_cursor = page_of(query.order_by(Artist.id).limit(limit + 1).all(), limit)
+
+  # the shows of the whole page in one range query, then each artist's gaps from its timeline
+  timelines = busy_times(Show.artist_id, [row.id for row in page], start, end, duration) if page else {}
+  data = []
+  for row in page:
+    gaps = timelines[row.id].gaps(start, end, min_gap)
+    if gaps:
+      data.append({"id": row.id, "name": row.name, "gaps": gaps})
+  return json_response({"start": start, "end": end, "data": data, "next_cursor": next_cursor})
+
+@api.route('/artists/<int:artist_id>/availability')
+@conditional(artist_last_modified)
+@read_only_view
+def artist_availability(artist_id):
+  return entity_availability(Artist, Show.artist_id, artist_id)
+
+@api.route('/artists/<int:artist_id>')
+@conditional(artist_last_modified)
+@read_only_view
+def show_artist(artist_id):
+  artist = artist_detail(artist_id)
+  if artist is None:
+    abort(404)
+  return json_response(sparse(artist._asdict()))
+
+#  Shows
+#  ----------------------------------------------------------------
+
+@api.route('/shows')
+@conditional(lambda: listing_state(Show, Venue, Artist, started=request.args.get('upcoming') == '1'))
+@read_only_view
+def shows():
+  fields = requested_fields(SHOW_FIELDS)
+  limit = requested_limit()
+  try:
+    after = decode_show_cursor(request.args.get('after'))
+  except ValueError:
+    abort(400, 'malformed cursor')
+  rows = show_listing_query(request.args.get('upcoming') == '1', after).limit(limit + 1).yield_per(1000)
+  return stream_collection(rows, limit, fields, encode_show_cursor)
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+  return jsonify({"error": error.description}), error.code
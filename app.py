@@ -2,231 +2,289 @@
 # Imports
 #----------------------------------------------------------------------------#
 
-import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import os
+import functools
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, url_for, abort, jsonify, current_app, stream_with_context
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
 from forms import *
-from flask_migrate import Migrate
+from flask_migrate import Migrate, stamp
+from alembic.migration import MigrationContext
+from models import *
+from search import make_search_backend
+from geo import make_geo_backend, geocode_command, gazetteer
+from similarity import SimilarityIndex, build_similarity_command
+from viewmodels import *
+from queries import *
+from cache import make_page_cache, conditional_get, cached, page_cache
+from bulk import bulk_cli, VENUE_FIELDS, ARTIST_FIELDS
+from reports import reports_cli, REPORTS, SOURCES, report_window, run_report
+from editing import clean_changes, change_rows, delete_rows, update_entities, delete_entities
+from api import api
+from booking import book_shows, show_request, show_duration, ShowWriter
+from profiler import Profiler
+from metrics import Metrics
+from routing import init_routing
+from templating import init_templates
+import hmac
 import sys
+import ipaddress
+import time
+import click
+from flask.cli import with_appcontext
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# extensions are created here and bound to each app in create_app()
+moment = Moment()
+migrate = Migrate()
 
-# connect to a local postgresql database
+# per-request query/render/latency profile, see profiler.py
+profiler = Profiler()
+
+# prometheus counters, histograms and pool gauges for /metrics, see metrics.py
+metrics = Metrics()
+
+# every page and form lives on this blueprint; create_app() registers it
+main = Blueprint('main', __name__, cli_group=None)
+
+def create_app(config='config'):
+  # builds a configured app. nothing here touches the database: the schema is created by
+  # "flask db upgrade" (or "flask create-db" for a scratch database), not at import
+  app = Flask(__name__)
+  app.config.from_object(config)
+  moment.init_app(app)
+  db.init_app(app)
+  init_routing(app)
+  migrate.init_app(app, db)
+
+  # rendered page cache, see cache.py. CACHE_BACKEND in config.py picks the backend
+  app.extensions['page_cache'] = make_page_cache(app.config)
+
+  # search backends for the two search pages, chosen by SEARCH_BACKEND in config.py
+  app.extensions['search'] = {
+    'venues': make_search_backend(app.config['SEARCH_BACKEND'], db, Venue, app.config['SEARCH_RESULT_LIMIT']),
+    'artists': make_search_backend(app.config['SEARCH_BACKEND'], db, Artist, app.config['SEARCH_RESULT_LIMIT'])
+  }
+
+  # venue proximity search, chosen by GEO_BACKEND in config.py
+  app.extensions['geo'] = make_geo_backend(app.config['GEO_BACKEND'], db, Venue, app.config['GEO_CELL_DEGREES'])
+
+  # similar artists and venues, built offline, see similarity.py
+  app.extensions['similarity'] = SimilarityIndex(app.config['SIMILARITY_PATH'])
+
+  # queued show bookings, see booking.py
+  app.extensions['show_writer'] = ShowWriter(app, app.config['SHOW_WRITE_BATCH_SIZE']) if app.config['SHOW_WRITE_QUEUE'] else None
+
+  profiler.init_app(app)
+  metrics.init_app(app, db)
+
+  app.add_template_filter(format_datetime, 'datetime')
+  app.register_blueprint(main)
+  # json api under /api/v1, see api.py
+  app.register_blueprint(api)
+  app.cli.add_command(bulk_cli)
+  app.cli.add_command(reports_cli)
+  app.cli.add_command(create_db_command)
+  app.cli.add_command(geocode_command)
+  app.cli.add_command(build_similarity_command)
+  app.cli.add_command(rollover_show_counts_command)
+  app.cli.add_command(check_show_counts_command)
+  configure_logging(app)
+
+  # bytecode cache, {% cache %} fragments and warmup, see templating.py
+  init_templates(app)
+  return app
+
+def add_file_handler(logger, path, formatter, level):
+  # create_app() may run more than once in a process (tests, benchmarks); loggers are global
+  path = os.path.abspath(path)
+  if any(isinstance(handler, FileHandler) and handler.baseFilename == path for handler in logger.handlers):
+    return
+  handler = FileHandler(path)
+  handler.setFormatter(formatter)
+  handler.setLevel(level)
+  logger.addHandler(handler)
+
+def configure_logging(app):
+  if not app.debug:
+    app.logger.setLevel(logging.INFO)
+    add_file_handler(app.logger, 'error.log',
+      Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'), logging.INFO)
+    app.logger.info('errors')
+
+  # structured profiler records, one JSON object per line
+  if app.config['PROFILER_ENABLED'] and app.config['PROFILER_LOG']:
+    profile_logger = logging.getLogger('fyyur.profiler')
+    profile_logger.setLevel(app.config['PROFILER_LOG_LEVEL'])
+    add_file_handler(profile_logger, app.config['PROFILER_LOG'], Formatter('%(message)s'), logging.NOTSET)
 
 #----------------------------------------------------------------------------#
-# Models.
+# Commands.
 #----------------------------------------------------------------------------#
 
-class Venue(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String())
-    genres = db.Column(db.String())
-    address = db.Column(db.String())
-    city = db.Column(db.String())
-    state = db.Column(db.String())
-    phone = db.Column(db.String())
-    website = db.Column(db.String())
-    image_link = db.Column(db.String())
-    facebook_link = db.Column(db.String())
-    seeking_talent = db.Column(db.Boolean(),default=False)
-    seeking_description = db.Column(db.String())
-
-    # build the venue to show relationship
-    venue_shows = db.relationship('Show', cascade="all,delete", backref='venue', lazy=True)
-
-    # implement any missing fields, as a database migration using Flask-Migrate
-
-class Artist(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String())
-    city = db.Column(db.String())
-    state = db.Column(db.String())
-    phone = db.Column(db.String())
-    website = db.Column(db.String())
-    genres = db.Column(db.String())
-    image_link = db.Column(db.String())
-    facebook_link = db.Column(db.String())
-    seeking_venue = db.Column(db.Boolean(),default=False)
-    seeking_description = db.Column(db.String())
-
-    # build the artist to show relationship
-    artist_shows = db.relationship('Show', cascade="all,delete", backref='artist', lazy=True)
-
-    # implement any missing fields, as a database migration using Flask-Migrate
-
-# Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
-
-# build the show class with foreign keys on both artist and venue
-class Show(db.Model):
-    __tablename__ = 'show'
-    id = db.Column('id', db.Integer, primary_key=True)
-    artist_id = db.Column('artist_id', db.Integer, db.ForeignKey('artist.id'))
-    venue_id = db.Column('venue_id', db.Integer, db.ForeignKey('venue.id'))
-    start_time = db.Column('start_time', db.DateTime, nullable=False)
-
-db.create_all()
+@click.command('create-db')
+@with_appcontext
+def create_db_command():
+  """Create the tables straight from the models and mark the database as migrated to the newest revision."""
+  # a database already under migrations is only brought forward by its revisions: create_all would
+  # add missing tables but not columns, and stamping it would skip the revisions still to run
+  with db.engine.connect() as connection:
+    revision = MigrationContext.configure(connection).get_current_revision()
+  if revision is not None:
+    raise click.ClickException('%r is already at revision %s, run "flask db upgrade" instead' % (db.engine.url, revision))
+  db.create_all()
+  # the tables now match the newest revision, so a later "flask db upgrade" starts from there
+  stamp()
+  click.echo('created the tables in %r at the newest revision' % (db.engine.url,))
+
+@click.command('rollover-show-counts')
+@click.option('--every', type=int, default=0, help='Keep running, rolling over every N seconds.')
+@with_appcontext
+def rollover_show_counts_command(every):
+  """Move shows that have started from the upcoming to the past counters."""
+  while True:
+    moved = rollover_show_counters()
+    click.echo('moved %d shows from upcoming to past' % moved)
+    if not every:
+      break
+    time.sleep(every)
+
+@click.command('check-show-counts')
+@click.option('--fix', is_flag=True, help='Rewrite counters that disagree with the show table.')
+@with_appcontext
+def check_show_counts_command(fix):
+  """Compare the denormalized show counters with the show table."""
+  failed = False
+  for model in (Venue, Artist):
+    mismatches = show_counter_mismatches(model, fix=fix)
+    for row in mismatches:
+      click.echo('%s %d: stored upcoming=%d past=%d, actual upcoming=%d past=%d' % ((model.__tablename__,) + tuple(row)))
+    click.echo('%s: %d mismatched rows%s' % (model.__tablename__, len(mismatches), ' fixed' if fix and mismatches else ''))
+    failed = failed or (bool(mismatches) and not fix)
+  if failed:
+    sys.exit(1)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# babel and dateutil are imported on first use rather than at startup: most workers format their
+# first date well after boot, and neither is needed to serve a cached or 304 response
+
+@functools.lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # babel pattern and locale are parsed once per (format, locale) instead of on every call
+  import babel.dates
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale or babel.dates.LC_TIME)
+
+@functools.lru_cache(maxsize=4096)
+def cached_format_datetime(value, format, locale):
+  # the same show times repeat across pages and requests, so the formatted strings are memoized
+  pattern, locale = datetime_pattern(format, locale)
+  return pattern.apply(value, locale)
+
+def format_datetime(value, format='medium', locale=None):
+  # views pass datetime objects straight through; strings are still accepted and parsed
+  if isinstance(value, str):
+    import dateutil.parser
+    value = dateutil.parser.parse(value)
+  return cached_format_datetime(value, format, locale)
+
+#----------------------------------------------------------------------------#
+# Edits.
+#----------------------------------------------------------------------------#
 
-app.jinja_env.filters['datetime'] = format_datetime
+def submitted_changes(entity_id, fields):
+  # the edit form's fields that were posted, with the version the page was rendered at. the genres
+  # select posts nothing when it is emptied, so it always counts as submitted
+  row = dict((name, request.form.get(name)) for name in fields if name in request.form)
+  row['genres'] = request.form.getlist('genres')
+  row['id'] = entity_id
+  row['version'] = request.form.get('version')
+  return row
+
+def delete_response(entity, entity_id):
+  # DELETE of one venue or artist, with ?version= to refuse it if the row was edited since
+  result = delete_entities(entity, [{'id': entity_id, 'version': request.args.get('version', type=int)}])
+  if result['missing']:
+    abort(404)
+  if result['conflicts']:
+    return jsonify({'success': False, 'error': 'changed since version %s' % request.args['version']}), 409
+  return jsonify({'success': True, 'shows_deleted': result['shows']})
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@main.route('/')
 def index():
   return render_template('pages/home.html')
 
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@main.route('/venues')
+@conditional_get(cache_control='LISTING_PAGE_CACHE_CONTROL')
+@cached('venues')
+@read_only_view
 def venues():
-  # replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-
-  # pain in the butt to figure out, but this query gets me the 'headers' for each city state breakdown to start our data up
-  query = db.session.query(Venue.city, Venue.state).distinct().order_by(Venue.city).order_by(Venue.state)
-
-  # lets start our new data array
-  data = []
-  # loop through combos of city state
-  for city_state_combo in query:
-
-    # set city state to variable for readibility in next query
-    distinct_city = city_state_combo.city
-    distinct_state = city_state_combo.state
-
-    # query venue table WHERE city and state match previous result
-    query2 = db.session.query(Venue).filter(Venue.city == distinct_city, Venue.state == distinct_state).all()
-
-    # start new empty venue object
-    venues = []
-
-    # loop through venues only found in city state match
-    for venue in query2:
-      # build new venue object and append to root venues object
-      venue = {
-        "id": venue.id,
-        "name": venue.name,
-        "num_upcoming_shows": 0
-      }
-      venues.append(venue)
-
-    # now we can build the root venue object using the city, state, and venues object we built previously
-    root_venue_object = {
-      "city": distinct_city,
-      "state": distinct_state,
-      "venues": venues
-    }
-    
-    # add each root object to the root data being passed to the template
-    data.append(root_venue_object)
-
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
+  # one query gets every venue with its number of upcoming shows, instead of one query per city/state combo
+  rows = upcoming_shows_per_venue().all()
+
+  return render_template('pages/venues.html', areas=group_venues_by_area(rows))
+
+@main.route('/venues/genre/<genre_name>')
+@conditional_get(cache_control='LISTING_PAGE_CACHE_CONTROL')
+@cached('{genre_name}', namespace='venues_by_genre')
+@read_only_view
+def venues_by_genre(genre_name):
+  # same areas listing as /venues, restricted through the venue_genres index
+  rows = upcoming_shows_per_venue() \
+    .join(venue_genres, venue_genres.c.venue_id == Venue.id) \
+    .join(Genre, Genre.id == venue_genres.c.genre_id) \
+    .filter(Genre.name == genre_name) \
+    .all()
+
+  return render_template('pages/venues.html', areas=group_venues_by_area(rows), genre=genre_name)
+
+@main.route('/venues/search', methods=['POST'])
+@read_only_view
 def search_venues():
-  # implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  # build query using generic like - using ilike for insensitive case
-  venues = db.session.query(Venue).filter(Venue.name.ilike('%' + request.form.get('search_term') + '%')).all()
-  # get count of query for returned number
-  search_count = db.session.query(Venue).filter(Venue.name.ilike('%' + request.form.get('search_term') + '%')).count()
-  # build response object template is expecting
-  response={
-    "count": search_count,
-    "data": venues
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
-
-@app.route('/venues/<int:venue_id>')
+  # partial, case-insensitive search - results and count come back from one query (see search.py)
+  search_term = request.form.get('search_term', '')
+  response = current_app.extensions['search']['venues'].search(search_term)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+@main.route('/venues/<int:venue_id>')
+@conditional_get(venue_last_modified, 'ENTITY_PAGE_CACHE_CONTROL')
+@cached('venue:{venue_id}')
+@read_only_view
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # replace with real venue data from the venues table, using venue_id
-  # get venue by venue_id
-  venue = db.session.query(Venue).get(venue_id)
-  # query Show table using venue id and < current time to get past shows
-  past_shows = db.session.query(Show).filter(Show.venue_id == venue_id, Show.start_time < datetime.now()).all()
-  # query Show table using venue id and > current time to get upcoming shows
-  upcoming_shows = db.session.query(Show).filter(Show.venue_id == venue_id, Show.start_time > datetime.now()).all()
-  # query show table using venue id and < current time to get past show count
-  past_shows_count = db.session.query(Show).filter(Show.venue_id == venue_id, Show.start_time < datetime.now()).count()
-  # query show table using venue id and > current time to get upcoming show count
-  upcoming_shows_count = db.session.query(Show).filter(Show.venue_id == venue_id, Show.start_time > datetime.now()).count()
-  # do some string operations to clean the genres data stored to match the formatting of the demo data
-  convert_genres = str(venue.genres).replace("{",'').replace("}","").split(",")
-
-  # assemble the new data object using the above queries
-  data = {
-    "id": venue.id,
-    "name": venue.name,
-    "genres": convert_genres,
-    "address": venue.address,
-    "city": venue.city,
-    "state": venue.state,
-    "phone": venue.phone,
-    "website": venue.website,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.seeking_talent,
-    "seeking_description": venue.seeking_description,
-    "image_link": venue.image_link,
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": past_shows_count,
-    "upcoming_shows_count": upcoming_shows_count
-  }
+  data = venue_detail(venue_id)
+  if data is None:
+    abort(404)
 
-  # loop through past shows and cast the timestamps as strings
-  for past_show in past_shows:
-    past_show.start_time = str(past_show.start_time)
-    past_show.artist_image_link = db.session.query(Artist).get(past_show.artist_id).image_link
-    data['past_shows'].append(past_show)
-
-  # loop through upcoming shows and cast the timestamps as strings
-  for upcoming_show in upcoming_shows:
-    upcoming_show.start_time = str(upcoming_show.start_time)
-    upcoming_show.artist_image_link = db.session.query(Artist).get(upcoming_show.artist_id).image_link
-    data['upcoming_shows'].append(upcoming_show)
-
-  #sys.stdout.flush()   
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
 
   try:
@@ -250,9 +308,16 @@ def create_venue_submission():
       seeking_talent = False
 
     # build the actual venue item and commit it
-    venue = Venue(name=name, address=address, city=city, state=state, phone=phone, seeking_talent=seeking_talent, seeking_description=seeking_description, website=website, facebook_link=facebook_link, image_link=image_link, genres=genres)
+    venue = Venue(name=name, address=address, city=city, state=state, phone=phone, seeking_talent=seeking_talent, seeking_description=seeking_description, website=website, facebook_link=facebook_link, image_link=image_link, genres=genres_from_names(genres))
+    # located from the bundled gazetteer, an in-memory lookup (see geo.py)
+    location = gazetteer.lookup(city, state)
+    if location is not None:
+      venue.latitude, venue.longitude = location[:2]
     db.session.add(venue)
     db.session.commit()
+    current_app.extensions['search']['venues'].add(venue.id, venue.name)
+    current_app.extensions['geo'].add(venue.id, venue.latitude, venue.longitude)
+    page_cache.invalidate(keys=['venues'], namespaces=['venues_by_genre'])
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   except:
@@ -264,49 +329,55 @@ def create_venue_submission():
   # modify data to be the data object returned from db insertion
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-  # TODO: Complete this endpoint for taking a venue_id, and using
-  # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-
-  # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
-  # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+  # the venue goes with its shows and genre links, see editing.py
+  return delete_response('venues', venue_id)
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@main.route('/artists')
+@conditional_get(cache_control='LISTING_PAGE_CACHE_CONTROL')
+@cached('artists')
+@read_only_view
 def artists():
-  # replace with real data returned from querying the database
-  artists = Artist.query.all()
+  # only the columns the listing shows
+  artists = [ArtistSummary.from_row(row) for row in db.session.query(Artist.id, Artist.name).order_by(Artist.id)]
 
   return render_template('pages/artists.html', artists=artists)
 
-@app.route('/artists/search', methods=['POST'])
+@main.route('/artists/genre/<genre_name>')
+@conditional_get(cache_control='LISTING_PAGE_CACHE_CONTROL')
+@cached('{genre_name}', namespace='artists_by_genre')
+@read_only_view
+def artists_by_genre(genre_name):
+  # artists listing restricted through the artist_genres index
+  artists = db.session.query(Artist.id, Artist.name) \
+    .join(artist_genres, artist_genres.c.artist_id == Artist.id) \
+    .join(Genre, Genre.id == artist_genres.c.genre_id) \
+    .filter(Genre.name == genre_name) \
+    .order_by(Artist.name)
+  artists = [ArtistSummary.from_row(row) for row in artists]
+
+  return render_template('pages/artists.html', artists=artists, genre=genre_name)
+
+@main.route('/artists/search', methods=['POST'])
+@read_only_view
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  # build query using generic like - using ilike for insensitive case
-  artists = db.session.query(Artist).filter(Artist.name.ilike('%' + request.form.get('search_term') + '%')).all()
-  # get count of query for returned number
-  search_count = db.session.query(Artist).filter(Artist.name.ilike('%' + request.form.get('search_term') + '%')).count()
-  # build response object template is expecting
-  response={
-    "count": search_count,
-    "data": artists
-  }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  # partial, case-insensitive search - results and count come back from one query (see search.py)
+  search_term = request.form.get('search_term', '')
+  response = current_app.extensions['search']['artists'].search(search_term)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # insert form data as a new Venue record in the db, instead
@@ -327,9 +398,11 @@ def create_artist_submission():
     else:
       seeking_venue = False
 
-    artist = Artist(name=name, city=city, state=state, phone=phone, facebook_link=facebook_link, image_link=image_link, genres=genres, website=website, seeking_venue=seeking_venue, seeking_description=seeking_description)
+    artist = Artist(name=name, city=city, state=state, phone=phone, facebook_link=facebook_link, image_link=image_link, genres=genres_from_names(genres), website=website, seeking_venue=seeking_venue, seeking_description=seeking_description)
     db.session.add(artist)
     db.session.commit()
+    current_app.extensions['search']['artists'].add(artist.id, artist.name)
+    page_cache.invalidate(keys=['artists'], namespaces=['artists_by_genre'])
     # on successful db insert, flash success
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except:
@@ -344,180 +417,272 @@ def create_artist_submission():
 
 
 
-@app.route('/artists/<int:artist_id>')
+@main.route('/artists/<int:artist_id>')
+@conditional_get(artist_last_modified, 'ENTITY_PAGE_CACHE_CONTROL')
+@cached('artist:{artist_id}')
+@read_only_view
 def show_artist(artist_id):
-  # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
   # shows the artist page with the given artist_id
-  # replace with real artist data from the artist table, using artist_id
-  # get artist by artist_id
-  artist = db.session.query(Artist).get(artist_id)
-  # query Show table using artist id and < current time to get past shows
-  past_shows = db.session.query(Show).filter(Show.artist_id == artist_id, Show.start_time < datetime.now()).all()
-  # query Show table using artist id and > current time to get upcoming shows
-  upcoming_shows = db.session.query(Show).filter(Show.artist_id == artist_id, Show.start_time > datetime.now()).all()
-  # query show table using artist id and < current time to get past show count
-  past_shows_count = db.session.query(Show).filter(Show.artist_id == artist_id, Show.start_time < datetime.now()).count()
-  # query show table using artist id and > current time to get upcoming show count
-  upcoming_shows_count = db.session.query(Show).filter(Show.artist_id == artist_id, Show.start_time > datetime.now()).count()
-  # do some string operations to clean the genres data stored to match the formatting of the demo data
-  convert_genres = str(artist.genres).replace("{",'').replace("}","").split(",")
-
-  # assemble the new data object using the above queries
-  data = {
-    "id": artist.id,
-    "name": artist.name,
-    "genres": convert_genres,
-    "city": artist.city,
-    "state": artist.state,
-    "phone": artist.phone,
-    "website": artist.website,
-    "facebook_link": artist.facebook_link,
-    "seeking_venue": artist.seeking_venue,
-    "seeking_description": artist.seeking_description,
-    "image_link": artist.image_link,
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": past_shows_count,
-    "upcoming_shows_count": upcoming_shows_count
-  }
-
-  # loop through past shows and cast the timestamps as strings
-  for past_show in past_shows:
-    past_show.start_time = str(past_show.start_time)
-    past_show.venue_image_link = db.session.query(Venue).get(past_show.venue_id).image_link
-    data['past_shows'].append(past_show)
+  data = artist_detail(artist_id)
+  if data is None:
+    abort(404)
 
-  # loop through upcoming shows and cast the timestamps as strings
-  for upcoming_show in upcoming_shows:
-    upcoming_show.start_time = str(upcoming_show.start_time)
-    upcoming_show.venue_image_link = db.session.query(Venue).get(upcoming_show.venue_id).image_link
-    data['upcoming_shows'].append(upcoming_show)
-
-  #sys.stdout.flush()   
   return render_template('pages/show_artist.html', artist=data)
 
+@main.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+  return delete_response('artists', artist_id)
+
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  form = ArtistForm()
-
   artist = db.session.query(Artist).get(artist_id)
+  if artist is None:
+    abort(404)
 
-  # TODO: populate form with fields from artist with ID <artist_id>
+  # the page carries the artist's version, so saving it over someone else's edit is refused
+  form = ArtistForm(obj=artist)
+  form.genres.data = [genre.name for genre in artist.genres]
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-  # TODO: take values from the form submitted, and update existing
-  # artist record with ID <artist_id> using the new attributes
-
-  return redirect(url_for('show_artist', artist_id=artist_id))
-
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+  changes, errors = clean_changes('artists', submitted_changes(artist_id, ARTIST_FIELDS))
+  if errors:
+    flash('Artist was NOT updated: ' + '; '.join('%s: %s' % (name, ' '.join(problems)) for name, problems in sorted(errors.items())))
+    return redirect(url_for('main.edit_artist', artist_id=artist_id))
+  result = update_entities('artists', [changes])
+  if result['missing']:
+    abort(404)
+  if result['conflicts']:
+    flash('Artist was changed by someone else since you opened it. Review the current details and save again.')
+    return redirect(url_for('main.edit_artist', artist_id=artist_id))
+  flash('Artist ' + request.form.get('name', '') + ' was successfully updated!')
+  return redirect(url_for('main.show_artist', artist_id=artist_id))
+
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  form = VenueForm()
-
   venue = db.session.query(Venue).get(venue_id)
-  
-  # TODO: populate form with values from venue with ID <venue_id>
+  if venue is None:
+    abort(404)
+
+  form = VenueForm(obj=venue)
+  form.genres.data = [genre.name for genre in venue.genres]
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-  # TODO: take values from the form submitted, and update existing
-  # venue record with ID <venue_id> using the new attributes
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  changes, errors = clean_changes('venues', submitted_changes(venue_id, VENUE_FIELDS))
+  if errors:
+    flash('Venue was NOT updated: ' + '; '.join('%s: %s' % (name, ' '.join(problems)) for name, problems in sorted(errors.items())))
+    return redirect(url_for('main.edit_venue', venue_id=venue_id))
+  result = update_entities('venues', [changes])
+  if result['missing']:
+    abort(404)
+  if result['conflicts']:
+    flash('Venue was changed by someone else since you opened it. Review the current details and save again.')
+    return redirect(url_for('main.edit_venue', venue_id=venue_id))
+  flash('Venue ' + request.form.get('name', '') + ' was successfully updated!')
+  return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@main.route('/shows')
+@conditional_get(cache_control='LISTING_PAGE_CACHE_CONTROL')
+@cached(lambda: request.query_string.decode('utf-8'), namespace='shows')
+@read_only_view
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  query=Show.query.all()
+  # displays list of shows at /shows, one page at a time.
+  # keyset pagination on (start_time, id) means page 500 costs the same as page 1 - no OFFSET scans
+  per_page = current_app.config['SHOWS_PER_PAGE']
+  upcoming_only = request.args.get('upcoming') == '1'
+  try:
+    after = decode_show_cursor(request.args.get('after'))
+  except ValueError:
+    abort(400)
 
-  # loop through to build new data array
+  # one extra row tells us whether there is a next page without a count query
+  rows = show_listing_query(upcoming_only, after).limit(per_page + 1).all()
 
-  data = []
+  next_url = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_url = url_for('main.shows', after=encode_show_cursor(rows[-1]), upcoming='1' if upcoming_only else None)
 
-  for show in query:
-    show = {
-      "venue_id": show.venue_id,
-      "venue_name": db.session.query(Venue).get(show.venue_id).name,
-      "artist_id": show.artist_id,
-      "artist_name": db.session.query(Artist).get(show.artist_id).name,
-      "artist_image_link": db.session.query(Artist).get(show.artist_id).image_link,
-      "start_time": str(show.start_time)
-    }
-    data.append(show)
+  data = [ShowListing.from_row(show) for show in rows]
 
-  return render_template('pages/shows.html', shows=data)
+  return render_template('pages/shows.html', shows=data, next_url=next_url, upcoming_only=upcoming_only)
 
-@app.route('/shows/create')
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@main.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
-  artist_id = request.form.get('artist_id')
-  venue_id = request.form.get('venue_id')
-  start_time = request.form.get('start_time')
-
-
-  show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
-
-  db.session.add(show)
-  db.session.commit()
-
+  form = ShowForm()
+  if not form.validate():
+    for field, errors in form.errors.items():
+      for error in errors:
+        flash(error if field != 'csrf_token' else 'The form expired, please submit it again.')
+    return render_template('forms/new_show.html', form=form)
+
+  # existence and double-booking checks happen in booking.py, in the same transaction as the insert
+  show = show_request(form.data)
+  show_writer = current_app.extensions['show_writer']
+  if show_writer is not None:
+    show_writer.submit(show)
+    flash('Show was submitted and will be listed shortly.')
+    return render_template('pages/home.html')
 
+  try:
+    error, = book_shows([show], show_duration(current_app.config))
+  except Exception:
+    current_app.logger.exception('listing show %r failed', show)
+    db.session.rollback()
+    error = 'An error occurred. Show could not be listed.'
+  if error is not None:
+    flash(error)
+    return render_template('forms/new_show.html', form=form)
 
   # on successful db insert, flash success
   flash('Show was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Show could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
-@app.errorhandler(404)
+#  Admin
+#  ----------------------------------------------------------------
+
+def bearer_matches(token):
+  # whether the request carries "Authorization: Bearer <token>"; never for an empty token
+  supplied = request.headers.get('Authorization', '')
+  return bool(token) and hmac.compare_digest(supplied.encode('utf-8'), ('Bearer ' + token).encode('utf-8'))
+
+def admin_only(view):
+  # ADMIN_TOKEN as a bearer token. without a configured token the endpoints are closed, debug mode or not
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    if not bearer_matches(current_app.config['ADMIN_TOKEN']):
+      abort(403)
+    return view(*args, **kwargs)
+  return wrapper
+
+def metrics_only(view):
+  # /metrics has its own rule, apart from the admin endpoints, so a scraper needs no ADMIN_TOKEN:
+  # METRICS_TOKEN as a bearer token when one is set, otherwise clients on METRICS_ALLOW_NETWORKS
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+      allowed = bearer_matches(token)
+    else:
+      try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+      except ValueError:
+        address = None
+      allowed = address is not None and any(address in ipaddress.ip_network(network)
+        for network in current_app.config['METRICS_ALLOW_NETWORKS'])
+    if not allowed:
+      abort(403)
+    return view(*args, **kwargs)
+  return wrapper
+
+@main.route('/admin/cache-stats')
+@admin_only
+def cache_stats():
+  # hit/miss counters for this worker's view of the page cache
+  return jsonify(page_cache.get_stats())
+
+@main.route('/admin/profile')
+@admin_only
+def profile_stats():
+  # per-route latency, db time, render time and query count percentiles for this worker
+  return jsonify(profiler.get_stats())
+
+@main.route('/admin/reports/<name>')
+@admin_only
+def report(name):
+  # booking reports (reports.py), streamed as they are read. ?start=&end= are ISO dates, end exclusive;
+  # ?source=live sums the show table instead of the daily rollups; ?format=json for dashboards
+  if name not in REPORTS:
+    abort(404)
+  source = request.args.get('source', 'rollup')
+  fmt = request.args.get('format', 'csv')
+  if source not in SOURCES or fmt not in ('csv', 'json'):
+    abort(400)
+  try:
+    start, end = report_window(request.args.get('start'), request.args.get('end'), current_app.config['REPORTS_DEFAULT_DAYS'])
+  except ValueError:
+    abort(400)
+  chunks = run_report(name, source, start, end, current_app.config['REPORTS_BATCH_SIZE'], fmt)
+  def generate():
+    # the query runs here, after the view has returned, so it is marked read-only again
+    with reading():
+      for chunk in chunks:
+        yield chunk
+  if fmt == 'json':
+    return Response(stream_with_context(generate()), mimetype='application/json')
+  return Response(stream_with_context(generate()), mimetype='text/csv',
+    headers={'Content-Disposition': 'attachment; filename=%s.csv' % name})
+
+@main.route('/admin/<any(venues, artists):entity>/update', methods=['POST'])
+@admin_only
+def batch_update(entity):
+  # a JSON list of {"id": ..., "version": ... (optional), <changed fields>}, applied in chunked
+  # transactions; invalid rows are reported by position and skipped
+  rows = request.get_json(silent=True)
+  if not isinstance(rows, list):
+    abort(400)
+  changes, errors = change_rows(entity, rows)
+  result = update_entities(entity, changes)
+  result['rejected'] = [{'row': line, 'errors': problems} for line, problems in errors]
+  return jsonify(result)
+
+@main.route('/admin/<any(venues, artists):entity>/delete', methods=['POST'])
+@admin_only
+def batch_delete(entity):
+  # a JSON list of ids or of {"id": ..., "version": ...}; each goes with its shows and genre links
+  rows = request.get_json(silent=True)
+  if not isinstance(rows, list):
+    abort(400)
+  cleaned, errors = delete_rows(rows)
+  result = delete_entities(entity, cleaned)
+  result['rejected'] = [{'row': line, 'errors': problems} for line, problems in errors]
+  return jsonify(result)
+
+@main.route('/metrics')
+@metrics_only
+def metrics_endpoint():
+  # prometheus text format, summed over threads and, with METRICS_DIR, over worker processes
+  return metrics.response()
+
+@main.app_errorhandler(404)
 def not_found_error(error):
+    metrics.count_error(404)
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def server_error(error):
+    metrics.count_error(500)
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
@@ -0,0 +1,103 @@
+#----------------------------------------------------------------------------#
+# Venue and artist availability.
+#
+# A show keeps its venue and artist busy for SHOW_DURATION minutes from its
+# start, the same rule booking.py enforces, so a show overlaps the window
+# [start, end) exactly when it starts after start - SHOW_DURATION and
+# before end. Every question here is therefore a start_time range query
+# over the (venue_id, start_time) or (artist_id, start_time) index:
+#
+#   free_venues  - venues in a city with no show overlapping the window,
+#                  one anti-join; the database probes the venue's index
+#                  range for each venue of the city
+#   busy_times   - the shows of a page of venues or artists inside the
+#                  window, one query, folded into a Timeline per entity
+#
+# A Timeline holds an entity's busy intervals merged and sorted; a bisect
+# finds the first one touching a window and the free gaps come out in one
+# pass. Every show lasts as long as every other, so a sorted list of merged
+# intervals answers what an interval tree would, without the tree.
+#----------------------------------------------------------------------------#
+
+import bisect
+import itertools
+from datetime import datetime, timedelta
+
+from models import *
+
+
+class Timeline(object):
+  # busy [start, end) intervals, merged and sorted by start
+  def __init__(self):
+    self.starts = []
+    self.ends = []
+
+  @classmethod
+  def from_starts(cls, start_times, duration):
+    # start times in ascending order, as the index returns them, merge in a single pass
+    timeline = cls()
+    for start_time in start_times:
+      end_time = start_time + duration
+      if timeline.ends and timeline.ends[-1] >= start_time:
+        timeline.ends[-1] = max(timeline.ends[-1], end_time)
+      else:
+        timeline.starts.append(start_time)
+        timeline.ends.append(end_time)
+    return timeline
+
+  def intervals(self):
+    return list(zip(self.starts, self.ends))
+
+  def gaps(self, start, end, min_length=timedelta(0)):
+    # the free stretches of [start, end) at least min_length long, in order
+    gaps = []
+    cursor = start
+    # the intervals are disjoint, so their ends are sorted too
+    for i in range(bisect.bisect_right(self.ends, start), len(self.starts)):
+      if self.starts[i] >= end:
+        break
+      if self.starts[i] > cursor:
+        gaps.append((cursor, self.starts[i]))
+      cursor = max(cursor, self.ends[i])
+    if cursor < end:
+      gaps.append((cursor, end))
+    return [gap for gap in gaps if gap[1] - gap[0] >= min_length]
+
+
+def day_window(day):
+  # a date's window runs from midnight to midnight
+  start = datetime(day.year, day.month, day.day)
+  return start, start + timedelta(days=1)
+
+
+def overlapping(start, end, duration):
+  # shows that overlap [start, end), as a start_time range
+  return db.and_(Show.start_time > start - duration, Show.start_time < end)
+
+
+def unbooked(model, column, start, end, duration):
+  # venues or artists (column being Show.venue_id or Show.artist_id) with no show overlapping
+  # [start, end)
+  return ~db.exists().where(db.and_(column == model.id, overlapping(start, end, duration)))
+
+
+def free_venues(city, state, start, end, duration, after=None, limit=100):
+  # venues of city/state with nothing booked in [start, end), in id order from after
+  query = db.session.query(Venue.id, Venue.name, Venue.address, Venue.city, Venue.state) \
+    .filter(Venue.city == city, Venue.state == state, unbooked(Venue, Show.venue_id, start, end, duration))
+  if after is not None:
+    query = query.filter(Venue.id > after)
+  return query.order_by(Venue.id).limit(limit)
+
+
+def busy_times(column, ids, start, end, duration):
+  # one query for the shows of all the given venues or artists that overlap [start, end), folded
+  # into a Timeline per id; ids without a show get an empty one
+  rows = db.session.query(column, Show.start_time) \
+    .filter(column.in_(ids), overlapping(start, end, duration)) \
+    .order_by(column, Show.start_time)
+  timelines = dict((entity_id, Timeline()) for entity_id in ids)
+  for entity_id, shows in itertools.groupby(rows, key=lambda row: row[0]):
+    timelines[entity_id] = Timeline.from_starts((row[1] for row in shows), duration)
+  return timelines
+
@@ -0,0 +1,128 @@
+# availability benchmark over synthetic data (datagen.py), 1M shows by default.
+# for random days and weeks inside the data's year, times each availability question as the api
+# answers it (availability.py: indexed range queries folded into timelines) against the per-entity
+# loop it replaces (one query per venue or artist), and checks both give the same answer.
+#   free venues    - the venues of the city with the most venues, free on a day
+#   artist gaps    - a page of 100 artists with their free gaps over a week
+#   one artist     - the busiest artist's gaps over AVAILABILITY_MAX_DAYS
+# the api routes are also timed end to end through the test client.
+#   python benchmarks/bench_availability.py [--venues N] [--artists N] [--shows N] [--queries N] [--seed N]
+
+import os
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+os.environ.setdefault('CACHE_BACKEND', 'none')
+
+from common import load_app, QueryCounter
+from datagen import generate, busiest
+
+
+def timed_each(func, arguments):
+  # milliseconds per call
+  started = time.perf_counter()
+  for argument in arguments:
+    func(argument)
+  return (time.perf_counter() - started) * 1000 / len(arguments)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=20000)
+  parser.add_argument('--artists', type=int, default=20000)
+  parser.add_argument('--shows', type=int, default=1000000)
+  parser.add_argument('--queries', type=int, default=50)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  app_module = load_app()
+  started = time.perf_counter()
+  counts = generate(app_module, options.venues, options.artists, options.shows, options.seed)
+  print('%(venues)d venues, %(artists)d artists, %(shows)d shows' % counts, 'generated in %.0f s' % (time.perf_counter() - started))
+
+  import availability
+  db, Venue, Artist, Show = app_module.db, app_module.Venue, app_module.Artist, app_module.Show
+  duration = timedelta(minutes=app_module.app.config['SHOW_DURATION'])
+  city, state = db.session.query(Venue.city, Venue.state).group_by(Venue.city, Venue.state) \
+    .order_by(db.func.count().desc()).limit(1).one()
+  city_venues = [venue_id for venue_id, in db.session.query(Venue.id).filter(Venue.city == city, Venue.state == state)]
+  artist_page = [artist_id for artist_id, in db.session.query(Artist.id).order_by(Artist.id).limit(100)]
+  artist_id = busiest(app_module, Show.artist_id)
+  max_days = app_module.app.config['AVAILABILITY_MAX_DAYS']
+
+  rnd = random.Random(options.seed)
+  today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+  days = [availability.day_window(today + timedelta(days=rnd.randint(-300, 300))) for i in range(options.queries)]
+  weeks = [(start, start + timedelta(days=7)) for start, end in days]
+
+  def indexed_free(window):
+    return set(row.id for row in availability.free_venues(city, state, window[0], window[1], duration, limit=len(city_venues) + 1))
+
+  def looped_free(window):
+    free = set()
+    for venue_id in city_venues:
+      if not db.session.query(Show.id).filter(Show.venue_id == venue_id,
+          availability.overlapping(window[0], window[1], duration)).first():
+        free.add(venue_id)
+    return free
+
+  def indexed_gaps(window):
+    timelines = availability.busy_times(Show.artist_id, artist_page, window[0], window[1], duration)
+    return dict((entity_id, timelines[entity_id].gaps(*window)) for entity_id in artist_page)
+
+  def looped_gaps(window):
+    gaps = {}
+    for entity_id in artist_page:
+      starts = [start for start, in db.session.query(Show.start_time).filter(Show.artist_id == entity_id,
+        availability.overlapping(window[0], window[1], duration)).order_by(Show.start_time)]
+      gaps[entity_id] = availability.Timeline.from_starts(starts, duration).gaps(*window)
+    return gaps
+
+  long_windows = [(start, start + timedelta(days=max_days)) for start, end in days[:10]]
+
+  def artist_timeline(window):
+    return availability.busy_times(Show.artist_id, [artist_id], window[0], window[1], duration)[artist_id].gaps(*window)
+
+  print('%-44s %12s %12s %10s' % ('question', 'indexed ms', 'looped ms', 'queries'))
+  mismatches = 0
+  engine = db.engine
+  for name, indexed, looped, windows in (
+      ('free venues of %d in %s, a day' % (len(city_venues), state), indexed_free, looped_free, days),
+      ('gaps of 100 artists, a week', indexed_gaps, looped_gaps, weeks),
+      ('gaps of the busiest artist, %d days' % max_days, artist_timeline, None, long_windows)):
+    with QueryCounter(engine) as counter:
+      indexed_ms = timed_each(indexed, windows)
+    looped_ms = None
+    if looped is not None:
+      looped_ms = timed_each(looped, windows[:5])
+      mismatches += sum(1 for window in windows[:5] if indexed(window) != looped(window))
+    print('%-44s %12.2f %12s %10d' % (name[:44], indexed_ms, '%.2f' % looped_ms if looped_ms is not None else '-',
+      counter.count // len(windows)))
+  print('indexed and looped answers %s' % ('agree' if not mismatches else 'differ on %d windows' % mismatches))
+
+  client = app_module.app.test_client()
+  day = days[0][0].date().isoformat()
+  routes = [
+    ('venues/available, a day', '/api/v1/venues/available?city=%s&state=%s&date=%s' % (city, state, day)),
+    ('artists/available, a day', '/api/v1/artists/available?date=%s' % day),
+    ('artists/available, a week, unbooked=1', '/api/v1/artists/available?start=%s&end=%s&unbooked=1' % (
+      weeks[0][0].isoformat(), weeks[0][1].isoformat())),
+    ('artists/<id>/availability, %d days' % max_days, '/api/v1/artists/%d/availability?start=%s&end=%s' % (
+      artist_id, long_windows[0][0].isoformat(), long_windows[0][1].isoformat())),
+  ]
+  print('%-44s %12s %8s' % ('route', 'ms', 'status'))
+  for name, route in routes:
+    client.get(route)
+    best = None
+    for i in range(5):
+      started = time.perf_counter()
+      response = client.get(route)
+      elapsed = (time.perf_counter() - started) * 1000
+      best = elapsed if best is None else min(best, elapsed)
+    print('%-44s %12.2f %8d' % (name, best, response.status_code))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,60 @@
+# micro-benchmark for the datetime template filter.
+# renders pages/shows.html with 10k shows using the original reparse-everything filter and the
+# current one (native datetimes, precompiled babel patterns, memoized output).
+#   python benchmarks/bench_datetime_filter.py [shows]
+
+import sys
+import random
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+from common import load_app, timed
+
+
+def original_format_datetime(value, format='medium'):
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format)
+
+
+def make_shows(count):
+  rnd = random.Random(42)
+  # shows start on the hour or half hour, like real listings, so times repeat across rows
+  start = datetime(2020, 1, 1, 18)
+  return [{
+    "venue_id": rnd.randint(1, 500),
+    "venue_name": "Venue",
+    "artist_id": rnd.randint(1, 500),
+    "artist_name": "Artist",
+    "artist_image_link": "https://example.com/a.jpg",
+    "start_time": start + timedelta(minutes=30 * rnd.randint(0, 2000))
+  } for i in range(count)]
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  app_module = load_app()
+  flask_app = app_module.app
+  shows = make_shows(count)
+  stringified = [dict(show, start_time=str(show['start_time'])) for show in shows]
+
+  def render(filter_func, rows):
+    flask_app.jinja_env.filters['datetime'] = filter_func
+    with flask_app.test_request_context('/shows'):
+      app_module.render_template('pages/shows.html', shows=rows, next_url=None, upcoming_only=False)
+
+  print('%d shows through pages/shows.html' % count)
+  print('%-28s %10.1f ms' % ('original (str + reparse)', timed(lambda: render(original_format_datetime, stringified), repeat=3)))
+  app_module.cached_format_datetime.cache_clear()
+  print('%-28s %10.1f ms' % ('current, cold cache', timed(lambda: render(app_module.format_datetime, shows), repeat=1)))
+  print('%-28s %10.1f ms' % ('current, warm cache', timed(lambda: render(app_module.format_datetime, shows), repeat=3)))
+  flask_app.jinja_env.filters['datetime'] = app_module.format_datetime
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,75 @@
+# edit and delete benchmark over synthetic data (datagen.py).
+#   update  - --count venues renamed and moved through update_entities (one executemany per batch)
+#             against the same edits made one orm object at a time
+#   delete  - --count artists deleted with their shows through delete_entities (set-based deletes)
+#             against session.delete(), whose cascade loads every show first
+# both delete paths must leave the show counters matching the show table.
+#   python benchmarks/bench_editing.py [--venues N] [--artists N] [--shows N] [--count N] [--seed N]
+
+import time
+import random
+import argparse
+
+from common import load_app, QueryCounter
+from datagen import generate
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=20000)
+  parser.add_argument('--artists', type=int, default=20000)
+  parser.add_argument('--shows', type=int, default=200000)
+  parser.add_argument('--count', type=int, default=2000)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  app_module = load_app()
+  counts = generate(app_module, options.venues, options.artists, options.shows, options.seed)
+  print('%(venues)d venues, %(artists)d artists, %(shows)d shows' % counts)
+  from editing import update_entities, delete_entities
+  from models import show_counter_mismatches
+  db, Venue, Artist = app_module.db, app_module.Venue, app_module.Artist
+  engine = db.engine
+
+  rnd = random.Random(options.seed)
+  venue_ids = rnd.sample(range(1, counts['venues'] + 1), 2 * options.count)
+  artist_ids = rnd.sample(range(1, counts['artists'] + 1), 2 * options.count)
+  print('%-44s %10s %10s' % ('%d entities' % options.count, 'seconds', 'queries'))
+
+  rows = [{'id': venue_id, 'version': 1, 'name': 'Renamed %d' % venue_id, 'city': 'Austin', 'state': 'TX'}
+    for venue_id in venue_ids[:options.count]]
+  with QueryCounter(engine) as counter:
+    started = time.perf_counter()
+    result = update_entities('venues', rows)
+    elapsed = time.perf_counter() - started
+  print('%-44s %10.2f %10d' % ('update_entities, %d updated' % len(result['updated']), elapsed, counter.count))
+
+  with QueryCounter(engine) as counter:
+    started = time.perf_counter()
+    for venue_id in venue_ids[options.count:]:
+      venue = db.session.query(Venue).get(venue_id)
+      venue.name, venue.city, venue.state = 'Renamed %d' % venue_id, 'Austin', 'TX'
+      db.session.commit()
+    elapsed = time.perf_counter() - started
+  print('%-44s %10.2f %10d' % ('orm, one venue at a time', elapsed, counter.count))
+
+  with QueryCounter(engine) as counter:
+    started = time.perf_counter()
+    result = delete_entities('artists', [{'id': artist_id, 'version': None} for artist_id in artist_ids[:options.count]])
+    elapsed = time.perf_counter() - started
+  print('%-44s %10.2f %10d' % ('delete_entities, %d shows' % result['shows'], elapsed, counter.count))
+
+  with QueryCounter(engine) as counter:
+    started = time.perf_counter()
+    for artist_id in artist_ids[options.count:]:
+      db.session.delete(db.session.query(Artist).get(artist_id))
+      db.session.commit()
+    elapsed = time.perf_counter() - started
+  print('%-44s %10.2f %10d' % ('orm cascade, one artist at a time', elapsed, counter.count))
+
+  mismatches = sum(len(show_counter_mismatches(model)) for model in (Venue, Artist))
+  print('show counters %s' % ('match the show table' if not mismatches else 'disagree on %d rows' % mismatches))
+
+
+if __name__ == '__main__':
+  main()
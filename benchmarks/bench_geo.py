@@ -0,0 +1,103 @@
+# proximity search benchmark: points scattered around the gazetteer's cities (data/gazetteer.csv),
+# queried from random cities.
+#   grid  - GridIndex k-nearest and within-radius lookups, checked against a brute force scan of
+#           every point on a sample of the queries
+#   sql   - SqlGeoBackend over a venue table holding the first --sql-venues points (0 to skip)
+#   python benchmarks/bench_geo.py [--points N] [--queries N] [--k N] [--radius KM] [--sql-venues N]
+
+import time
+import random
+import argparse
+
+from common import load_app
+from geo import gazetteer, haversine_km, GridIndex, SqlGeoBackend
+
+
+def scatter(count, rnd):
+  # clustered like venues are: most within a few km of a city centre, a few in the suburbs
+  centres = list(gazetteer.load().values())
+  for i in range(count):
+    lat, lng = rnd.choice(centres)
+    spread = 0.05 if rnd.random() < 0.8 else 0.5
+    yield i + 1, lat + rnd.gauss(0, spread), lng + rnd.gauss(0, spread)
+
+
+def brute_force(points, lat, lng, k, max_km):
+  distances = sorted((haversine_km(lat, lng, point_lat, point_lng), point_id) for point_id, point_lat, point_lng in points)
+  if max_km is not None:
+    distances = [match for match in distances if match[0] <= max_km]
+  return distances[:k]
+
+
+def per_query(func, queries):
+  started = time.perf_counter()
+  for lat, lng in queries:
+    func(lat, lng)
+  return (time.perf_counter() - started) * 1000 / len(queries)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--points', type=int, default=1000000)
+  parser.add_argument('--queries', type=int, default=2000)
+  parser.add_argument('--k', type=int, default=20)
+  parser.add_argument('--radius', type=float, default=5.0)
+  parser.add_argument('--cell', type=float, default=0.02, help='GEO_CELL_DEGREES')
+  parser.add_argument('--sql-venues', type=int, default=20000)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  rnd = random.Random(options.seed)
+  points = list(scatter(options.points, rnd))
+  centres = list(gazetteer.load().values())
+  queries = [(lat + rnd.gauss(0, 0.05), lng + rnd.gauss(0, 0.05)) for lat, lng in (rnd.choice(centres) for i in range(options.queries))]
+
+  index = GridIndex(options.cell)
+  started = time.perf_counter()
+  for point_id, lat, lng in points:
+    index.add(point_id, lat, lng)
+  print('%d points in %d cells of %.3f degrees, built in %.1f s' % (len(index), len(index.cells), options.cell,
+    time.perf_counter() - started))
+
+  print('%-34s %12s' % ('grid', 'ms / query'))
+  print('%-34s %12.4f' % ('k=%d nearest' % options.k, per_query(lambda lat, lng: index.nearest(lat, lng, options.k), queries)))
+  print('%-34s %12.4f' % ('within %.1f km (up to 1000)' % options.radius,
+    per_query(lambda lat, lng: index.nearest(lat, lng, 1000, options.radius), queries)))
+  print('%-34s %12.4f' % ('k=%d nearest within %.1f km' % (options.k, options.radius),
+    per_query(lambda lat, lng: index.nearest(lat, lng, options.k, options.radius), queries)))
+
+  # a scan of every point is slow, so it only checks (and is timed on) a few queries
+  sample = queries[:20]
+  mismatches = 0
+  for lat, lng in sample:
+    for k, max_km in ((options.k, None), (1000, options.radius)):
+      expected = brute_force(points, lat, lng, k, max_km)
+      found = index.nearest(lat, lng, k, max_km)
+      if [round(distance, 9) for distance, point_id in found] != [round(distance, 9) for distance, point_id in expected]:
+        mismatches += 1
+  print('%-34s %12.4f' % ('brute force k=%d nearest' % options.k,
+    per_query(lambda lat, lng: brute_force(points, lat, lng, options.k, None), sample[:3])))
+  print('grid agrees with brute force on %d of %d queries' % (2 * len(sample) - mismatches, 2 * len(sample)))
+
+  if options.sql_venues:
+    app_module = load_app()
+    db = app_module.db
+    db.session.execute(app_module.Venue.__table__.insert(), [{
+      'name': 'Venue %d' % point_id, 'city': 'City', 'state': 'CA', 'address': '1 Main St',
+      'latitude': lat, 'longitude': lng} for point_id, lat, lng in points[:options.sql_venues]])
+    db.session.commit()
+    backend = SqlGeoBackend(db, app_module.Venue, options.cell)
+    print('%-34s %12s' % ('sql (%d venues, %s)' % (options.sql_venues, db.engine.dialect.name), 'ms / query'))
+    sql_queries = queries[:200]
+    print('%-34s %12.4f' % ('k=%d nearest' % options.k, per_query(lambda lat, lng: backend.nearest(lat, lng, options.k), sql_queries)))
+    print('%-34s %12.4f' % ('within %.1f km' % options.radius,
+      per_query(lambda lat, lng: backend.within(lat, lng, options.radius), sql_queries)))
+    small = GridIndex(options.cell)
+    for point_id, lat, lng in points[:options.sql_venues]:
+      small.add(point_id, lat, lng)
+    print('%-34s %12.4f' % ('grid at the same size, k=%d' % options.k,
+      per_query(lambda lat, lng: small.nearest(lat, lng, options.k), sql_queries)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,118 @@
+# booking reports benchmark over synthetic data (datagen.py), 1M shows by default.
+#   rollup   - "flask reports rollup --full", then an incremental refresh after --new-shows shows
+#              are booked and --deleted shows removed, checked against another full rollup
+#   reports  - each report over the whole data, summed from the rollups and aggregated live from
+#              the show table; both must write the same csv, and the same json
+#   writers  - the columnar csv writer against csv.DictWriter over the same rows
+#   routes   - /admin/reports/<name> end to end through the test client
+#   python benchmarks/bench_reports.py [--venues N] [--artists N] [--shows N] [--new-shows N] [--deleted N] [--seed N]
+
+import io
+import os
+import csv
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+os.environ.setdefault('ADMIN_TOKEN', 'bench')
+
+from common import load_app
+from datagen import generate
+
+
+def rollup_rows(app_module):
+  db = app_module.db
+  from reports import ROLLUPS
+  return dict((model.__tablename__, sorted(tuple(row) for row in db.session.query(*model.__table__.c)))
+    for model in ROLLUPS)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=20000)
+  parser.add_argument('--artists', type=int, default=20000)
+  parser.add_argument('--shows', type=int, default=1000000)
+  parser.add_argument('--new-shows', type=int, default=1000)
+  parser.add_argument('--deleted', type=int, default=100)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  app_module = load_app()
+  started = time.perf_counter()
+  counts = generate(app_module, options.venues, options.artists, options.shows, options.seed)
+  print('%(venues)d venues, %(artists)d artists, %(shows)d shows' % counts, 'generated in %.0f s' % (time.perf_counter() - started))
+
+  from reports import REPORTS, refresh_rollups, run_report, csv_chunks
+  db, Show = app_module.db, app_module.Show
+  config = app_module.app.config
+  batch_size = config['REPORTS_BATCH_SIZE']
+
+  started = time.perf_counter()
+  refresh_rollups(full=True)
+  print('%-40s %10.2f s' % ('full rollup', time.perf_counter() - started))
+
+  rnd = random.Random(options.seed)
+  now = datetime.now()
+  db.session.execute(Show.__table__.insert(), [{'venue_id': rnd.randint(1, counts['venues']),
+    'artist_id': rnd.randint(1, counts['artists']), 'start_time': now + timedelta(days=rnd.randint(-180, 180), hours=rnd.randint(0, 23))}
+    for i in range(options.new_shows)])
+  # through the orm, so the after_delete hooks mark the days
+  for show in db.session.query(Show).filter(Show.id.in_(rnd.sample(range(1, counts['shows'] + 1), options.deleted))):
+    db.session.delete(show)
+  db.session.commit()
+  started = time.perf_counter()
+  ranges = refresh_rollups()
+  print('%-40s %10.2f s   %d days in %d ranges' % ('refresh, %d booked and %d deleted' % (options.new_shows, options.deleted),
+    time.perf_counter() - started, sum((end - start).days for start, end in ranges), len(ranges)))
+  refreshed = rollup_rows(app_module)
+  refresh_rollups(full=True)
+  print('refresh %s the full rollup' % ('matches' if refreshed == rollup_rows(app_module) else 'differs from'))
+
+  first, last = db.session.query(db.func.min(Show.start_time), db.func.max(Show.start_time)).one()
+  start, end = first.date(), last.date() + timedelta(days=1)
+  print('%-24s %12s %12s %10s %8s %8s' % ('report', 'rollup ms', 'live ms', 'rows', 'same', 'json'))
+  for name in sorted(REPORTS):
+    outputs, documents, times = {}, {}, {}
+    for source in ('rollup', 'live'):
+      started = time.perf_counter()
+      outputs[source] = ''.join(run_report(name, source, start, end, batch_size))
+      times[source] = (time.perf_counter() - started) * 1000
+      documents[source] = json.loads(''.join(run_report(name, source, start, end, batch_size, 'json')))
+    print('%-24s %12.1f %12.1f %10d %8s %8s' % (name, times['rollup'], times['live'], outputs['rollup'].count('\n') - 1,
+      'yes' if outputs['rollup'] == outputs['live'] else 'NO', 'yes' if documents['rollup'] == documents['live'] else 'NO'))
+
+  # the biggest report's rows, held in memory so only the writing is timed
+  columns, query = REPORTS['venue-months']('rollup', start, end)
+  rows = [tuple(row) for row in query]
+  names = [name for name, kind in columns]
+  started = time.perf_counter()
+  columnar = ''.join(csv_chunks(columns, rows, batch_size))
+  columnar_ms = (time.perf_counter() - started) * 1000
+  started = time.perf_counter()
+  stream = io.StringIO()
+  writer = csv.DictWriter(stream, fieldnames=names)
+  writer.writeheader()
+  for row in rows:
+    writer.writerow(dict(zip(names, row)))
+  dict_ms = (time.perf_counter() - started) * 1000
+  print('%-40s %10.1f ms' % ('columnar csv, %d rows' % len(rows), columnar_ms))
+  print('%-40s %10.1f ms   %s output' % ('csv.DictWriter, %d rows' % len(rows), dict_ms,
+    'same' if stream.getvalue() == columnar else 'DIFFERENT'))
+
+  client = app_module.app.test_client()
+  headers = {'Authorization': 'Bearer ' + config['ADMIN_TOKEN']}
+  window = 'start=%s&end=%s' % (start.isoformat(), end.isoformat())
+  print('%-44s %12s %8s %10s' % ('route', 'ms', 'status', 'bytes'))
+  for route in ('/admin/reports/busiest-cities?%s' % window, '/admin/reports/genre-demand?%s&format=json' % window,
+      '/admin/reports/artist-utilization?%s' % window, '/admin/reports/venue-months?%s' % window):
+    started = time.perf_counter()
+    response = client.get(route, headers=headers)
+    body = response.get_data()
+    print('%-44s %12.1f %8d %10d' % (route.split('?')[0] + ('?format=json' if 'json' in route else ''),
+      (time.perf_counter() - started) * 1000, response.status_code, len(body)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,85 @@
+# per-route micro-benchmarks over synthetic data (datagen.py), through the flask test client.
+# every route is requested once to warm it up, then timed over --iterations requests; reported per
+# route: latency percentiles and statements per request. results are saved as json for
+# compare_results.py.
+#   python benchmarks/bench_routes.py [--venues N] [--artists N] [--shows N] [--seed N]
+#                                     [--iterations N] [--cache none|local] [--output PATH]
+
+import os
+import time
+import argparse
+
+from common import load_app, request_route, save_results, QueryCounter
+from datagen import generate, busiest
+
+
+def harness_routes(app_module):
+  # the pages and api calls a visitor makes, pointed at the busiest venue and artist and the most
+  # common genre, so every route does the most work the data set allows
+  db = app_module.db
+  venue_id = busiest(app_module, app_module.Show.venue_id)
+  artist_id = busiest(app_module, app_module.Show.artist_id)
+  genre = db.session.query(app_module.Genre.name) \
+    .join(app_module.venue_genres, app_module.venue_genres.c.genre_id == app_module.Genre.id) \
+    .group_by(app_module.Genre.name).order_by(db.func.count().desc()).limit(1).scalar() or 'Jazz'
+  return [
+    '/',
+    '/venues',
+    '/venues/genre/%s' % genre,
+    '/venues/%d' % venue_id,
+    'POST /venues/search',
+    '/artists',
+    '/artists/genre/%s' % genre,
+    '/artists/%d' % artist_id,
+    'POST /artists/search',
+    '/shows',
+    '/shows?upcoming=1',
+    '/api/v1/venues?limit=100',
+    '/api/v1/shows?limit=100',
+  ]
+
+
+def consume(response):
+  # streamed api bodies only run their queries while being read
+  response.get_data()
+  return response
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--shows', type=int, default=20000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--iterations', type=int, default=50)
+  parser.add_argument('--cache', default='none', help='CACHE_BACKEND for the run')
+  parser.add_argument('--output', help='where to write the json results')
+  options = parser.parse_args()
+
+  os.environ['CACHE_BACKEND'] = options.cache
+  from profiler import percentiles
+  app_module = load_app()
+  counts = generate(app_module, options.venues, options.artists, options.shows, options.seed)
+  client = app_module.app.test_client()
+  engine = app_module.db.engine
+
+  results = {'data': counts, 'iterations': options.iterations, 'cache': options.cache, 'routes': {}}
+  print('%-28s %8s %8s %8s %8s %8s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'status'))
+  for route in harness_routes(app_module):
+    consume(request_route(client, route))
+    timings, queries = [], []
+    for i in range(options.iterations):
+      with QueryCounter(engine) as counter:
+        started = time.perf_counter()
+        response = consume(request_route(client, route))
+        timings.append((time.perf_counter() - started) * 1000)
+      queries.append(counter.count)
+    latency = percentiles(timings)
+    results['routes'][route] = {'latency_ms': latency, 'queries': max(queries), 'status': response.status_code}
+    print('%-28s %8.2f %8.2f %8.2f %8d %8d' % (route[:28], latency['p50'], latency['p95'], latency['p99'], max(queries), response.status_code))
+
+  print('results: %s' % save_results('routes', results, options.output))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,73 @@
+# benchmark for the show listing form under concurrent posters.
+# every poster thread submits shows through POST /shows/create, first booked in the request and
+# then through the queued ShowWriter, and reports submissions and committed shows per second.
+# a fraction of the submissions deliberately double-book, so the conflict check does real work.
+#   python benchmarks/bench_show_booking.py [posters] [shows per poster]
+
+import sys
+import time
+import threading
+from datetime import datetime, timedelta
+
+from common import load_app, seed
+
+
+def post_shows(app_module, poster, count, start, errors):
+  client = app_module.app.test_client()
+  for i in range(count):
+    # each poster books its own venue and artist every 4 hours; every 10th show repeats the
+    # previous slot and has to be turned away
+    slot = i - 1 if i % 10 == 9 else i
+    response = client.post('/shows/create', data={
+      'venue_id': poster + 1,
+      'artist_id': poster + 1,
+      'start_time': (start + timedelta(hours=4 * slot)).strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    if response.status_code != 200:
+      errors.append(response.status_code)
+
+
+def run(app_module, posters, per_poster, start):
+  Show = app_module.Show
+  before = Show.query.count()
+  app_module.db.session.commit()
+  errors = []
+  threads = [threading.Thread(target=post_shows, args=(app_module, poster, per_poster, start, errors)) for poster in range(posters)]
+  started = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  submitted = time.perf_counter() - started
+  show_writer = app_module.app.extensions['show_writer']
+  if show_writer is not None:
+    show_writer.flush()
+  committed = time.perf_counter() - started
+  booked = Show.query.count() - before
+  app_module.db.session.commit()
+  return posters * per_poster / submitted, booked / committed, booked, errors
+
+
+def main():
+  posters = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+  per_poster = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+  app_module = load_app()
+  seed(app_module, venues=posters, artists=posters, shows=0, cities=1)
+
+  start = datetime.now() + timedelta(days=30)
+  for name, writer in [
+    ('in request', None),
+    ('queued', app_module.ShowWriter(app_module.app, app_module.app.config['SHOW_WRITE_BATCH_SIZE'])),
+  ]:
+    app_module.app.extensions['show_writer'] = writer
+    submitted, committed, booked, errors = run(app_module, posters, per_poster, start)
+    print('%-11s %8.0f posts/s %8.0f shows/s %6d booked %4d errors' % (name, submitted, committed, booked, len(errors)))
+    # the next run books the same slots a year later
+    start += timedelta(days=365)
+
+  mismatches = sum(len(app_module.show_counter_mismatches(model)) for model in (app_module.Venue, app_module.Artist))
+  print('counter mismatches: %d' % mismatches)
+
+
+if __name__ == '__main__':
+  main()
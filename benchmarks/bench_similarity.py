@@ -0,0 +1,78 @@
+# similarity index benchmark over synthetic data (datagen.py).
+#   build    - a full build of both kinds, and the size of the stored file
+#   refresh  - an incremental refresh after --new-shows more shows are booked, checked against a
+#              full build of the same data: every row's scores must match
+#   lookup   - SimilarityIndex.similar() as the detail pages call it
+# the index is written to a temporary file, not SIMILARITY_PATH.
+#   python benchmarks/bench_similarity.py [--venues N] [--artists N] [--shows N] [--new-shows N] [--seed N]
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+directory = tempfile.mkdtemp(prefix='fyyur-similarity-')
+os.environ['SIMILARITY_PATH'] = os.path.join(directory, 'similarity.npz')
+
+from common import load_app
+from datagen import generate
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=20000)
+  parser.add_argument('--artists', type=int, default=20000)
+  parser.add_argument('--shows', type=int, default=200000)
+  parser.add_argument('--new-shows', type=int, default=1000)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  app_module = load_app()
+  counts = generate(app_module, options.venues, options.artists, options.shows, options.seed)
+  print('%(venues)d venues, %(artists)d artists, %(shows)d shows' % counts)
+  import numpy as np
+  from similarity import build_similarity, load_arrays
+  config = app_module.app.config
+  path = config['SIMILARITY_PATH']
+  db, Show = app_module.db, app_module.Show
+
+  started = time.perf_counter()
+  build_similarity(config, full=True)
+  print('%-36s %10.2f s   %.1f MB (k=%d)' % ('full build', time.perf_counter() - started, os.path.getsize(path) / 1e6,
+    config['SIMILARITY_K']))
+
+  # bookings between existing venues and artists, one second after the build so its edits count
+  time.sleep(1)
+  rnd = random.Random(options.seed)
+  now = datetime.now()
+  db.session.execute(Show.__table__.insert(), [{'venue_id': rnd.randint(1, counts['venues']),
+    'artist_id': rnd.randint(1, counts['artists']), 'start_time': now + timedelta(days=rnd.randint(1, 90))}
+    for i in range(options.new_shows)])
+  db.session.commit()
+  started = time.perf_counter()
+  changed = build_similarity(config)
+  print('%-36s %10.2f s   %d artist and %d venue rows changed' % ('refresh after %d shows' % options.new_shows,
+    time.perf_counter() - started, len(changed['artists']), len(changed['venues'])))
+  refreshed = load_arrays(path)
+  started = time.perf_counter()
+  build_similarity(config, full=True)
+  print('%-36s %10.2f s' % ('full build of the same data', time.perf_counter() - started))
+  rebuilt = load_arrays(path)
+  worst = max(np.abs(refreshed[kind + '_scores'].astype(np.float32) - rebuilt[kind + '_scores'].astype(np.float32)).max()
+    for kind in ('artists', 'venues'))
+  print('refresh %s the full build (largest score difference %.4f)' % ('matches' if worst == 0 else 'differs from', worst))
+
+  index = app_module.app.extensions['similarity']
+  ids = [rnd.randint(1, counts['artists']) for i in range(10000)]
+  index.similar('artists', ids[0])
+  started = time.perf_counter()
+  for artist_id in ids:
+    index.similar('artists', artist_id, config['SIMILAR_PANEL_SIZE'])
+  print('%-36s %10.2f us' % ('lookup of %d similar artists' % config['SIMILAR_PANEL_SIZE'],
+    (time.perf_counter() - started) * 1e6 / len(ids)))
+
+
+if __name__ == '__main__':
+  main()
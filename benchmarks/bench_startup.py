@@ -0,0 +1,115 @@
+# cold boot of N workers, the way a pre-fork server starts them.
+#   spawn   - every worker is a fresh interpreter that imports the app and calls create_app()
+#             (gunicorn without --preload)
+#   preload - the master imports and creates the app once, then forks the workers (--preload)
+# each worker then serves its first requests. reported per mode, with and without template warmup:
+# median import / create_app / first-requests time per worker, and the wall time until every worker
+# has answered.
+#   python benchmarks/bench_startup.py [workers]
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+import tempfile
+
+from common import ROOT
+
+FIRST_REQUESTS = ['/venues', '/venues/1', '/artists/1', '/shows']
+
+
+def serve_first_requests(flask_app):
+  client = flask_app.test_client()
+  for route in FIRST_REQUESTS:
+    client.get(route)
+
+
+def worker():
+  # run as "bench_startup.py --worker" in a fresh interpreter: one line of timings on stdout
+  started = time.perf_counter()
+  import app
+  imported = time.perf_counter()
+  flask_app = app.create_app()
+  created = time.perf_counter()
+  serve_first_requests(flask_app)
+  served = time.perf_counter()
+  print(json.dumps({'import': imported - started, 'create': created - imported, 'first': served - created}))
+
+
+def seed_database(path):
+  # a small seeded database, made in a child so this process never imports the app
+  code = 'from common import load_app, seed; seed(load_app(), venues=50, artists=50, shows=500, cities=10)'
+  subprocess.check_call([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+    env=dict(os.environ, DATABASE_URL='sqlite:///' + path))
+
+
+def spawn(workers, env):
+  started = time.perf_counter()
+  processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker'], cwd=ROOT, env=env,
+    stdout=subprocess.PIPE) for i in range(workers)]
+  timings = [json.loads(process.communicate()[0]) for process in processes]
+  return time.perf_counter() - started, timings
+
+
+def preload(workers, env):
+  # in a child of its own, so each run starts from an interpreter that hasn't imported the app
+  code = 'import bench_startup, json; print(json.dumps(bench_startup.fork_workers(%d)))' % workers
+  output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+  wall, timings = json.loads(output)
+  return wall, timings
+
+
+def fork_workers(workers):
+  started = time.perf_counter()
+  import app
+  imported = time.perf_counter()
+  flask_app = app.create_app()
+  created = time.perf_counter()
+  children = []
+  for i in range(workers):
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      os.close(read_end)
+      forked = time.perf_counter()
+      serve_first_requests(flask_app)
+      os.write(write_end, json.dumps({'import': 0.0, 'create': 0.0, 'first': time.perf_counter() - forked}).encode('utf-8'))
+      os._exit(0)
+    os.close(write_end)
+    children.append((pid, read_end))
+  timings = []
+  for pid, read_end in children:
+    with os.fdopen(read_end) as stream:
+      timings.append(json.loads(stream.read()))
+    os.waitpid(pid, 0)
+  # the master's one import and create_app are shared by every worker
+  for timing in timings:
+    timing['import'], timing['create'] = imported - started, created - imported
+  return time.perf_counter() - started, timings
+
+
+def main():
+  workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+  path = os.path.join(tempfile.mkdtemp(prefix='fyyur-startup-'), 'startup.db')
+  seed_database(path)
+  env = dict(os.environ, DATABASE_URL='sqlite:///' + path, CACHE_BACKEND='none', PROFILER_LOG='')
+
+  print('%d workers, first requests: %s' % (workers, ' '.join(FIRST_REQUESTS)))
+  print('%-24s %10s %10s %10s %10s' % ('', 'import ms', 'create ms', 'first ms', 'all ready'))
+  for name, start in [('spawn', spawn), ('preload', preload)]:
+    if name == 'preload' and not hasattr(os, 'fork'):
+      continue
+    for warm in ('0', '1'):
+      wall, timings = start(workers, dict(env, WARM_TEMPLATES=warm))
+      medians = [statistics.median(timing[key] for timing in timings) * 1000 for key in ('import', 'create', 'first')]
+      label = '%s, %s' % (name, 'warmed templates' if warm == '1' else 'lazy templates')
+      print('%-24s %10.1f %10.1f %10.1f %8.0f ms' % tuple([label] + medians + [wall * 1000]))
+
+
+if __name__ == '__main__':
+  if sys.argv[1:] == ['--worker']:
+    worker()
+  else:
+    main()
@@ -0,0 +1,89 @@
+# render benchmark for the largest pages: /venues with every venue, a page of 1000 shows and a
+# venue page carrying thousands of shows.
+#   loading - parsing and compiling the templates from source, against loading them from the
+#             bytecode cache (what a fresh worker does at boot)
+#   render  - rendering from the view models with {% cache %} fragments off, with an empty
+#             fragment cache, with every fragment cached, and after one booking has retired the
+#             fragments of one venue and one artist (what a page cache miss costs).
+#             /venues has no fragments: a venue card is cheaper to render than to look up
+#   python benchmarks/bench_templates.py [venues] [shows]
+
+import os
+import sys
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+# the fragments live in the page cache backend
+os.environ['CACHE_BACKEND'] = 'local'
+os.environ.setdefault('CACHE_MAX_ENTRIES', '100000')
+
+from common import load_app, seed, timed
+from templating import SharedBytecodeCache
+
+PAGES = ['pages/venues.html', 'pages/shows.html', 'pages/show_venue.html', 'layouts/main.html']
+
+
+def load_templates(env):
+  env.cache.clear()
+  for name in PAGES:
+    env.get_template(name)
+
+
+def main():
+  venues = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  shows = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+  app_module = load_app()
+  flask_app, db = app_module.app, app_module.db
+  seed(app_module, venues=venues, artists=500, shows=shows, cities=200)
+  # venue 1 gets a page's worth of its own
+  now = datetime.now()
+  db.session.execute(app_module.Show.__table__.insert(), [{
+    'venue_id': 1, 'artist_id': 1 + i % 500, 'start_time': now + timedelta(hours=i - 1500)} for i in range(3000)])
+  db.session.commit()
+
+  def contexts():
+    with flask_app.test_request_context('/'):
+      return {
+        'pages/venues.html': {'areas': app_module.group_venues_by_area(app_module.upcoming_shows_per_venue().all())},
+        'pages/shows.html': {'shows': [app_module.ShowListing.from_row(row) for row in app_module.show_listing_query().limit(1000)],
+          'next_url': None, 'upcoming_only': False},
+        'pages/show_venue.html': {'venue': app_module.venue_detail(1)},
+      }
+  renders = [('/venues', 'pages/venues.html'), ('/shows', 'pages/shows.html'), ('/venues/1', 'pages/show_venue.html')]
+
+  env = flask_app.jinja_env
+  directory = tempfile.mkdtemp(prefix='fyyur-bytecode-')
+  print('template loading (%s)' % ', '.join(PAGES))
+  env.bytecode_cache = None
+  print('%-30s %10.1f ms' % ('compile from source', timed(lambda: load_templates(env))))
+  env.bytecode_cache = SharedBytecodeCache(directory, 'fyyur-%s.cache')
+  load_templates(env)
+  print('%-30s %10.1f ms' % ('load from bytecode cache', timed(lambda: load_templates(env))))
+  shutil.rmtree(directory)
+
+  page_cache = flask_app.extensions['page_cache']
+  backend = page_cache.backend
+  current = contexts()
+  for path, template in renders:
+    def render():
+      with flask_app.test_request_context(path):
+        app_module.render_template(template, **current[template])
+    print('%s (%s)' % (path, template))
+    page_cache.backend = None
+    print('  %-28s %10.1f ms' % ('fragments off', timed(render)))
+    page_cache.backend = backend
+    backend.entries.clear()
+    print('  %-28s %10.1f ms' % ('fragment cache empty', timed(render, repeat=1)))
+    print('  %-28s %10.1f ms' % ('fragment cache warm', timed(render)))
+    # a booking at venue 1 by artist 1 moves their updated_at, which retires their fragments and
+    # nothing else
+    db.session.add(app_module.Show(venue_id=1, artist_id=1, start_time=now + timedelta(days=400)))
+    db.session.commit()
+    current = contexts()
+    print('  %-28s %10.1f ms' % ('after one booking', timed(render, repeat=1)))
+  print('fragment hit rate %.2f' % page_cache.get_stats()['fragment_hit_rate'])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,63 @@
+# benchmark for the /venues city/state listing.
+# compares the old one-query-per-city/state loop, a live grouped aggregate over the show table
+# and the stored upcoming_shows_count counters the page reads today.
+#   python benchmarks/bench_venues.py [venues] [shows]
+
+import sys
+from datetime import datetime
+
+from common import load_app, seed, timed, QueryCounter
+
+
+def legacy_areas(app_module):
+  # the original implementation: distinct city/state, then one venue query per combo
+  db, Venue = app_module.db, app_module.Venue
+  data = []
+  for combo in db.session.query(Venue.city, Venue.state).distinct().order_by(Venue.city).order_by(Venue.state):
+    venues = db.session.query(Venue).filter(Venue.city == combo.city, Venue.state == combo.state).all()
+    data.append({
+      "city": combo.city,
+      "state": combo.state,
+      "venues": [{"id": v.id, "name": v.name, "num_upcoming_shows": 0} for v in venues]
+    })
+  return data
+
+
+def grouped_areas(app_module):
+  # live count: venues left outer joined to their upcoming shows and grouped by venue
+  db, Venue, Show = app_module.db, app_module.Venue, app_module.Show
+  num_upcoming_shows = db.func.count(Show.id).label('num_upcoming_shows')
+  rows = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, num_upcoming_shows) \
+    .outerjoin(Show, db.and_(Show.venue_id == Venue.id, Show.start_time > datetime.now())) \
+    .group_by(Venue.id, Venue.name, Venue.city, Venue.state) \
+    .order_by(Venue.city, Venue.state, Venue.id) \
+    .all()
+  return app_module.group_venues_by_area(rows)
+
+
+def counter_areas(app_module):
+  return app_module.group_venues_by_area(app_module.upcoming_shows_per_venue().all())
+
+
+def main():
+  venues = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  shows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+  app_module = load_app()
+  engine = app_module.db.engine
+  seed(app_module, venues=venues, artists=max(venues // 10, 1), shows=shows, cities=venues // 5)
+
+  client = app_module.app.test_client()
+  for name, func in [
+    ('legacy loop', lambda: legacy_areas(app_module)),
+    ('grouped query', lambda: grouped_areas(app_module)),
+    ('counters', lambda: counter_areas(app_module)),
+    ('GET /venues', lambda: client.get('/venues')),
+  ]:
+    with QueryCounter(engine) as counter:
+      func()
+    app_module.db.session.remove()
+    print('%-14s %6d queries %10.1f ms' % (name, counter.count, timed(func, repeat=3)))
+
+
+if __name__ == '__main__':
+  main()
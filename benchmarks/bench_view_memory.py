@@ -0,0 +1,49 @@
+# peak memory of rendering one busy venue page.
+# compares loading live Show orm objects (the original approach: mutate them, attach image
+# links, keep them in the identity map for the whole render) with the slotted view models.
+#   python benchmarks/bench_view_memory.py [shows]
+
+import sys
+import tracemalloc
+from datetime import datetime
+
+from common import load_app, seed
+
+
+def legacy_venue_page(app_module, venue_id):
+  db, Venue, Artist, Show = app_module.db, app_module.Venue, app_module.Artist, app_module.Show
+  venue = db.session.query(Venue).get(venue_id)
+  shows = db.session.query(Show).filter(Show.venue_id == venue_id).all()
+  past_shows, upcoming_shows = [], []
+  for show in shows:
+    show.artist_image_link = db.session.query(Artist).get(show.artist_id).image_link
+    (past_shows if show.start_time < datetime.now() else upcoming_shows).append(show)
+  data = {"id": venue.id, "name": venue.name, "genres": [genre.name for genre in venue.genres], "city": venue.city,
+    "state": venue.state, "image_link": venue.image_link, "past_shows": past_shows, "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows), "upcoming_shows_count": len(upcoming_shows)}
+  return app_module.render_template('pages/show_venue.html', venue=data)
+
+
+def measure(app_module, func):
+  with app_module.app.test_request_context('/venues/1'):
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    app_module.db.session.remove()
+  return peak / 1024.0
+
+
+def main():
+  shows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+  app_module = load_app()
+  # every show at venue 1 so one page carries the whole load
+  seed(app_module, venues=1, artists=500, shows=shows, cities=1)
+
+  print('venue page with %d shows, peak traced memory' % shows)
+  print('%-22s %10.0f KiB' % ('orm objects (legacy)', measure(app_module, lambda: legacy_venue_page(app_module, 1))))
+  print('%-22s %10.0f KiB' % ('view models', measure(app_module, lambda: app_module.show_venue(venue_id=1))))
+
+
+if __name__ == '__main__':
+  main()
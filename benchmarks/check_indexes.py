@@ -0,0 +1,101 @@
+# EXPLAIN based index regression check.
+# requests every route, runs EXPLAIN on each statement it issued and fails (exit code 1) when a
+# plan reads a table with a sequential scan that the route is not expected to need.
+# on postgres enable_seqscan is switched off for the EXPLAIN so a small seeded database still
+# shows whether an index *can* serve the query.
+#   python benchmarks/check_indexes.py
+
+import re
+import sys
+import json
+
+from common import load_app, seed, request_route, QueryCounter
+
+# route -> tables it legitimately reads in full (listings walk the whole table)
+ROUTES = {
+  '/venues': {'venue'},
+  '/venues/1': set(),
+  '/venues/genre/Jazz': set(),
+  '/artists': {'artist'},
+  '/artists/1': set(),
+  '/artists/genre/Jazz': set(),
+  '/shows': set(),
+  '/shows?upcoming=1': set(),
+  '/api/v1/venues/available?city=City 1&state=CA&date=2030-01-01': set(),
+  '/api/v1/venues/1/availability?date=2030-01-01': set(),
+  # artists are paged in id order; their shows are one range query over the artist index
+  '/api/v1/artists/available?date=2030-01-01': {'artist'},
+  '/api/v1/artists/available?date=2030-01-01&unbooked=1': {'artist'},
+  '/api/v1/artists/1/availability?date=2030-01-01': set(),
+  # its validator counts rows over an index and reads the newest writes from one
+  '/api/v1/shows?upcoming=1': set(),
+  # sqlite can't index a LIKE '%term%', on postgres the trigram index serves these
+  'POST /venues/search': {'venue'},
+  'POST /artists/search': {'artist'},
+}
+
+# "SCAN CONSTANT ROW" is the FROM-less outer select wrapping scalar subqueries, not a table
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)(\w+)\b(?! USING)')
+
+
+def sqlite_full_scans(cursor, statement, parameters):
+  cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+  scans = set()
+  for row in cursor.fetchall():
+    match = SQLITE_FULL_SCAN.match(row[-1])
+    if match:
+      scans.add(match.group(1))
+  return scans
+
+
+def postgres_full_scans(cursor, statement, parameters):
+  cursor.execute('SET enable_seqscan = off')
+  cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+  plan = cursor.fetchone()[0]
+  if isinstance(plan, str):
+    plan = json.loads(plan)
+  scans = set()
+  nodes = [plan[0]['Plan']]
+  while nodes:
+    node = nodes.pop()
+    if node.get('Node Type') == 'Seq Scan':
+      scans.add(node['Relation Name'])
+    nodes.extend(node.get('Plans', []))
+  return scans
+
+
+def main():
+  app_module = load_app()
+  seed(app_module, venues=200, artists=200, shows=5000, cities=20)
+  engine = app_module.db.engine
+  explain = postgres_full_scans if engine.dialect.name == 'postgresql' else sqlite_full_scans
+  client = app_module.app.test_client()
+
+  failures = 0
+  for route, allowed in sorted(ROUTES.items()):
+    with QueryCounter(engine) as counter:
+      request_route(client, route)
+    app_module.db.session.remove()
+
+    raw = engine.raw_connection()
+    try:
+      cursor = raw.cursor()
+      unexpected = set()
+      for statement, parameters in zip(counter.statements, counter.parameters):
+        if statement.lstrip().upper().startswith('SELECT'):
+          unexpected |= explain(cursor, statement, parameters) - allowed
+    finally:
+      raw.rollback()
+      raw.close()
+
+    if unexpected:
+      failures += 1
+      print('FAIL %-24s sequential scan on %s' % (route, ', '.join(sorted(unexpected))))
+    else:
+      print('ok   %-24s' % route)
+
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
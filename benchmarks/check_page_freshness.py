@@ -0,0 +1,104 @@
+# stale page check: after an edit, a page that shows the edited entity must neither be served from
+# the page cache nor revalidated with a 304 against the etag it had before. exits 1 when
+#   - renaming an artist leaves the venue page (html or api) of one of its shows unchanged
+#   - changing a venue's image leaves the artist page of one of its shows unchanged
+#   - the same rename made by another process (nothing invalidated here) leaves its fragments cached
+#   - another worker gives an unchanged page a different etag
+#   - /api/v1/venues/near or the ngram venue search misses a venue another process moved or added,
+#     or keeps one it deleted
+#   python benchmarks/check_page_freshness.py
+
+import os
+import sys
+from datetime import datetime
+
+os.environ.setdefault('CACHE_BACKEND', 'local')
+# the in-process search index, which like the grid proximity index has to follow other processes
+os.environ.setdefault('SEARCH_BACKEND', 'ngram')
+
+from common import load_app, seed
+
+
+def main():
+  app_module = load_app()
+  db, app, Show = app_module.db, app_module.app, app_module.Show
+  seed(app_module, venues=20, artists=20, shows=200, cities=5)
+  from editing import update_entities
+  client = app.test_client()
+  checks = []
+
+  def edited(url, edit, expected):
+    # (still matching the old etag, new content missing) for url around edit()
+    etag = client.get(url).headers.get('ETag')
+    client.get(url)
+    with app.app_context():
+      edit()
+    response = client.get(url, headers={'If-None-Match': etag or ''})
+    return response.status_code == 304, expected not in response.get_data(as_text=True)
+
+  with app.app_context():
+    show = db.session.query(Show).first()
+    venue_id, artist_id = show.venue_id, show.artist_id
+
+  for number, url in enumerate(('/venues/%d' % venue_id, '/api/v1/venues/%d' % venue_id)):
+    name = 'Renamed Artist %d' % number
+    revalidated, missing = edited(url, lambda: update_entities('artists', [{'id': artist_id, 'name': name}]), name)
+    checks.append(('%s no 304 after renaming an artist' % url, not revalidated))
+    checks.append(('%s shows the new artist name' % url, not missing))
+
+  for number, url in enumerate(('/artists/%d' % artist_id, '/api/v1/artists/%d' % artist_id)):
+    image = 'https://example.com/venue/new-%d.jpg' % number
+    revalidated, missing = edited(url, lambda: update_entities('venues', [{'id': venue_id, 'image_link': image}]), image)
+    checks.append(('%s no 304 after a venue image change' % url, not revalidated))
+    checks.append(('%s shows the new venue image' % url, not missing))
+
+  def elsewhere(name):
+    # what update_entities writes, as another worker or a cli command would: straight to the
+    # database, so none of this process's caches or counters hear about it
+    Venue, Artist = app_module.Venue, app_module.Artist
+    db.session.execute(Artist.__table__.update().where(Artist.id == artist_id).values(name=name))
+    db.session.execute(Venue.__table__.update().where(Venue.id.in_(
+      db.select([Show.venue_id]).where(Show.artist_id == artist_id))).values(updated_at=datetime.now()))
+    db.session.commit()
+
+  url = '/venues/%d' % venue_id
+  revalidated, missing = edited(url, lambda: elsewhere('Renamed Elsewhere'), 'Renamed Elsewhere')
+  checks.append(('%s no 304 after a rename in another process' % url, not revalidated))
+  checks.append(('%s shows a name changed in another process' % url, not missing))
+
+  # a second app stands in for another worker, or this one after a restart
+  for url in ('/venues/%d' % venue_id, '/artists/%d' % artist_id):
+    etag = client.get(url).headers.get('ETag')
+    checks.append(('%s same etag from another worker' % url,
+      app_module.create_app().test_client().get(url).headers.get('ETag') == etag))
+
+  # writes this process never hears about, against its grid proximity and ngram search indexes
+  Venue = app_module.Venue
+  def near():
+    return [record['id'] for record in client.get('/api/v1/venues/near?lat=10&lng=10&k=2').get_json()['data']]
+  def found():
+    return [record['id'] for record in client.get('/api/v1/venues/search?q=elsewhere').get_json()['data']]
+  near()
+  found()
+  with app.app_context():
+    db.session.execute(Venue.__table__.update().where(Venue.id == venue_id).values(latitude=10.0, longitude=10.0))
+    db.session.execute(Venue.__table__.insert().values(id=1000, name='Added Elsewhere', city='Nowhere', state='CA',
+      latitude=10.001, longitude=10.0))
+    db.session.commit()
+  checks.append(('venues/near finds venues moved and added in another process', sorted(near()) == sorted([venue_id, 1000])))
+  checks.append(('venue search finds a venue added in another process', found() == [1000]))
+  with app.app_context():
+    db.session.execute(Venue.__table__.delete().where(Venue.id == 1000))
+    db.session.commit()
+  checks.append(('venues/near drops a venue deleted in another process', near() == [venue_id]))
+  checks.append(('venue search drops a venue deleted in another process', found() == []))
+
+  failures = 0
+  for name, passed in checks:
+    print('%-4s %s' % ('ok' if passed else 'FAIL', name))
+    failures += not passed
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,65 @@
+# query-count regression harness.
+# seeds a small catalogue, requests each page and fails (exit code 1) when a route issues
+# more sql statements than its budget. budgets must not grow with the number of shows.
+#   python benchmarks/check_query_counts.py
+
+import sys
+
+from common import load_app, seed, request_route, QueryCounter
+
+# route (prefixed with POST for search forms) -> maximum number of statements allowed for a single request
+BUDGETS = {
+  '/venues': 1,
+  # entity pages: the last-modified validator (see conditional_get in cache.py), the entity, its shows, its genres
+  '/venues/1': 4,
+  '/venues/genre/Jazz': 1,
+  '/artists/1': 4,
+  '/artists/genre/Jazz': 1,
+  '/shows': 1,
+  '/shows?upcoming=1': 1,
+  'POST /venues/search': 1,
+  'POST /artists/search': 1,
+}
+
+# revalidating an entity page with its etag must answer 304 from the validator query alone
+REVALIDATE_BUDGETS = {
+  '/venues/1': 1,
+  '/artists/1': 1,
+  '/api/v1/venues/1': 1,
+  '/api/v1/venues': 1,
+  '/api/v1/artists/available?date=2030-01-01': 1,
+  '/api/v1/shows?upcoming=1': 1,
+}
+
+
+def main():
+  app_module = load_app()
+  seed(app_module, venues=50, artists=50, shows=2000, cities=10)
+  client = app_module.app.test_client()
+
+  failures = 0
+  for url, budget in sorted(BUDGETS.items()):
+    with QueryCounter(app_module.db.engine) as counter:
+      response = request_route(client, url)
+    status = 'ok' if counter.count <= budget and response.status_code == 200 else 'FAIL'
+    if status == 'FAIL':
+      failures += 1
+    print('%-4s %-24s %3d queries (budget %d), HTTP %d' % (status, url, counter.count, budget, response.status_code))
+    if status == 'FAIL':
+      for statement in counter.statements:
+        print('       ' + ' '.join(statement.split())[:120])
+
+  for url, budget in sorted(REVALIDATE_BUDGETS.items()):
+    etag = client.get(url).headers.get('ETag')
+    with QueryCounter(app_module.db.engine) as counter:
+      response = client.get(url, headers={'If-None-Match': etag or ''})
+    status = 'ok' if counter.count <= budget and response.status_code == 304 else 'FAIL'
+    if status == 'FAIL':
+      failures += 1
+    print('%-4s %-24s %3d queries (budget %d), HTTP %d' % (status, url + ' 304', counter.count, budget, response.status_code))
+
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,62 @@
+# primary/replica routing check, with two sqlite files standing in for the two servers.
+# the replica is a copy of the primary taken after seeding, so anything written afterwards shows
+# which database a page was read from. exits 1 when
+#   - a listing is read from the primary instead of the replica
+#   - a visitor doesn't see their own write right after submitting a form
+#   - another visitor isn't still served by the replica
+#   - a statement outliving its route's timeout isn't interrupted
+#   python benchmarks/check_replica_routing.py
+
+import os
+import sys
+import shutil
+import tempfile
+
+directory = tempfile.mkdtemp(prefix='fyyur-replica-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'primary.db')
+os.environ['DATABASE_REPLICA_URL'] = 'sqlite:///' + os.path.join(directory, 'replica.db')
+
+from common import load_app, seed
+
+
+def main():
+  app_module = load_app()
+  db, app = app_module.db, app_module.app
+  seed(app_module, venues=20, artists=20, shows=100, cities=5)
+  db.session.remove()
+  db.get_engine(app).dispose()
+  shutil.copy(os.path.join(directory, 'primary.db'), os.path.join(directory, 'replica.db'))
+
+  # slow enough to trip a 50ms timeout many times over
+  def slow():
+    db.session.execute(db.text('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 100000000) SELECT count(*) FROM c')).scalar()
+    return 'finished'
+  app.add_url_rule('/slow', 'slow', slow)
+  app.config['STATEMENT_TIMEOUTS']['slow'] = 50
+
+  writer = app.test_client()
+  other = app.test_client()
+  checks = []
+
+  # written straight to the primary: the replica never sees it
+  db.session.add(app_module.Venue(name='Only On Primary', city='City 0', state='CA'))
+  db.session.commit()
+  checks.append(('listings read from the replica', b'Only On Primary' not in other.get('/venues').data))
+
+  response = writer.post('/venues/create', data={'name': 'Just Listed', 'city': 'City 0', 'state': 'CA', 'genres': ['Jazz']})
+  checks.append(('form response sets the sticky cookie', 'fyyur_primary_until' in response.headers.get('Set-Cookie', '')))
+  checks.append(('writer reads their own write', b'Just Listed' in writer.get('/venues').data))
+  checks.append(('other visitors still read the replica', b'Just Listed' not in other.get('/venues').data))
+
+  app.config['PROPAGATE_EXCEPTIONS'] = False
+  checks.append(('slow statement interrupted', other.get('/slow').status_code == 500))
+
+  failures = 0
+  for name, passed in checks:
+    print('%-4s %s' % ('ok' if passed else 'FAIL', name))
+    failures += not passed
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,173 @@
+# shared helpers for the benchmark scripts in this folder.
+# run them from the project root, e.g. "python benchmarks/bench_venues.py"
+# they use a throwaway sqlite database unless DATABASE_URL is already set.
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+  sys.path.insert(0, ROOT)
+
+
+def load_app():
+  # point the app at a scratch database before it is created (config.py reads the environment)
+  if 'DATABASE_URL' not in os.environ:
+    path = os.path.join(tempfile.mkdtemp(prefix='fyyur-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+  # measure the database and render path, not the page cache, unless asked to
+  os.environ.setdefault('CACHE_BACKEND', 'none')
+  # keep profiler records out of the working tree
+  os.environ.setdefault('PROFILER_LOG', '')
+  import app
+  app.app = app.create_app()
+  app.app.config['WTF_CSRF_ENABLED'] = False
+  # scripts talk to the database outside of requests
+  app.app.app_context().push()
+  app.db.create_all()
+  return app
+
+
+class QueryCounter(object):
+  # counts the sql statements (and keeps their parameters) sent through an engine while the block runs
+  def __init__(self, engine):
+    self.engine = engine
+    self.statements = []
+    self.parameters = []
+
+  def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    self.statements.append(statement)
+    self.parameters.append(parameters)
+
+  def __enter__(self):
+    from sqlalchemy import event
+    event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+    return self
+
+  def __exit__(self, *exc):
+    from sqlalchemy import event
+    event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+
+  @property
+  def count(self):
+    return len(self.statements)
+
+
+class ThreadQueryCounter(object):
+  # counts statements per thread on every engine, for drivers running requests on several threads.
+  # the test client handles a request on the thread that sends it
+  def __init__(self):
+    self.local = threading.local()
+
+  def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    self.local.count = getattr(self.local, 'count', 0) + 1
+
+  def __enter__(self):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+    return self
+
+  def __exit__(self, *exc):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+
+  def take(self):
+    # statements run on this thread since the last take()
+    count = getattr(self.local, 'count', 0)
+    self.local.count = 0
+    return count
+
+
+def request_route(client, route):
+  # routes are written as '/path' or 'POST /path' (search forms, posted with a fixed term)
+  if route.startswith('POST '):
+    return client.post(route[5:], data={'search_term': '1'})
+  return client.get(route)
+
+
+def seed(app_module, venues=1000, artists=1000, shows=10000, cities=500, seed=42):
+  # bulk inserts synthetic rows, bypassing the orm so seeding 100k shows stays quick
+  db = app_module.db
+  rnd = random.Random(seed)
+  states = ['CA', 'NY', 'TX', 'WA', 'IL', 'FL', 'LA', 'MA', 'OR', 'CO']
+  city_names = ['City %d' % i for i in range(cities)]
+  now = datetime.now()
+
+  db.session.execute(app_module.Venue.__table__.insert(), [{
+    'name': 'Venue %d' % i,
+    'city': rnd.choice(city_names),
+    'state': rnd.choice(states),
+    'address': '%d Main St' % i,
+    'image_link': 'https://example.com/venue/%d.jpg' % i,
+    'seeking_talent': False
+  } for i in range(venues)])
+  db.session.execute(app_module.Artist.__table__.insert(), [{
+    'name': 'Artist %d' % i,
+    'city': rnd.choice(city_names),
+    'state': rnd.choice(states),
+    'image_link': 'https://example.com/artist/%d.jpg' % i,
+    'seeking_venue': False
+  } for i in range(artists)])
+  if shows:
+    db.session.execute(app_module.Show.__table__.insert(), [{
+      'venue_id': rnd.randint(1, venues),
+      'artist_id': rnd.randint(1, artists),
+      'start_time': now + timedelta(hours=rnd.randint(-24 * 365, 24 * 365))
+    } for i in range(shows)])
+  db.session.commit()
+  # the inserts above bypass the orm events, so fill in the denormalized show counters afterwards
+  for model in (app_module.Venue, app_module.Artist):
+    app_module.show_counter_mismatches(model, fix=True)
+  # reading the counters may have created the rollover watermark; don't leave its write transaction open
+  db.session.commit()
+
+
+def timed(func, repeat=5):
+  # best-of-n wall clock time in milliseconds
+  best = None
+  for i in range(repeat):
+    started = time.perf_counter()
+    func()
+    elapsed = (time.perf_counter() - started) * 1000
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def git_revision():
+  try:
+    revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL) != 0
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+  return revision + ('-dirty' if dirty else '')
+
+
+def save_results(kind, results, path=None):
+  # writes results as json, by default to benchmarks/results/<kind>-<revision>-<time>.json, so runs on
+  # different commits can be put side by side with compare_results.py
+  revision = git_revision()
+  document = {
+    'kind': kind,
+    'revision': revision,
+    'created': datetime.now().isoformat(timespec='seconds'),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'database': os.environ.get('DATABASE_URL', '').split(':', 1)[0],
+    'results': results,
+  }
+  if path is None:
+    path = os.path.join(ROOT, 'benchmarks', 'results', '%s-%s-%s.json' % (kind, revision, datetime.now().strftime('%Y%m%d-%H%M%S')))
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  with open(path, 'w') as stream:
+    json.dump(document, stream, indent=2, sort_keys=True)
+  return path
@@ -0,0 +1,72 @@
+# puts two result files from bench_routes.py or load_test.py side by side, route by route:
+# p50/p95/p99 latency and statements per request, with the change from the first to the second.
+# exits 1 when a route needs more statements than before, or (with --threshold) when its p95
+# latency grew by more than that many percent.
+#   python benchmarks/compare_results.py BEFORE.json AFTER.json [--threshold PERCENT]
+
+import sys
+import json
+import argparse
+
+
+def load(path):
+  with open(path) as stream:
+    document = json.load(stream)
+  routes = dict(document['results']['routes'])
+  if 'overall' in document['results']:
+    routes['overall'] = document['results']['overall']
+  return document, routes
+
+
+def queries(summary):
+  # bench_routes records the statements of a request, load_test the mean over its requests
+  return summary.get('queries', summary.get('queries_per_request'))
+
+
+def change(before, after):
+  if not before:
+    return '      -'
+  return '%+6.1f%%' % ((after - before) * 100.0 / before)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('before')
+  parser.add_argument('after')
+  parser.add_argument('--threshold', type=float, help='fail when a p95 grows by more than this percentage')
+  options = parser.parse_args()
+
+  before_document, before = load(options.before)
+  after_document, after = load(options.after)
+  if before_document['kind'] != after_document['kind']:
+    sys.exit('cannot compare %s results with %s results' % (before_document['kind'], after_document['kind']))
+  print('%s: %s (%s) -> %s (%s)' % (before_document['kind'], before_document['revision'], before_document['created'],
+    after_document['revision'], after_document['created']))
+  if before_document['results'].get('data') != after_document['results'].get('data'):
+    print('warning: the runs used different data sets')
+
+  print('%-28s %18s %18s %18s %16s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+  failures = []
+  for route in sorted(set(before) | set(after)):
+    if route not in before or route not in after:
+      print('%-28s only in %s' % (route[:28], 'after' if route in after else 'before'))
+      continue
+    old, new = before[route], after[route]
+    columns = []
+    for percentile in ('p50', 'p95', 'p99'):
+      columns.append('%8.2f %s' % (new['latency_ms'][percentile], change(old['latency_ms'][percentile], new['latency_ms'][percentile])))
+    columns.append('%6.2f (%+.2f)' % (queries(new), queries(new) - queries(old)))
+    print('%-28s %s' % (route[:28], ' '.join('%18s' % column for column in columns)))
+    if queries(new) > queries(old):
+      failures.append('%s: %s statements per request, was %s' % (route, queries(new), queries(old)))
+    if options.threshold is not None and old['latency_ms']['p95'] and \
+        (new['latency_ms']['p95'] - old['latency_ms']['p95']) * 100.0 / old['latency_ms']['p95'] > options.threshold:
+      failures.append('%s: p95 %.2f ms, was %.2f ms' % (route, new['latency_ms']['p95'], old['latency_ms']['p95']))
+
+  for failure in failures:
+    print('FAIL %s' % failure)
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,139 @@
+# seeded synthetic data for the benchmark harness.
+# states and genres come from the choice lists in forms.py, with a skew like real listings: a few
+# states hold most venues and artists, within a state a few cities dominate, rock and pop are far
+# more common than musical theatre, and a handful of popular venues and artists play most shows.
+# the same seed always produces the same rows, with show dates relative to the day it runs.
+#   python benchmarks/datagen.py [venues] [artists] [shows] [seed]
+# fills DATABASE_URL (a throwaway sqlite database when unset) and prints what it wrote.
+
+import sys
+import random
+import bisect
+import itertools
+from datetime import datetime, timedelta
+
+from common import load_app
+
+# relative weights, roughly by population; states not listed weigh 1
+STATE_WEIGHTS = {'CA': 12, 'TX': 9, 'FL': 7, 'NY': 6, 'PA': 4, 'IL': 4, 'OH': 4, 'GA': 3, 'NC': 3, 'MI': 3,
+  'NJ': 3, 'VA': 3, 'WA': 3, 'AZ': 2, 'MA': 2, 'TN': 2, 'IN': 2, 'MO': 2, 'MD': 2, 'CO': 2, 'LA': 2, 'OR': 2}
+
+# relative weights of the form's genres; genres not listed weigh 1
+GENRE_WEIGHTS = {'Rock n Roll': 10, 'Pop': 9, 'Hip-Hop': 8, 'Alternative': 6, 'Electronic': 6, 'Country': 5,
+  'R&B': 5, 'Jazz': 4, 'Folk': 4, 'Punk': 3, 'Heavy Metal': 3, 'Soul': 3, 'Blues': 3, 'Reggae': 2, 'Funk': 2}
+
+
+def choice_values(field):
+  # the (value, label) choices of a form field, read off the unbound field on the form class
+  return [value for value, label in field.kwargs['choices']]
+
+
+def zipf_weights(count, s=1.1):
+  return [1.0 / (rank ** s) for rank in range(1, count + 1)]
+
+
+class Picker(object):
+  # weighted choice with the cumulative weights computed once
+  def __init__(self, values, weights, rnd):
+    self.values = values
+    self.cumulative = list(itertools.accumulate(weights))
+    self.rnd = rnd
+
+  def __call__(self):
+    return self.values[bisect.bisect(self.cumulative, self.rnd.random() * self.cumulative[-1])]
+
+  def sample(self, count):
+    # count distinct values
+    picked = []
+    while len(picked) < min(count, len(self.values)):
+      value = self()
+      if value not in picked:
+        picked.append(value)
+    return picked
+
+
+def generate(app_module, venues=1000, artists=1000, shows=10000, seed=42, cities_per_state=20, days=365):
+  # inserts the rows in bulk, bypassing the orm like common.seed(), then fixes the show counters
+  import forms
+  db = app_module.db
+  rnd = random.Random(seed)
+  states = choice_values(forms.VenueForm.state)
+  genres = choice_values(forms.VenueForm.genres)
+  pick_state = Picker(states, [STATE_WEIGHTS.get(state, 1) for state in states], rnd)
+  pick_city = dict((state, Picker(['%s City %d' % (state, i) for i in range(cities_per_state)], zipf_weights(cities_per_state), rnd))
+    for state in states)
+  pick_genre = Picker(genres, [GENRE_WEIGHTS.get(genre, 1) for genre in genres], rnd)
+
+  existing = dict((name, id) for id, name in db.session.query(app_module.Genre.id, app_module.Genre.name))
+  missing = [{'name': genre} for genre in genres if genre not in existing]
+  if missing:
+    db.session.execute(app_module.Genre.__table__.insert(), missing)
+  genre_ids = dict((name, id) for id, name in db.session.query(app_module.Genre.id, app_module.Genre.name))
+  first_venue = (db.session.query(db.func.max(app_module.Venue.id)).scalar() or 0) + 1
+  first_artist = (db.session.query(db.func.max(app_module.Artist.id)).scalar() or 0) + 1
+
+  def place():
+    state = pick_state()
+    return pick_city[state](), state
+
+  venue_rows, venue_links = [], []
+  for i in range(venues):
+    city, state = place()
+    seeking = rnd.random() < 0.3
+    venue_rows.append({'id': first_venue + i, 'name': 'The %s Room %d' % (city.split()[0], i), 'city': city, 'state': state,
+      'address': '%d Main St' % rnd.randint(1, 9999), 'phone': '%03d-%03d-%04d' % (rnd.randint(200, 999), rnd.randint(0, 999), rnd.randint(0, 9999)),
+      'image_link': 'https://example.com/venue/%d.jpg' % i, 'seeking_talent': seeking,
+      'seeking_description': 'Looking for local acts' if seeking else None})
+    venue_links.extend({'venue_id': first_venue + i, 'genre_id': genre_ids[genre]} for genre in pick_genre.sample(rnd.randint(1, 3)))
+  artist_rows, artist_links = [], []
+  for i in range(artists):
+    city, state = place()
+    seeking = rnd.random() < 0.4
+    artist_rows.append({'id': first_artist + i, 'name': 'Artist %d' % i, 'city': city, 'state': state,
+      'image_link': 'https://example.com/artist/%d.jpg' % i, 'seeking_venue': seeking,
+      'seeking_description': 'Booking a tour' if seeking else None})
+    artist_links.extend({'artist_id': first_artist + i, 'genre_id': genre_ids[genre]} for genre in pick_genre.sample(rnd.randint(1, 2)))
+
+  # popularity is zipf over a shuffled order, so the busiest venues aren't simply the lowest ids
+  venue_ids = [row['id'] for row in venue_rows]
+  artist_ids = [row['id'] for row in artist_rows]
+  rnd.shuffle(venue_ids)
+  rnd.shuffle(artist_ids)
+  pick_venue = Picker(venue_ids, zipf_weights(len(venue_ids), 0.9), rnd)
+  pick_artist = Picker(artist_ids, zipf_weights(len(artist_ids), 0.9), rnd)
+  # evening shows on the hour or half hour, spread over the past and next `days` days
+  today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+  show_rows = [{'venue_id': pick_venue(), 'artist_id': pick_artist(),
+    'start_time': today + timedelta(days=rnd.randint(-days, days), hours=rnd.randint(18, 23), minutes=rnd.choice((0, 30)))}
+    for i in range(shows if venue_ids and artist_ids else 0)]
+
+  for table, rows in ((app_module.Venue.__table__, venue_rows), (app_module.venue_genres, venue_links),
+      (app_module.Artist.__table__, artist_rows), (app_module.artist_genres, artist_links), (app_module.Show.__table__, show_rows)):
+    for start in range(0, len(rows), 5000):
+      db.session.execute(table.insert(), rows[start:start + 5000])
+  db.session.commit()
+  for model in (app_module.Venue, app_module.Artist):
+    app_module.show_counter_mismatches(model, fix=True)
+  db.session.commit()
+  return {'venues': len(venue_rows), 'artists': len(artist_rows), 'shows': len(show_rows), 'seed': seed,
+    'venue_genres': len(venue_links), 'artist_genres': len(artist_links)}
+
+
+def busiest(app_module, column):
+  # id of the venue or artist with the most shows, the page a benchmark should hit
+  db = app_module.db
+  row = db.session.query(column, db.func.count()).group_by(column).order_by(db.func.count().desc(), column).first()
+  return row[0] if row else 1
+
+
+def main():
+  args = [int(arg) for arg in sys.argv[1:5]]
+  venues, artists, shows, seed = args + [1000, 1000, 10000, 42][len(args):]
+  app_module = load_app()
+  counts = generate(app_module, venues, artists, shows, seed)
+  print(', '.join('%s=%d' % item for item in sorted(counts.items())))
+  print('database: %s' % app_module.app.config['SQLALCHEMY_DATABASE_URI'])
+
+
+if __name__ == '__main__':
+  main()
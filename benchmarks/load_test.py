@@ -0,0 +1,121 @@
+# concurrent load driver over synthetic data (datagen.py).
+# --threads clients, each with its own flask test client, send a weighted mix of the harness routes
+# (bench_routes.py) for --duration seconds. reported overall and per route: requests, throughput,
+# latency p50/p95/p99, statements per request and errors. results are saved as json for
+# compare_results.py.
+# the clients share one process, so this measures the app under thread concurrency (GIL included),
+# the way a threaded worker serves it; run it against postgres for realistic database contention.
+#   python benchmarks/load_test.py [--threads N] [--duration S] [--venues N] [--artists N]
+#                                  [--shows N] [--seed N] [--cache none|local] [--output PATH]
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+from common import load_app, request_route, save_results, ThreadQueryCounter
+from datagen import generate
+from bench_routes import harness_routes, consume
+
+# how often a visitor hits each kind of route, relative to a detail page
+WEIGHTS = {'/': 2, '/venues': 3, '/artists': 3, '/shows': 4, 'POST': 2, 'genre': 2, 'api': 1}
+
+
+def route_weight(route):
+  if route.startswith('POST'):
+    return WEIGHTS['POST']
+  if '/genre/' in route:
+    return WEIGHTS['genre']
+  if route.startswith('/api/'):
+    return WEIGHTS['api']
+  return WEIGHTS.get(route.split('?')[0], 1)
+
+
+def client_loop(flask_app, routes, weights, deadline, seed, counter, samples, errors):
+  rnd = random.Random(seed)
+  client = flask_app.test_client()
+  while time.perf_counter() < deadline:
+    route = rnd.choices(routes, weights)[0]
+    counter.take()
+    started = time.perf_counter()
+    try:
+      status = consume(request_route(client, route)).status_code
+    except Exception as error:
+      errors.append('%s: %r' % (route, error))
+      continue
+    elapsed = (time.perf_counter() - started) * 1000
+    # list.append is atomic, so the threads share the lists without a lock
+    samples.append((route, elapsed, counter.take(), status))
+
+
+def summarize(samples, seconds):
+  from profiler import percentiles
+  latency = [sample[1] for sample in samples]
+  queries = [sample[2] for sample in samples]
+  return {
+    'requests': len(samples),
+    'throughput_rps': round(len(samples) / seconds, 1),
+    'latency_ms': percentiles(latency),
+    'queries_per_request': round(float(sum(queries)) / len(queries), 2),
+    'queries_max': max(queries),
+    'non_2xx': sum(1 for sample in samples if not 200 <= sample[3] < 300),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--threads', type=int, default=8)
+  parser.add_argument('--duration', type=float, default=10)
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=1000)
+  parser.add_argument('--shows', type=int, default=20000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--cache', default='none', help='CACHE_BACKEND for the run')
+  parser.add_argument('--output', help='where to write the json results')
+  options = parser.parse_args()
+
+  os.environ['CACHE_BACKEND'] = options.cache
+  app_module = load_app()
+  counts = generate(app_module, options.venues, options.artists, options.shows, options.seed)
+  routes = harness_routes(app_module)
+  weights = [route_weight(route) for route in routes]
+  # the clients open their own sessions; the script's app context holds no connection meanwhile
+  app_module.db.session.remove()
+
+  samples, errors = [], []
+  with ThreadQueryCounter() as counter:
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop, args=(app_module.app, routes, weights, started + options.duration,
+      options.seed + i, counter, samples, errors)) for i in range(options.threads)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    seconds = time.perf_counter() - started
+  if not samples:
+    sys.exit('no requests completed: %s' % (errors[:1] or ['nothing ran']))
+
+  results = {'data': counts, 'threads': options.threads, 'duration_s': round(seconds, 2), 'cache': options.cache,
+    'errors': len(errors), 'overall': summarize(samples, seconds), 'routes': {}}
+  for route in routes:
+    route_samples = [sample for sample in samples if sample[0] == route]
+    if route_samples:
+      results['routes'][route] = summarize(route_samples, seconds)
+
+  overall = results['overall']
+  print('%d threads, %.1f s: %d requests, %.1f req/s, %d errors' % (options.threads, seconds, overall['requests'],
+    overall['throughput_rps'], len(errors)))
+  print('%-28s %8s %8s %8s %8s %8s' % ('route', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+  for route, summary in [('overall', overall)] + sorted(results['routes'].items()):
+    latency = summary['latency_ms']
+    print('%-28s %8d %8.2f %8.2f %8.2f %8.2f' % (route[:28], summary['requests'], latency['p50'], latency['p95'],
+      latency['p99'], summary['queries_per_request']))
+  for error in errors[:5]:
+    print('error: %s' % error)
+  print('results: %s' % save_results('load', results, options.output))
+
+
+if __name__ == '__main__':
+  main()
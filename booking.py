@@ -0,0 +1,192 @@
+#----------------------------------------------------------------------------#
+# Show booking.
+#
+# Every path that lists shows one at a time goes through book_shows(): the
+# form handler calls it directly, or hands the show to a ShowWriter when
+# SHOW_WRITE_QUEUE is on and a worker thread books whole batches. For a
+# batch of shows it
+#   - checks every venue and artist exists, in one query
+#   - rejects a show that overlaps another show of the same venue or artist.
+#     A show takes up SHOW_DURATION minutes from its start. The check is one
+#     range query over the (venue_id, start_time) and (artist_id, start_time)
+#     indexes and also covers the shows booked earlier in the same batch
+#   - inserts the rest with one executemany and moves the show counters
+# On postgres the venues and artists involved are locked (transaction
+# scoped advisory locks, taken in key order) before the overlap check, so
+# two concurrent bookings can't both take the same slot.
+#----------------------------------------------------------------------------#
+
+import queue
+import logging
+import threading
+from datetime import timedelta
+
+from flask import current_app
+
+from models import *
+
+logger = logging.getLogger(__name__)
+
+
+def show_request(data):
+  # the (venue_id, artist_id, start_time) to book from validated ShowForm data
+  return (int(data['venue_id'] or 0), int(data['artist_id'] or 0), data['start_time'])
+
+
+def existing_ids(connection, venue_ids, artist_ids):
+  # one query for both sides: which of the given venue and artist ids exist
+  found = connection.execute(db.union_all(
+    db.select([db.literal('venue'), Venue.id]).where(Venue.id.in_(venue_ids)),
+    db.select([db.literal('artist'), Artist.id]).where(Artist.id.in_(artist_ids))))
+  ids = {'venue': set(), 'artist': set()}
+  for side, entity_id in found:
+    ids[side].add(entity_id)
+  return ids
+
+
+def lock_entities(connection, venue_ids, artist_ids):
+  # serializes bookings that share a venue or an artist until the end of the transaction
+  if connection.dialect.name != 'postgresql':
+    return
+  keys = sorted([venue_id * 2 for venue_id in venue_ids] + [artist_id * 2 + 1 for artist_id in artist_ids])
+  connection.execute(db.text('SELECT pg_advisory_xact_lock(key) FROM (SELECT unnest(CAST(:keys AS bigint[])) AS key ORDER BY key) AS keys'),
+    {'keys': keys})
+
+
+def booked_times(connection, venue_ids, artist_ids, start, end):
+  # start times of the shows each venue and artist already has between start and end
+  table = Show.__table__
+  rows = connection.execute(db.union_all(
+    db.select([db.literal('venue'), table.c.venue_id, table.c.start_time])
+      .where(db.and_(table.c.venue_id.in_(venue_ids), table.c.start_time > start, table.c.start_time < end)),
+    db.select([db.literal('artist'), table.c.artist_id, table.c.start_time])
+      .where(db.and_(table.c.artist_id.in_(artist_ids), table.c.start_time > start, table.c.start_time < end))))
+  booked = {'venue': {}, 'artist': {}}
+  for side, entity_id, start_time in rows:
+    booked[side].setdefault(entity_id, []).append(start_time)
+  return booked
+
+
+def book_shows(requests, duration):
+  # requests are (venue_id, artist_id, start_time) tuples and duration a timedelta. books every show
+  # that passes the checks in one transaction and returns, in order, None for each booked show or
+  # the reason it was rejected
+  if not requests:
+    return []
+  connection = db.session.connection()
+  venue_ids = set(venue_id for venue_id, _, _ in requests)
+  artist_ids = set(artist_id for _, artist_id, _ in requests)
+  found = existing_ids(connection, venue_ids, artist_ids)
+  lock_entities(connection, found['venue'], found['artist'])
+  booked = booked_times(connection, found['venue'], found['artist'],
+    min(start_time for _, _, start_time in requests) - duration,
+    max(start_time for _, _, start_time in requests) + duration)
+
+  results, accepted = [], []
+  for venue_id, artist_id, start_time in requests:
+    error = None
+    for side, entity_id in (('venue', venue_id), ('artist', artist_id)):
+      if entity_id not in found[side]:
+        error = 'There is no %s with id %d.' % (side, entity_id)
+        break
+      times = booked[side].setdefault(entity_id, [])
+      if any(abs(start_time - other) < duration for other in times):
+        error = 'The %s already has a show within %d minutes of %s.' % (side, duration.total_seconds() // 60, start_time)
+        break
+    if error is None:
+      booked['venue'][venue_id].append(start_time)
+      booked['artist'][artist_id].append(start_time)
+      accepted.append((venue_id, artist_id, start_time))
+    results.append(error)
+
+  if accepted:
+    connection.execute(Show.__table__.insert(),
+      [{'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time} for venue_id, artist_id, start_time in accepted])
+    apply_show_counters(connection, accepted, 1)
+  db.session.commit()
+  invalidate_booked(accepted)
+  return results
+
+
+def invalidate_booked(shows):
+  page_cache = current_app.extensions.get('page_cache')
+  if page_cache is None or not shows:
+    return
+  keys = set(['venues'])
+  for venue_id, artist_id, _ in shows:
+    keys.add('venue:%d' % venue_id)
+    keys.add('artist:%d' % artist_id)
+  page_cache.invalidate(keys=sorted(keys), namespaces=['shows'])
+
+
+def show_duration(config):
+  return timedelta(minutes=config['SHOW_DURATION'])
+
+
+class ShowWriter(object):
+  # queues show requests and books them in batches of up to batch_size on a worker thread, which
+  # starts with the first submission. rejections only reach the log, since the poster is long gone
+  def __init__(self, app, batch_size=100, wait=0.05):
+    self.app = app
+    self.batch_size = batch_size
+    self.wait = wait
+    self.queue = queue.Queue()
+    self.lock = threading.Lock()
+    self.thread = None
+    self.stats = {'queued': 0, 'booked': 0, 'rejected': 0, 'batches': 0}
+
+  def submit(self, request):
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run, name='show-writer', daemon=True)
+        self.thread.start()
+      self.stats['queued'] += 1
+    self.queue.put(request)
+
+  def flush(self):
+    # blocks until everything submitted so far has been booked or rejected
+    self.queue.join()
+
+  def next_batch(self):
+    batch = [self.queue.get()]
+    while len(batch) < self.batch_size:
+      try:
+        batch.append(self.queue.get(timeout=self.wait))
+      except queue.Empty:
+        break
+    return batch
+
+  def run(self):
+    while True:
+      batch = self.next_batch()
+      with self.app.app_context():
+        try:
+          self.book(batch)
+        finally:
+          db.session.remove()
+          for _ in batch:
+            self.queue.task_done()
+
+  def book(self, batch):
+    duration = show_duration(self.app.config)
+    try:
+      results = book_shows(batch, duration)
+    except Exception:
+      # one bad request shouldn't cost the whole batch: book them one by one instead
+      logger.exception('booking a batch of %d shows failed, retrying one at a time', len(batch))
+      db.session.rollback()
+      results = []
+      for request in batch:
+        try:
+          results.extend(book_shows([request], duration))
+        except Exception as error:
+          db.session.rollback()
+          results.append(str(error))
+    with self.lock:
+      self.stats['batches'] += 1
+      for request, error in zip(batch, results):
+        if error is None:
+          self.stats['booked'] += 1
+        else:
+          self.stats['rejected'] += 1
+          logger.warning('show %r was not listed: %s', request, error)
@@ -0,0 +1,367 @@
+#----------------------------------------------------------------------------#
+# Bulk import and export of venues, artists and shows.
+#
+#   flask bulk import venues venues.csv
+#   flask bulk import shows shows.jsonl --batch-size 10000
+#   flask bulk export shows - --format csv > shows.csv
+#
+# Files are CSV (genres separated by ';') or JSON lines, picked by extension
+# or --format. Rows are streamed in batches; every row is validated with the
+# same form class the create pages use, foreign keys and genres are resolved
+# with one query per batch, and each batch is written in its own transaction
+# with COPY on Postgres or a batched executemany INSERT elsewhere.
+#
+# "flask bulk update" and "flask bulk delete" are defined in editing.py.
+#----------------------------------------------------------------------------#
+
+import io
+import csv
+import sys
+import json
+import time
+import itertools
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.datastructures import MultiDict
+
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres, apply_show_counters
+
+bulk_cli = AppGroup('bulk', help='Bulk import and export of venues, artists and shows.')
+
+VENUE_FIELDS = ['name', 'address', 'city', 'state', 'phone', 'website', 'image_link', 'facebook_link',
+  'seeking_talent', 'seeking_description']
+ARTIST_FIELDS = ['name', 'city', 'state', 'phone', 'website', 'image_link', 'facebook_link',
+  'seeking_venue', 'seeking_description']
+
+# entity -> (model, form class, genre link table, link column, exported/imported columns)
+ENTITIES = {
+  'venues': (Venue, VenueForm, venue_genres, 'venue_id', VENUE_FIELDS),
+  'artists': (Artist, ArtistForm, artist_genres, 'artist_id', ARTIST_FIELDS),
+  'shows': (Show, ShowForm, None, None, ['artist_id', 'venue_id', 'start_time']),
+}
+
+BOOLEAN_FIELDS = ('seeking_talent', 'seeking_venue')
+
+
+class ImportFailed(Exception):
+  pass
+
+
+def detect_format(path, fmt):
+  if fmt:
+    return fmt
+  if path.endswith('.jsonl') or path.endswith('.json'):
+    return 'jsonl'
+  return 'csv'
+
+
+def read_rows(stream, fmt):
+  if fmt == 'csv':
+    for row in csv.DictReader(stream):
+      if row.get('genres') is not None:
+        row['genres'] = [name for name in row['genres'].split(';') if name.strip()]
+      yield row
+  else:
+    for line in stream:
+      if line.strip():
+        yield json.loads(line)
+
+
+def chunks(iterable, size):
+  iterator = iter(iterable)
+  while True:
+    batch = list(itertools.islice(iterator, size))
+    if not batch:
+      return
+    yield batch
+
+
+def form_data(row):
+  # the shape a browser would have posted: lists become repeated keys, booleans the checkbox 'y'
+  data = MultiDict()
+  for key, value in row.items():
+    if value is None:
+      continue
+    if key in BOOLEAN_FIELDS:
+      if str(value).lower() in ('y', 'yes', 'true', '1'):
+        data.add(key, 'y')
+    elif isinstance(value, list):
+      for item in value:
+        data.add(key, item)
+    else:
+      data.add(key, str(value))
+  return data
+
+
+def validate(form_class, row):
+  # returns (cleaned data, None) or (None, errors), using the same validators as the web forms
+  form = form_class(formdata=form_data(row), meta={'csrf': False})
+  if form.validate():
+    return form.data, None
+  return None, form.errors
+
+
+def dialect():
+  return db.engine.dialect.name
+
+
+def allocate_ids(table, count):
+  # ids are handed out up front so genre links can be written in the same batch without RETURNING
+  connection = db.session.connection()
+  if dialect() == 'postgresql':
+    sequence = connection.execute(db.text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table.name}).scalar()
+    return [row[0] for row in connection.execute(db.text('SELECT nextval(:sequence) FROM generate_series(1, :count)'),
+      {'sequence': sequence, 'count': count})]
+  # sqlite and friends: the write transaction serializes writers, so max(id) is stable until commit
+  start = (connection.execute(db.select([db.func.max(table.c.id)])).scalar() or 0) + 1
+  return list(range(start, start + count))
+
+
+def write_rows(table, columns, rows):
+  # COPY on postgres, one executemany INSERT otherwise
+  if not rows:
+    return
+  connection = db.session.connection()
+  if dialect() == 'postgresql':
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+      writer.writerow(['\\N' if row.get(column) is None else row[column] for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\\N')" % (table.name, ', '.join(columns)), buffer)
+  else:
+    connection.execute(table.insert(), [dict((column, row.get(column)) for column in columns) for row in rows])
+
+
+def genre_ids(names):
+  # one select for the genres we know, one insert for the ones we don't
+  names = set(names)
+  if not names:
+    return {}
+  connection = db.session.connection()
+  table = Genre.__table__
+  known = dict((name, genre_id) for genre_id, name in connection.execute(db.select([table.c.id, table.c.name]).where(table.c.name.in_(names))))
+  missing = sorted(names - set(known))
+  if missing:
+    connection.execute(table.insert(), [{'name': name} for name in missing])
+    known.update((name, genre_id) for genre_id, name in connection.execute(db.select([table.c.id, table.c.name]).where(table.c.name.in_(missing))))
+  return known
+
+
+def resolve_ids(model, ids, names):
+  # checks referenced ids exist and maps names to ids, one query each. ambiguous names are left out
+  known_ids = set()
+  by_name = {}
+  if ids:
+    known_ids = set(entity_id for entity_id, in db.session.query(model.id).filter(model.id.in_(ids)))
+  if names:
+    seen = {}
+    for entity_id, name in db.session.query(model.id, model.name).filter(model.name.in_(names)):
+      seen.setdefault(name, []).append(entity_id)
+    by_name = dict((name, found[0]) for name, found in seen.items() if len(found) == 1)
+  return known_ids, by_name
+
+
+def prepare_shows(batch):
+  # fills in venue_id/artist_id from *_name columns and drops rows whose references don't resolve
+  refs = {}
+  for side, model in (('venue', Venue), ('artist', Artist)):
+    ids = set(int(data[side + '_id']) for _, data in batch if str(data.get(side + '_id') or '').isdigit())
+    names = set(row.get(side + '_name') for row, data in batch if not data.get(side + '_id') and row.get(side + '_name'))
+    refs[side] = resolve_ids(model, ids, names)
+
+  records, errors = [], []
+  for row, data in batch:
+    record = {'start_time': data['start_time']}
+    for side in ('venue', 'artist'):
+      known_ids, by_name = refs[side]
+      value = str(data.get(side + '_id') or '')
+      entity_id = int(value) if value.isdigit() else by_name.get(row.get(side + '_name'))
+      if entity_id is None or (value.isdigit() and entity_id not in known_ids):
+        errors.append((row, {side: ['unknown or ambiguous %s %s' % (side, value or row.get(side + '_name'))]}))
+        break
+      record[side + '_id'] = entity_id
+    else:
+      records.append(record)
+  return records, errors
+
+
+def import_batch(entity, batch):
+  model, form_class, link_table, link_column, fields = ENTITIES[entity]
+  table = model.__table__
+  if entity == 'shows':
+    records, errors = prepare_shows(batch)
+    ids = allocate_ids(table, len(records))
+    for record, show_id in zip(records, ids):
+      record['id'] = show_id
+    write_rows(table, ['id', 'artist_id', 'venue_id', 'start_time'], records)
+    # COPY/executemany skip the orm events, so the counters are adjusted here for the whole batch
+    apply_show_counters(db.session.connection(), [(r['venue_id'], r['artist_id'], r['start_time']) for r in records], 1)
+    return records, errors
+
+  records = [data for _, data in batch]
+  ids = allocate_ids(table, len(records))
+  for record, entity_id in zip(records, ids):
+    record['id'] = entity_id
+  write_rows(table, ['id'] + fields, records)
+  genres = genre_ids(name for record in records for name in record.get('genres') or [])
+  write_rows(link_table, [link_column, 'genre_id'], [{link_column: record['id'], 'genre_id': genres[name]}
+    for record in records for name in set(record.get('genres') or [])])
+  return records, []
+
+
+def invalidate_after_import(entity, records):
+  page_cache = current_app.extensions.get('page_cache')
+  if page_cache is None:
+    return
+  if entity == 'venues':
+    page_cache.invalidate(keys=['venues'], namespaces=['venues_by_genre'])
+  elif entity == 'artists':
+    page_cache.invalidate(keys=['artists'], namespaces=['artists_by_genre'])
+  else:
+    keys = set(['venues'])
+    for record in records:
+      keys.add('venue:%d' % record['venue_id'])
+      keys.add('artist:%d' % record['artist_id'])
+    page_cache.invalidate(keys=sorted(keys), namespaces=['shows'])
+
+
+def run_import(entity, stream, fmt, batch_size=5000, max_errors=100, report=None):
+  # returns (imported, rejected). each batch commits on its own, so a failure keeps earlier batches
+  form_class = ENTITIES[entity][1]
+  imported = rejected = 0
+  started = time.perf_counter()
+  for number, rows in enumerate(chunks(read_rows(stream, fmt), batch_size)):
+    batch, errors = [], []
+    for offset, row in enumerate(rows):
+      data, problems = validate(form_class, row)
+      if problems:
+        errors.append((number * batch_size + offset + 1, problems))
+      else:
+        batch.append((row, data))
+    try:
+      records, unresolved = import_batch(entity, batch)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+    invalidate_after_import(entity, records)
+    errors.extend((None, problems) for _, problems in unresolved)
+
+    imported += len(records)
+    rejected += len(errors)
+    if report:
+      for line, problems in errors:
+        report('rejected%s: %s' % (' row %d' % line if line else '', json.dumps(problems, default=str)))
+      elapsed = time.perf_counter() - started
+      report('%d %s imported, %d rejected, %.0f rows/sec' % (imported, entity, rejected, (imported + rejected) / elapsed if elapsed else 0))
+    if max_errors is not None and rejected > max_errors:
+      raise ImportFailed('more than %d rejected rows, stopping' % max_errors)
+  return imported, rejected
+
+
+def export_rows(entity, batch_size=5000):
+  # streams rows with a server side cursor (yield_per), looking genres up once per batch
+  model, form_class, link_table, link_column, fields = ENTITIES[entity]
+  if entity == 'shows':
+    query = db.session.query(Show.id, Show.artist_id, Artist.name.label('artist_name'), Show.venue_id,
+        Venue.name.label('venue_name'), Show.start_time) \
+      .join(Artist, Artist.id == Show.artist_id) \
+      .join(Venue, Venue.id == Show.venue_id) \
+      .order_by(Show.id)
+    for row in query.yield_per(batch_size):
+      yield row._asdict()
+    return
+
+  query = db.session.query(model.id, *[getattr(model, field) for field in fields]).order_by(model.id)
+  for batch in chunks(query.yield_per(batch_size), batch_size):
+    names = {}
+    link_ids = link_table.c[link_column]
+    genre_rows = db.session.query(link_ids, Genre.name) \
+      .join(Genre, Genre.id == link_table.c.genre_id) \
+      .filter(link_ids.in_([row.id for row in batch])) \
+      .order_by(Genre.name)
+    for entity_id, name in genre_rows:
+      names.setdefault(entity_id, []).append(name)
+    for row in batch:
+      record = row._asdict()
+      record['genres'] = names.get(row.id, [])
+      yield record
+
+
+def export_columns(entity):
+  if entity == 'shows':
+    return ['id', 'artist_id', 'artist_name', 'venue_id', 'venue_name', 'start_time']
+  return ['id'] + ENTITIES[entity][4] + ['genres']
+
+
+def copy_shows_out(stream):
+  # postgres can write the csv itself
+  cursor = db.session.connection().connection.cursor()
+  cursor.copy_expert('COPY (SELECT show.id, show.artist_id, artist.name AS artist_name, show.venue_id, venue.name AS venue_name, show.start_time '
+    'FROM show JOIN artist ON artist.id = show.artist_id JOIN venue ON venue.id = show.venue_id ORDER BY show.id) '
+    'TO STDOUT WITH (FORMAT csv, HEADER)', stream)
+
+
+def run_export(entity, stream, fmt, batch_size=5000):
+  if entity == 'shows' and fmt == 'csv' and dialect() == 'postgresql':
+    copy_shows_out(stream)
+    return db.session.query(db.func.count(Show.id)).scalar()
+  count = 0
+  if fmt == 'csv':
+    writer = csv.DictWriter(stream, fieldnames=export_columns(entity))
+    writer.writeheader()
+    for record in export_rows(entity, batch_size):
+      if 'genres' in record:
+        record['genres'] = ';'.join(record['genres'])
+      writer.writerow(record)
+      count += 1
+  else:
+    for record in export_rows(entity, batch_size):
+      stream.write(json.dumps(record, default=str) + '\n')
+      count += 1
+  return count
+
+
+@bulk_cli.command('import')
+@click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, help='Rows per transaction.')
+@click.option('--max-errors', default=100, help='Stop after this many rejected rows.')
+def import_command(entity, path, fmt, batch_size, max_errors):
+  """Import venues, artists or shows from a CSV or JSONL file ('-' for stdin)."""
+  fmt = detect_format(path, fmt)
+  stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+  report = lambda message: click.echo(message, err=True)
+  try:
+    imported, rejected = run_import(entity, stream, fmt, batch_size, max_errors, report)
+  except ImportFailed as error:
+    raise click.ClickException(str(error))
+  finally:
+    if stream is not sys.stdin:
+      stream.close()
+  click.echo('imported %d %s, rejected %d' % (imported, entity, rejected))
+
+
+@bulk_cli.command('export')
+@click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, help='Rows fetched per round trip.')
+def export_command(entity, path, fmt, batch_size):
+  """Export venues, artists or shows to a CSV or JSONL file ('-' for stdout)."""
+  fmt = detect_format(path, fmt)
+  stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+  started = time.perf_counter()
+  try:
+    count = run_export(entity, stream, fmt, batch_size)
+  finally:
+    if stream is not sys.stdout:
+      stream.close()
+  elapsed = time.perf_counter() - started
+  click.echo('exported %d %s, %.0f rows/sec' % (count, entity, count / elapsed if elapsed else 0), err=True)
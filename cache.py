@@ -0,0 +1,307 @@
+#----------------------------------------------------------------------------#
+# Read-through page cache.
+#
+# Rendered pages are cached under keys built from the entity id (venue:3,
+# artist:7) or the listing they belong to (venues, shows:<query string>).
+# Write handlers invalidate exactly the keys they affect. Listings that have
+# many variants (every /shows page, every genre page) live in a namespace
+# whose generation number is bumped to drop them all at once.
+#
+# Generation numbers never share the page LRU: an evicted one would restart
+# at 0 and bring back pages already dropped. With the local backend, or
+# caching disabled, they are kept in-process in Counters.
+# Template fragments of {% cache %} blocks (fragment(), see templating.py)
+# are kept in the same backend, keyed on database state the template passes.
+#
+# Backends:
+#   local   - in-process LRU with per-entry TTL
+#   shared  - any redis-like client (get/set with ex/delete/incr), so every
+#             worker sees the same entries and invalidations. CACHE_URL
+#             'local://' uses LocalStandInClient, an in-memory stand-in with
+#             the same interface, which is what tests and sqlite setups use.
+#   none    - caching disabled
+#
+# conditional_get() adds the HTTP side: Cache-Control on every response and,
+# for pages with a last-modified validator, a strong ETag / Last-Modified
+# pair so browsers and the CDN can revalidate with a 304 that never renders.
+# Both come from the database alone, so every worker gives an unchanged page
+# the same ETag, and a restart can't repeat one for different content.
+#
+# cached() and page_cache look the app's PageCache up through current_app,
+# so views can be decorated before create_app() has built one.
+#----------------------------------------------------------------------------#
+
+import time
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+from datetime import timezone
+
+from flask import g, request, session, abort, make_response, current_app
+from werkzeug.local import LocalProxy
+from werkzeug.http import is_resource_modified
+
+
+class LocalCache(object):
+  # least recently used entries are evicted once max_entries is reached; expired entries are dropped on read
+  def __init__(self, max_entries=1024):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.evictions = 0
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      value, expires_at = entry
+      if expires_at is not None and expires_at <= time.time():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl=None):
+    with self.lock:
+      self.entries[key] = (value, time.time() + ttl if ttl else None)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+
+  def delete(self, *keys):
+    with self.lock:
+      for key in keys:
+        self.entries.pop(key, None)
+
+  def incr(self, key):
+    with self.lock:
+      value = self.entries.get(key, (0, None))[0] + 1
+      self.entries[key] = (value, None)
+      return value
+
+  def __len__(self):
+    return len(self.entries)
+
+
+class Counters(object):
+  # namespace generation counters; unlike LocalCache nothing is ever evicted
+  def __init__(self):
+    self.values = {}
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      return self.values.get(key)
+
+  def incr(self, key):
+    with self.lock:
+      value = self.values.get(key, 0) + 1
+      self.values[key] = value
+      return value
+
+
+class LocalStandInClient(object):
+  # the subset of the redis client api SharedCache uses, kept in memory.
+  # values come back as bytes, like they would from a real server. counters
+  # live outside the LRU, as keys without a ttl do under redis' volatile-lru
+  def __init__(self, max_entries=1024):
+    self.store = LocalCache(max_entries)
+    self.counters = Counters()
+
+  def get(self, key):
+    value = self.counters.get(key)
+    return self.store.get(key) if value is None else value
+
+  def set(self, key, value, ex=None):
+    if isinstance(value, str):
+      value = value.encode('utf-8')
+    self.store.set(key, value, ex)
+    return True
+
+  def delete(self, *keys):
+    self.store.delete(*keys)
+
+  def incr(self, key):
+    return self.counters.incr(key)
+
+
+class SharedCache(object):
+  # adapts a redis-like client to the LocalCache interface; pages are stored as utf-8
+  def __init__(self, client, prefix='fyyur:'):
+    self.client = client
+    self.prefix = prefix
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    if isinstance(value, bytes):
+      value = value.decode('utf-8')
+    return value
+
+  def set(self, key, value, ttl=None):
+    self.client.set(self.prefix + key, value, ex=ttl)
+
+  def delete(self, *keys):
+    if keys:
+      self.client.delete(*[self.prefix + key for key in keys])
+
+  def incr(self, key):
+    return self.client.incr(self.prefix + key)
+
+
+class PageCache(object):
+  def __init__(self, backend, ttl=60):
+    self.backend = backend
+    self.ttl = ttl
+    # a shared backend keeps the generations every worker has to agree on; anything else counts in-process
+    self.generation_store = backend if isinstance(backend, SharedCache) else Counters()
+    self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'invalidations': 0, 'fragment_hits': 0, 'fragment_misses': 0}
+    self.stats_lock = threading.Lock()
+
+  def count(self, stat, amount=1):
+    with self.stats_lock:
+      self.stats[stat] += amount
+
+  def namespaced(self, namespace, key):
+    generation = self.generation_store.get('generation:' + namespace) or 0
+    return '%s:%s:%s' % (namespace, generation, key)
+
+  def serve(self, key, namespace, view, kwargs):
+    # pages are neither served from nor written to the cache while a flash message is waiting, so
+    # one visitor's message is never shown to another
+    if self.backend is None or request.method != 'GET' or session.get('_flashes'):
+      return view(**kwargs)
+    cache_key = key(**kwargs) if callable(key) else key.format(**kwargs)
+    # under conditional_get the page's etag is part of the key, so a cached copy can never be
+    # served (and revalidated) as a newer version than the one it was rendered from. the etag
+    # moves with the database, so a write in any process retires the page, invalidate() or not
+    if g.get('page_etag'):
+      cache_key += '@' + g.page_etag
+    if namespace:
+      cache_key = self.namespaced(namespace, cache_key)
+    page = self.backend.get(cache_key)
+    if page is not None:
+      self.count('hits')
+      return page
+    self.count('misses')
+    page = view(**kwargs)
+    if isinstance(page, str):
+      self.backend.set(cache_key, page, self.ttl)
+      self.count('sets')
+    return page
+
+  def cached(self, key, namespace=None):
+    # decorator for GET views returning rendered html, cached in this instance
+    def decorator(view):
+      @functools.wraps(view)
+      def wrapper(**kwargs):
+        return self.serve(key, namespace, view, kwargs)
+      return wrapper
+    return decorator
+
+  def fragment(self, name, state, render):
+    # a rendered template fragment, cached under its name and the state values it was rendered from
+    cache_key = 'fragment:%s:%s' % (name, ':'.join(str(value) for value in state))
+    page = self.backend.get(cache_key)
+    if page is not None:
+      self.count('fragment_hits')
+      return page
+    self.count('fragment_misses')
+    page = render()
+    self.backend.set(cache_key, page, self.ttl)
+    return page
+
+  def invalidate(self, keys=(), namespaces=()):
+    keys = list(keys)
+    if keys and self.backend is not None:
+      self.backend.delete(*keys)
+    for namespace in namespaces:
+      self.generation_store.incr('generation:' + namespace)
+    self.count('invalidations', len(keys) + len(namespaces))
+
+  def get_stats(self):
+    with self.stats_lock:
+      stats = dict(self.stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(float(stats['hits']) / lookups, 4) if lookups else 0.0
+    lookups = stats['fragment_hits'] + stats['fragment_misses']
+    stats['fragment_hit_rate'] = round(float(stats['fragment_hits']) / lookups, 4) if lookups else 0.0
+    if isinstance(self.backend, LocalCache):
+      stats['entries'] = len(self.backend)
+      stats['evictions'] = self.backend.evictions
+    return stats
+
+
+# the current app's PageCache, for views and helpers defined before any app exists
+page_cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+
+
+def cached(key, namespace=None):
+  # decorator for GET views returning rendered html, cached in the current app's page cache. key is
+  # a format string filled from the view arguments, or a callable taking them
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      return current_app.extensions['page_cache'].serve(key, namespace, view, kwargs)
+    return wrapper
+  return decorator
+
+
+def conditional_get(last_modified=None, cache_control=None):
+  # decorator for GET views. cache_control names the config key holding the Cache-Control value.
+  # last_modified is a callable taking the view arguments and returning
+  # the (naive, local) time the page last changed, or None for a missing entity (404). it should
+  # be one cheap query: when the client's validators still match, the view is never called.
+  # pages with a waiting flash message are private and carry no validators
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      if request.method != 'GET' or session.get('_flashes'):
+        response = make_response(view(**kwargs))
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+      if last_modified is not None:
+        modified = last_modified(**kwargs)
+        if modified is None:
+          abort(404)
+        modified = modified.astimezone(timezone.utc)
+        etag = hashlib.sha1(('%s|%s' % (request.path, modified.isoformat())).encode('utf-8')).hexdigest()
+        g.page_etag = etag
+        if not is_resource_modified(request.environ, etag, last_modified=modified):
+          response = make_response('', 304)
+        else:
+          response = make_response(view(**kwargs))
+        if response.status_code in (200, 304):
+          response.set_etag(etag)
+          response.last_modified = modified
+      else:
+        response = make_response(view(**kwargs))
+      if cache_control and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = current_app.config[cache_control]
+      return response
+    return wrapper
+  return decorator
+
+
+def make_page_cache(config):
+  name = config.get('CACHE_BACKEND', 'local')
+  if name == 'none':
+    backend = None
+  elif name == 'local':
+    backend = LocalCache(config.get('CACHE_MAX_ENTRIES', 1024))
+  elif name == 'shared':
+    url = config.get('CACHE_URL', 'local://')
+    if url.startswith('local://'):
+      client = LocalStandInClient(config.get('CACHE_MAX_ENTRIES', 1024))
+    else:
+      try:
+        import redis
+      except ImportError:
+        raise RuntimeError('CACHE_BACKEND "shared" with CACHE_URL %r needs the redis package installed' % url)
+      client = redis.Redis.from_url(url)
+    backend = SharedCache(client)
+  else:
+    raise ValueError('unknown CACHE_BACKEND %r, expected local, shared or none' % name)
+  return PageCache(backend, config.get('CACHE_DEFAULT_TTL', 60))
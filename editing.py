@@ -0,0 +1,325 @@
+#----------------------------------------------------------------------------#
+# Edits and deletes of venues and artists.
+#
+#   flask bulk update venues changes.csv
+#   flask bulk delete artists stale.jsonl --batch-size 500
+#   POST /admin/venues/update, POST /admin/artists/delete (a JSON list of rows)
+#
+# The edit pages and the batch paths share these functions. A row names the
+# entity's id, optionally the version it was read at, and only the fields
+# that change. Each batch is checked and written in its own transaction:
+#
+#   - the rows' current versions are read (and locked) with one SELECT; rows
+#     that moved past the version they name are reported as conflicts and
+#     left alone, ids that don't exist as missing
+#   - updates are one executemany UPDATE per set of changed columns, guarded
+#     on the version read, and bump the version and updated_at (which the
+#     page validators and the similarity refresh go by). a new name or image
+#     also bumps updated_at of every entity on the other side sharing a show,
+#     whose pages list it
+#   - deletes remove the entities' shows with one DELETE ... IN per batch,
+#     not the orm cascade that loads every show first. the other side's
+#     show counters are adjusted from one grouped count, which also bumps
+#     its updated_at, and the shows' days are marked for the report rollups
+#
+# Page caches, the search index and the venue proximity index are brought
+# up to date after each commit.
+#----------------------------------------------------------------------------#
+
+import sys
+import json
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+
+from models import *
+from geo import gazetteer
+from reports import day_of
+from bulk import bulk_cli, ENTITIES, chunks, genre_ids, form_data, read_rows, detect_format
+
+# entity -> (the show column pointing at it, the model and show column on the other side)
+SIDES = {
+  'venues': (Show.venue_id, Artist, Show.artist_id),
+  'artists': (Show.artist_id, Venue, Show.venue_id),
+}
+
+# fields shown on the other side's pages and the shows listing, so changing them invalidates those
+LISTED_FIELDS = ('name', 'image_link')
+
+
+def clean_changes(entity, row):
+  # (changes, None) or (None, errors). only the fields present in row are validated and changed,
+  # with the validators of the form the create pages use
+  model, form_class, link_table, link_column, fields = ENTITIES[entity]
+  errors = {}
+  changes = {}
+  for key in ('id', 'version'):
+    value = row.get(key)
+    if value is None or value == '':
+      if key == 'id':
+        errors['id'] = ['an id is required']
+      continue
+    try:
+      changes[key] = int(value)
+    except (TypeError, ValueError):
+      errors[key] = ['must be a number']
+  supplied = [name for name in fields + ['genres'] if name in row and row[name] is not None]
+  form = form_class(formdata=form_data(row), meta={'csrf': False})
+  form.validate()
+  # an optional field sent empty is cleared rather than checked, an empty link is not an invalid one
+  cleared = set(name for name in supplied if row[name] == '' and not form[name].flags.required)
+  errors.update((name, problems) for name, problems in form.errors.items() if name in supplied and name not in cleared)
+  if errors:
+    return None, errors
+  changes.update((name, None if name in cleared else form.data[name]) for name in supplied)
+  return changes, None
+
+
+def current_versions(table, ids, columns=()):
+  # {id: row} for the ids that exist, locked until the transaction ends
+  query = db.select([table.c.id, table.c.version] + [table.c[column] for column in columns]) \
+    .where(table.c.id.in_(ids)).with_for_update()
+  return dict((row.id, row) for row in db.session.connection().execute(query))
+
+
+def check_versions(rows, current):
+  # (rows to apply, conflicting ids, missing ids)
+  applied, conflicts, missing = [], [], []
+  for row in rows:
+    found = current.get(row['id'])
+    if found is None:
+      missing.append(row['id'])
+    elif row.get('version') is not None and row['version'] != found.version:
+      conflicts.append(row['id'])
+    else:
+      applied.append(row)
+  return applied, conflicts, missing
+
+
+def update_batch(entity, rows):
+  # applies one batch of cleaned rows inside the current transaction, returns
+  # (applied rows, conflicting ids, missing ids)
+  model, form_class, link_table, link_column, fields = ENTITIES[entity]
+  table = model.__table__
+  connection = db.session.connection()
+  located = entity == 'venues'
+  current = current_versions(table, [row['id'] for row in rows], ('city', 'state') if located else ())
+  applied, conflicts, missing = check_versions(rows, current)
+
+  # a venue that moves is geocoded again from the bundled gazetteer, as a new one is
+  for row in applied:
+    if located and ('city' in row or 'state' in row):
+      found = current[row['id']]
+      location = gazetteer.lookup(row.get('city', found.city), row.get('state', found.state))
+      row['latitude'], row['longitude'] = location[:2] if location is not None else (None, None)
+
+  by_columns = {}
+  for row in applied:
+    columns = tuple(sorted(name for name in row if name in fields or name in ('latitude', 'longitude')))
+    by_columns.setdefault(columns, []).append(row)
+  for columns, group in by_columns.items():
+    # the bound names can't be the column names, sqlalchemy reserves those for the SET clause
+    statement = table.update() \
+      .where(db.and_(table.c.id == db.bindparam('row_id'), table.c.version == db.bindparam('row_version'))) \
+      .values(dict([(column, db.bindparam('new_' + column)) for column in columns] + [('version', table.c.version + 1)]))
+    connection.execute(statement, [dict([('row_id', row['id']), ('row_version', current[row['id']].version)] +
+      [('new_' + column, row[column]) for column in columns]) for row in group])
+
+  relinked = [row for row in applied if 'genres' in row]
+  if relinked:
+    links = link_table.c[link_column]
+    connection.execute(link_table.delete().where(links.in_([row['id'] for row in relinked])))
+    genres = genre_ids(name for row in relinked for name in row['genres'])
+    new_links = [{link_column: row['id'], 'genre_id': genres[name]} for row in relinked for name in set(row['genres'])]
+    if new_links:
+      connection.execute(link_table.insert(), new_links)
+
+  # the other side's pages list this side's names and images next to their shows, so their
+  # validators have to move with it, as they do when a show is booked
+  listed = [row['id'] for row in applied if any(name in row for name in LISTED_FIELDS)]
+  if listed:
+    own_column, other_model, other_column = SIDES[entity]
+    others = db.select([other_column]).where(own_column.in_(listed)).distinct()
+    other_table = other_model.__table__
+    connection.execute(other_table.update().where(other_table.c.id.in_(others)).values(updated_at=datetime.now()))
+  return applied, conflicts, missing
+
+
+def delete_batch(entity, rows):
+  # deletes one batch of entities with their shows and genre links inside the current transaction,
+  # returns (deleted ids, ids on the other side that lost shows, shows deleted, conflicts, missing)
+  model, form_class, link_table, link_column, fields = ENTITIES[entity]
+  own_column, other_model, other_column = SIDES[entity]
+  table = model.__table__
+  connection = db.session.connection()
+  applied, conflicts, missing = check_versions(rows, current_versions(table, [row['id'] for row in rows]))
+  ids = [row['id'] for row in applied]
+  if not ids:
+    return [], set(), 0, conflicts, missing
+
+  # what the shows counted for on the other side, grouped rather than loaded show by show
+  watermark = rollover_watermark(connection)
+  upcoming = db.func.count(db.case([(Show.start_time > watermark, Show.id)]))
+  past = db.func.count(db.case([(Show.start_time <= watermark, Show.id)]))
+  counts = connection.execute(db.select([other_column, upcoming, past]).where(own_column.in_(ids)).group_by(other_column)).fetchall()
+  bump_show_counters(connection, other_model, dict((other_id, -n) for other_id, n, _ in counts), 'upcoming_shows_count')
+  bump_show_counters(connection, other_model, dict((other_id, -n) for other_id, _, n in counts), 'past_shows_count')
+  days = db.select([day_of(Show.start_time)]).where(own_column.in_(ids)).distinct()
+  mark_rollup_days(connection, [day for day, in connection.execute(days)])
+
+  shows = connection.execute(Show.__table__.delete().where(own_column.in_(ids))).rowcount
+  connection.execute(link_table.delete().where(link_table.c[link_column].in_(ids)))
+  connection.execute(table.delete().where(table.c.id.in_(ids)))
+  return ids, set(other_id for other_id, _, _ in counts), shows, conflicts, missing
+
+
+def invalidate_after_update(entity, rows):
+  model, form_class, link_table, link_column, fields = ENTITIES[entity]
+  singular = entity[:-1]
+  keys = set([entity] + ['%s:%d' % (singular, row['id']) for row in rows])
+  namespaces = [entity + '_by_genre']
+  listed = [row['id'] for row in rows if any(name in row for name in LISTED_FIELDS)]
+  if listed:
+    # the other side's pages show this side's names and images next to their shows
+    own_column, other_model, other_column = SIDES[entity]
+    others = db.session.query(other_column).filter(own_column.in_(listed)).distinct()
+    keys.update('%s:%d' % (other_model.__tablename__, other_id) for other_id, in others)
+    namespaces.append('shows')
+  current_app.extensions['page_cache'].invalidate(keys=sorted(keys), namespaces=namespaces)
+  for row in rows:
+    if 'name' in row:
+      current_app.extensions['search'][entity].add(row['id'], row['name'])
+    if 'latitude' in row:
+      current_app.extensions['geo'].add(row['id'], row['latitude'], row['longitude'])
+
+
+def invalidate_after_delete(entity, ids, others):
+  own_column, other_model, other_column = SIDES[entity]
+  keys = ['venues', 'artists'] + ['%s:%d' % (entity[:-1], entity_id) for entity_id in ids] + \
+    ['%s:%d' % (other_model.__tablename__, other_id) for other_id in sorted(others)]
+  current_app.extensions['page_cache'].invalidate(keys=keys, namespaces=['venues_by_genre', 'artists_by_genre', 'shows'])
+  for entity_id in ids:
+    current_app.extensions['search'][entity].remove(entity_id)
+    if entity == 'venues':
+      current_app.extensions['geo'].remove(entity_id)
+
+
+def update_entities(entity, rows, batch_size=1000):
+  # rows are cleaned changes (clean_changes). each batch commits on its own, so a failure keeps the
+  # batches before it. returns {'updated': [ids], 'conflicts': [ids], 'missing': [ids]}
+  result = {'updated': [], 'conflicts': [], 'missing': []}
+  for batch in chunks(rows, batch_size):
+    try:
+      applied, conflicts, missing = update_batch(entity, batch)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+    invalidate_after_update(entity, applied)
+    result['updated'].extend(row['id'] for row in applied)
+    result['conflicts'].extend(conflicts)
+    result['missing'].extend(missing)
+  return result
+
+
+def delete_entities(entity, rows, batch_size=1000):
+  # rows are {'id': ..., 'version': ... or None}. batches commit on their own, as updates do.
+  # returns {'deleted': [ids], 'shows': count, 'conflicts': [ids], 'missing': [ids]}
+  result = {'deleted': [], 'shows': 0, 'conflicts': [], 'missing': []}
+  for batch in chunks(rows, batch_size):
+    try:
+      ids, others, shows, conflicts, missing = delete_batch(entity, batch)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+    invalidate_after_delete(entity, ids, others)
+    result['deleted'].extend(ids)
+    result['shows'] += shows
+    result['conflicts'].extend(conflicts)
+    result['missing'].extend(missing)
+  return result
+
+
+def delete_rows(rows):
+  # (rows, errors) for delete: ids, or {'id': ..., 'version': ...} rows as read from a file
+  cleaned, errors = [], []
+  for number, row in enumerate(rows):
+    if not isinstance(row, dict):
+      row = {'id': row}
+    try:
+      cleaned.append({'id': int(row['id']), 'version': int(row['version']) if row.get('version') not in (None, '') else None})
+    except (KeyError, TypeError, ValueError):
+      errors.append((number + 1, {'id': ['an id, and optionally a version, must be numbers']}))
+  return cleaned, errors
+
+
+def change_rows(entity, rows):
+  # (rows, errors) for update
+  cleaned, errors = [], []
+  for number, row in enumerate(rows):
+    changes, problems = clean_changes(entity, row) if isinstance(row, dict) else (None, {'row': ['must be an object']})
+    if problems:
+      errors.append((number + 1, problems))
+    else:
+      cleaned.append(changes)
+  return cleaned, errors
+
+
+#  Commands
+#  ----------------------------------------------------------------
+#  the update and delete commands of "flask bulk", next to import and export
+
+def read_changes(path, fmt):
+  # csv cells left empty mean "unchanged", as a csv can't tell an empty value from a missing one
+  stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+  try:
+    for row in read_rows(stream, fmt):
+      if fmt == 'csv':
+        row = dict((key, value) for key, value in row.items() if value not in ('', []))
+      yield row
+  finally:
+    if stream is not sys.stdin:
+      stream.close()
+
+
+def report_result(entity, verb, result, errors, started):
+  for line, problems in errors:
+    click.echo('rejected row %d: %s' % (line, json.dumps(problems, default=str)), err=True)
+  for entity_id in result['conflicts']:
+    click.echo('conflict: %s %d changed since the version given' % (entity[:-1], entity_id), err=True)
+  for entity_id in result['missing']:
+    click.echo('missing: no %s %d' % (entity[:-1], entity_id), err=True)
+  done = len(result[verb])
+  elapsed = time.perf_counter() - started
+  click.echo('%s %d %s%s, %d conflicts, %d missing, %d rejected, %.0f rows/sec' % (verb, done, entity,
+    ' and %d shows' % result['shows'] if 'shows' in result else '', len(result['conflicts']), len(result['missing']),
+    len(errors), done / elapsed if elapsed else 0))
+
+
+@bulk_cli.command('update')
+@click.argument('entity', type=click.Choice(['artists', 'venues']))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, help='Rows per transaction.')
+def update_command(entity, path, fmt, batch_size):
+  """Update venues or artists from a CSV or JSONL file of id, optional version and changed fields."""
+  started = time.perf_counter()
+  rows, errors = change_rows(entity, read_changes(path, detect_format(path, fmt)))
+  result = update_entities(entity, rows, batch_size)
+  report_result(entity, 'updated', result, errors, started)
+
+
+@bulk_cli.command('delete')
+@click.argument('entity', type=click.Choice(['artists', 'venues']))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, help='Entities per transaction.')
+def delete_command(entity, path, fmt, batch_size):
+  """Delete venues or artists, with their shows, listed by id (and optional version) in a CSV or JSONL file."""
+  started = time.perf_counter()
+  rows, errors = delete_rows(read_changes(path, detect_format(path, fmt)))
+  result = delete_entities(entity, rows, batch_size)
+  report_result(entity, 'deleted', result, errors, started)
@@ -4,11 +4,16 @@ from fabric.contrib.console import confirm
 # prepare for deployment
 
 
+# the checks in benchmarks/ fail on a query budget, missing index or routing regression
+CHECKS = (
+    "python benchmarks/check_query_counts.py && python benchmarks/check_indexes.py"
+    " && python benchmarks/check_replica_routing.py"
+)
+
+
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local(CHECKS, capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -39,9 +44,16 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run 'python benchmarks/check_query_counts.py && python benchmarks/check_indexes.py'")
+
+
+def bench(before=None):
+    # route benchmarks and a load run, saved under benchmarks/results; compared with an earlier
+    # result file when given, e.g. fab bench:before=benchmarks/results/routes-abc1234-....json
+    local("python benchmarks/bench_routes.py --output benchmarks/results/routes-latest.json")
+    local("python benchmarks/load_test.py")
+    if before:
+        local("python benchmarks/compare_results.py %s benchmarks/results/routes-latest.json" % before)
 
 
 def deploy():
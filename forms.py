@@ -1,16 +1,30 @@
 from datetime import datetime
 from flask_wtf import Form
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, AnyOf, URL, Regexp
+
+class FlexibleDateTimeField(DateTimeField):
+    # accepts anything dateutil can parse ('2020-05-01 20:00', iso timestamps, ...), as the
+    # show form always has
+    def process_formdata(self, valuelist):
+        if valuelist:
+            # imported here so loading the forms doesn't pull in dateutil at startup
+            import dateutil.parser
+            try:
+                self.data = dateutil.parser.parse(' '.join(valuelist))
+            except (ValueError, OverflowError):
+                self.data = None
+                raise ValueError(self.gettext('Not a valid datetime value'))
 
 class ShowForm(Form):
+    # ids may be left empty by bulk imports that name the venue/artist instead
     artist_id = StringField(
-        'artist_id'
+        'artist_id', validators=[Regexp(r'^\d*$', message='Artist ID must be a number.')]
     )
     venue_id = StringField(
-        'venue_id'
+        'venue_id', validators=[Regexp(r'^\d*$', message='Venue ID must be a number.')]
     )
-    start_time = DateTimeField(
+    start_time = FlexibleDateTimeField(
         'start_time',
         validators=[DataRequired()],
         default= datetime.today()
@@ -0,0 +1,396 @@
+#----------------------------------------------------------------------------#
+# Venue locations: geocoding and proximity search.
+#
+# Venues get a latitude/longitude from the gazetteer bundled in
+# data/gazetteer.csv, without any network access. A (city, state) pair is
+# looked up there, and a state's centroid is used when the city isn't
+# listed. Venues are geocoded as they are created, and "flask geocode"
+# fills in rows created any other way (bulk imports, older rows).
+#
+# Proximity backends, chosen by GEO_BACKEND:
+#
+#   grid  - a pure python grid index held in the process: cells of
+#           GEO_CELL_DEGREES, searched ring by ring outwards from the query
+#           point, stopping as soon as no unvisited cell can hold a closer
+#           venue. Built lazily from the table, per worker, and brought up
+#           to date before each query with the rows written since (by any
+#           worker or cli command), see models.TableSync.
+#   sql   - a latitude/longitude bounding box over ix_venue_latitude_longitude
+#           (migration d2e4f6a8b0c3), with exact distances computed on the
+#           rows it returns. Works on any database.
+#
+# Both answer "the k nearest venues, optionally within r km" with
+# great-circle distances, returned as (venue id, km) pairs.
+#----------------------------------------------------------------------------#
+
+import os
+import csv
+import math
+import heapq
+import threading
+
+import click
+from flask.cli import with_appcontext
+
+from models import TableSync
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.csv')
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+  lat1, lng1, lat2, lng2 = math.radians(lat1), math.radians(lng1), math.radians(lat2), math.radians(lng2)
+  h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+#  Geocoding
+#  ----------------------------------------------------------------
+
+def normalize_place(name):
+  # 'St. Louis', 'saint louis' and 'St Louis' are the same place
+  name = ' '.join((name or '').lower().replace('.', ' ').split())
+  if name.startswith('st '):
+    name = 'saint ' + name[3:]
+  return name
+
+
+class Gazetteer(object):
+  def __init__(self, path=GAZETTEER_PATH):
+    self.path = path
+    self.places = None
+    self.lock = threading.Lock()
+
+  def load(self):
+    # read on first use: rows with an empty city are the state's centroid
+    with self.lock:
+      if self.places is None:
+        places = {}
+        with open(self.path, newline='') as stream:
+          for row in csv.DictReader(stream):
+            places[(normalize_place(row['city']), row['state'].upper())] = (float(row['latitude']), float(row['longitude']))
+        self.places = places
+    return self.places
+
+  def lookup(self, city, state):
+    # (latitude, longitude, precision) with precision 'city' or 'state', or None
+    places = self.places if self.places is not None else self.load()
+    state = (state or '').strip().upper()
+    location = places.get((normalize_place(city), state))
+    if location is not None:
+      return location + ('city',)
+    location = places.get(('', state))
+    if location is not None:
+      return location + ('state',)
+    return None
+
+
+gazetteer = Gazetteer()
+
+
+@click.command('geocode')
+@click.option('--all', 'everything', is_flag=True, help='Geocode every venue again, not just those without a location.')
+@click.option('--batch-size', type=int, default=1000, help='Venues updated per transaction.')
+@with_appcontext
+def geocode_command(everything, batch_size):
+  """Fill in venue latitude/longitude from the bundled gazetteer."""
+  from flask import current_app
+  from models import db, Venue
+  counts = {'city': 0, 'state': 0, 'unmatched': 0}
+  after = 0
+  while True:
+    # keyset over the id, so each batch is one indexed range read however far along we are
+    query = db.session.query(Venue.id, Venue.city, Venue.state).filter(Venue.id > after)
+    if not everything:
+      query = query.filter(Venue.latitude.is_(None))
+    rows = query.order_by(Venue.id).limit(batch_size).all()
+    if not rows:
+      break
+    after = rows[-1].id
+    updates = []
+    for row in rows:
+      location = gazetteer.lookup(row.city, row.state)
+      if location is None:
+        counts['unmatched'] += 1
+        continue
+      counts[location[2]] += 1
+      updates.append({'venue_id': row.id, 'latitude': location[0], 'longitude': location[1]})
+    if updates:
+      db.session.execute(Venue.__table__.update().where(Venue.id == db.bindparam('venue_id'))
+        .values(latitude=db.bindparam('latitude'), longitude=db.bindparam('longitude')), updates)
+    db.session.commit()
+    geo = current_app.extensions.get('geo')
+    if geo is not None:
+      for update in updates:
+        geo.add(update['venue_id'], update['latitude'], update['longitude'])
+  page_cache = current_app.extensions.get('page_cache')
+  if page_cache is not None and (counts['city'] or counts['state']):
+    page_cache.invalidate(keys=['venues'])
+  click.echo('geocoded %d venues by city, %d by state centroid; %d unmatched' % (counts['city'], counts['state'], counts['unmatched']))
+
+
+#  Grid index
+#  ----------------------------------------------------------------
+
+class GridIndex(object):
+  # points bucketed into cells of cell_degrees x cell_degrees. a nearest query visits the cells in
+  # rings around the query point's cell; after ring r every unvisited point is at least
+  # ring_bound(r) away, so the search stops once it has k points closer than that.
+  # the occupied cells are also grouped into blocks of COARSE x COARSE cells, for queries from
+  # where venues are sparse
+  COARSE = 16
+
+  def __init__(self, cell_degrees=0.02):
+    self.cell = cell_degrees
+    self.rows = int(math.ceil(180 / cell_degrees))
+    self.columns = int(math.ceil(360 / cell_degrees))
+    self.cells = {}
+    self.blocks = {}
+    self.points = {}
+    self.lock = threading.Lock()
+
+  def key(self, lat, lng):
+    row = min(self.rows - 1, max(0, int((lat + 90) // self.cell)))
+    return row, int((lng + 180) // self.cell) % self.columns
+
+  def add(self, point_id, lat, lng):
+    with self.lock:
+      self._remove(point_id)
+      self.points[point_id] = (lat, lng)
+      key = self.key(lat, lng)
+      if key not in self.cells:
+        self.cells[key] = []
+        self.blocks.setdefault(self.block(key), set()).add(key)
+      self.cells[key].append((point_id, lat, lng))
+
+  def remove(self, point_id):
+    with self.lock:
+      self._remove(point_id)
+
+  def _remove(self, point_id):
+    location = self.points.pop(point_id, None)
+    if location is None:
+      return
+    key = self.key(*location)
+    # cells are replaced rather than edited, so a query iterating the old list is unaffected
+    remaining = [point for point in self.cells[key] if point[0] != point_id]
+    if remaining:
+      self.cells[key] = remaining
+    else:
+      del self.cells[key]
+      block = self.blocks[self.block(key)]
+      block.discard(key)
+      if not block:
+        del self.blocks[self.block(key)]
+
+  def block(self, key):
+    return key[0] // self.COARSE, key[1] // self.COARSE
+
+  def __len__(self):
+    return len(self.points)
+
+  def ring_bound(self, r, lat):
+    # lower bound in km on the distance to any point in rings beyond r, from a query point anywhere
+    # in the centre cell: its row is at least r cells of latitude away, or its column at least r
+    # cells of longitude away at a latitude no higher than the rows of ring r + 1 reach
+    if r <= 0:
+      return 0.0
+    step = math.radians(r * self.cell)
+    highest = min(90.0, abs(lat) + (r + 1) * self.cell)
+    by_longitude = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(math.radians(highest)) * math.sin(min(step, math.pi) / 2)))
+    return min(EARTH_RADIUS_KM * step, by_longitude)
+
+  def ring(self, center, r):
+    # the cells at chebyshev distance r from center; callers stop before the ring wraps around
+    row, column = center
+    if r == 0:
+      yield center
+      return
+    for ring_row in range(row - r, row + r + 1):
+      if not 0 <= ring_row < self.rows:
+        continue
+      if ring_row in (row - r, row + r):
+        ring_columns = range(column - r, column + r + 1)
+      else:
+        ring_columns = (column - r, column + r)
+      for ring_column in ring_columns:
+        yield ring_row, ring_column % self.columns
+
+  def nearest(self, lat, lng, k, max_km=None):
+    # the k nearest points as (km, id), closest first, optionally only those within max_km
+    center = self.key(lat, lng)
+    cells = self.cells
+    best = []
+    visited = 0
+    r = 0
+    while True:
+      for key in self.ring(center, r):
+        points = cells.get(key)
+        if points:
+          self.collect(points, lat, lng, k, max_km, best)
+      visited += 8 * r or 1
+      bound = self.ring_bound(r, lat)
+      if (len(best) == k and -best[0][0] <= bound) or (max_km is not None and bound > max_km):
+        break
+      if visited > len(cells) or 2 * r + 3 >= self.columns:
+        # sparse data (the rings are mostly empty cells) or a ring about to wrap around the globe:
+        # go through the occupied cells that are left instead
+        self.scan_cells(lat, lng, k, max_km, best, r)
+        break
+      r += 1
+    return sorted((-distance, point_id) for distance, point_id in best)
+
+  def collect(self, points, lat, lng, k, max_km, best):
+    # best is a max-heap of (-km, id) holding the k closest so far. the difference in latitude
+    # alone puts a floor under the distance, which rules most points out without a haversine
+    limit = max_km if max_km is not None else float('inf')
+    if len(best) == k:
+      limit = min(limit, -best[0][0])
+    for point_id, point_lat, point_lng in points:
+      if abs(point_lat - lat) * KM_PER_DEGREE > limit:
+        continue
+      distance = haversine_km(lat, lng, point_lat, point_lng)
+      if distance > limit:
+        continue
+      if len(best) < k:
+        heapq.heappush(best, (-distance, point_id))
+      elif distance < -best[0][0]:
+        heapq.heapreplace(best, (-distance, point_id))
+      if len(best) == k:
+        limit = min(limit, -best[0][0])
+
+  def scan_cells(self, lat, lng, k, max_km, best, visited_rings):
+    # the occupied cells outside the rings already searched, nearest first: blocks are opened into
+    # their cells as the search reaches them. nothing in a cell or block is closer than its centre
+    # less half its diagonal
+    center_row, center_column = self.key(lat, lng)
+    cells = self.cells
+    candidates = []
+    for block, keys in list(self.blocks.items()):
+      candidates.append((self.cell_bound(lat, lng, block[0], block[1], self.COARSE), 0, block, keys))
+    heapq.heapify(candidates)
+    while candidates:
+      bound, is_cell, key, contents = heapq.heappop(candidates)
+      if (len(best) == k and -best[0][0] <= bound) or (max_km is not None and bound > max_km):
+        break
+      if is_cell:
+        self.collect(contents, lat, lng, k, max_km, best)
+        continue
+      for row, column in list(contents):
+        column_distance = min((column - center_column) % self.columns, (center_column - column) % self.columns)
+        points = cells.get((row, column))
+        if points and max(abs(row - center_row), column_distance) > visited_rings:
+          heapq.heappush(candidates, (self.cell_bound(lat, lng, row, column, 1), 1, (row, column), points))
+
+  def cell_bound(self, lat, lng, row, column, size):
+    # size x size cells from (row, column) * size; a degree of longitude is never longer than a
+    # degree of latitude, so half the diagonal in degrees of latitude covers the whole block
+    degrees = self.cell * size
+    cell_lat = (row + 0.5) * degrees - 90
+    cell_lng = (column + 0.5) * degrees - 180
+    return haversine_km(lat, lng, cell_lat, cell_lng) - degrees * KM_PER_DEGREE * 0.7072
+
+
+#  Backends
+#  ----------------------------------------------------------------
+
+class GridGeoBackend(object):
+  def __init__(self, db, model, cell_degrees):
+    self.db = db
+    self.model = model
+    self.cell_degrees = cell_degrees
+    self.index = GridIndex(cell_degrees)
+    self.table = TableSync(db, model, model.latitude, model.longitude)
+    self.lock = threading.Lock()
+
+  def sync(self):
+    # built from the table on the first query in this process, then kept up to date from it
+    with self.lock:
+      changes = self.table.changed()
+      if changes is None:
+        return
+      rebuild, rows = changes
+      # a rebuilt index is filled before it replaces the old one, which queries keep using until then
+      index = GridIndex(self.cell_degrees) if rebuild else self.index
+      for entity_id, lat, lng in rows:
+        if lat is None or lng is None:
+          index.remove(entity_id)
+        else:
+          index.add(entity_id, lat, lng)
+      self.index = index
+
+  def add(self, entity_id, lat, lng):
+    # this process's own writes show up at once, without waiting for the next query's sync
+    if self.table.state is not None:
+      if lat is None or lng is None:
+        self.index.remove(entity_id)
+      else:
+        self.index.add(entity_id, lat, lng)
+
+  def remove(self, entity_id):
+    with self.lock:
+      self.index.remove(entity_id)
+      self.table.forget(entity_id)
+
+  def nearest(self, lat, lng, k, max_km=None):
+    self.sync()
+    return [(entity_id, distance) for distance, entity_id in self.index.nearest(lat, lng, k, max_km)]
+
+
+class SqlGeoBackend(object):
+  def __init__(self, db, model, cell_degrees):
+    self.db = db
+    self.model = model
+    self.start_km = max(1.0, cell_degrees * KM_PER_DEGREE * 5)
+
+  def add(self, entity_id, lat, lng):
+    # the database indexes itself
+    pass
+
+  def remove(self, entity_id):
+    pass
+
+  def within(self, lat, lng, radius_km):
+    # rows inside the bounding box of the circle, then exact distances
+    model = self.model
+    lat_span = radius_km / KM_PER_DEGREE
+    query = self.db.session.query(model.id, model.latitude, model.longitude) \
+      .filter(model.latitude.between(lat - lat_span, lat + lat_span))
+    cos_lat = math.cos(math.radians(min(90.0, abs(lat) + lat_span)))
+    lng_span = radius_km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360
+    if lng_span < 180 and -180 <= lng - lng_span and lng + lng_span <= 180:
+      query = query.filter(model.longitude.between(lng - lng_span, lng + lng_span))
+    else:
+      query = query.filter(model.longitude.isnot(None))
+    matches = []
+    for entity_id, point_lat, point_lng in query:
+      distance = haversine_km(lat, lng, point_lat, point_lng)
+      if distance <= radius_km:
+        matches.append((distance, entity_id))
+    return matches
+
+  def nearest(self, lat, lng, k, max_km=None):
+    # widens the box until it holds k venues; the k nearest inside a circle are the k nearest overall
+    radius = min(self.start_km, max_km) if max_km is not None else self.start_km
+    while True:
+      matches = self.within(lat, lng, radius)
+      if len(matches) >= k or radius >= (max_km if max_km is not None else math.pi * EARTH_RADIUS_KM):
+        break
+      radius = min(radius * 4, max_km if max_km is not None else math.pi * EARTH_RADIUS_KM)
+    return [(entity_id, distance) for distance, entity_id in heapq.nsmallest(k, matches)]
+
+
+BACKENDS = {
+  'grid': GridGeoBackend,
+  'sql': SqlGeoBackend,
+}
+
+
+def make_geo_backend(name, db, model, cell_degrees):
+  try:
+    backend = BACKENDS[name]
+  except KeyError:
+    raise ValueError('unknown GEO_BACKEND %r, expected one of %s' % (name, ', '.join(sorted(BACKENDS))))
+  return backend(db, model, cell_degrees)
@@ -0,0 +1,290 @@
+#----------------------------------------------------------------------------#
+# Prometheus metrics.
+#
+# GET /metrics serves the text exposition format (version 0.0.4):
+#
+#   fyyur_http_requests_total{endpoint,method,status}        counter
+#   fyyur_http_request_duration_seconds{endpoint}            histogram
+#   fyyur_template_render_seconds{template}                  histogram
+#   fyyur_http_errors_total{code}                            counter, from the 404/500 handlers
+#   fyyur_db_pool_checkouts_total                            counter
+#   fyyur_db_pool_checkout_wait_seconds                      histogram
+#   fyyur_db_pool_size / _checked_out / _overflow            gauges
+#
+# Counters are sharded per thread: a thread only ever writes its own dict,
+# so recording takes no lock, and a scrape adds up a copy of every shard.
+# Shards of threads that have exited are folded into one retired total at
+# scrape time, so a thread-per-request server doesn't grow the list.
+# Histograms are stored as one counter per bucket and made cumulative when
+# they are written out.
+#
+# Pre-fork servers: with METRICS_DIR set, every process writes its totals
+# to METRICS_DIR/metrics-<pid>.json at most every METRICS_FLUSH_INTERVAL
+# seconds, and a scrape, whichever process gets it, sums all the files.
+# Gauges are only taken from processes that are still running. Shards are
+# reset in a forked child so it doesn't count its parent's requests again.
+#----------------------------------------------------------------------------#
+
+import os
+import json
+import time
+import threading
+
+from flask import g, request, Response, has_request_context
+from sqlalchemy import event
+
+from profiler import ProfiledTemplate, render_listeners
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+HELP = {
+  'fyyur_http_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+  'fyyur_http_request_duration_seconds': ('histogram', 'Request latency, by endpoint.'),
+  'fyyur_template_render_seconds': ('histogram', 'Template render time, by template.'),
+  'fyyur_http_errors_total': ('counter', 'Responses from the 404 and 500 error handlers.'),
+  'fyyur_db_pool_checkouts_total': ('counter', 'Connections checked out of the pool.'),
+  'fyyur_db_pool_checkout_wait_seconds': ('histogram', 'Time spent waiting for a pool connection.'),
+  'fyyur_db_pool_size': ('gauge', 'Configured pool size.'),
+  'fyyur_db_pool_checked_out': ('gauge', 'Connections currently checked out.'),
+  'fyyur_db_pool_overflow': ('gauge', 'Connections open beyond the pool size.'),
+}
+
+
+def bucket_for(seconds):
+  for le in BUCKETS:
+    if seconds <= le:
+      return le
+  return BUCKETS[-1]
+
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    for name, value in labels)
+
+
+def format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if isinstance(value, float) and not value.is_integer() else '%d' % value
+
+
+class Metrics(object):
+  def __init__(self, app=None, db=None):
+    self.local = threading.local()
+    self.shards = []
+    self.retired = {}
+    self.shards_lock = threading.Lock()
+    self.last_flush = 0.0
+    self.engines = []
+    if hasattr(os, 'register_at_fork'):
+      os.register_at_fork(after_in_child=self.reset)
+    if app is not None:
+      self.init_app(app, db)
+
+  def init_app(self, app, db):
+    self.directory = app.config['METRICS_DIR']
+    self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+    app.extensions['metrics'] = self
+    app.jinja_env.template_class = ProfiledTemplate
+    if self.observe_render not in render_listeners:
+      render_listeners.append(self.observe_render)
+    app.before_request(self.start_request)
+    app.after_request(self.note_status)
+    app.teardown_request(self.finish_request)
+    with app.app_context():
+      self.watch_engine(db.engine)
+
+  def reset(self):
+    self.local = threading.local()
+    self.shards = []
+    self.retired = {}
+    self.shards_lock = threading.Lock()
+    self.last_flush = 0.0
+
+  #  Recording
+  #  ----------------------------------------------------------------
+
+  def shard(self):
+    values = getattr(self.local, 'values', None)
+    if values is None:
+      values = self.local.values = {}
+      # once per thread; after this the shard is only ever written by its own thread
+      with self.shards_lock:
+        self.shards.append((threading.current_thread(), values))
+    return values
+
+  def inc(self, name, labels=(), amount=1):
+    values = self.shard()
+    key = (name, labels)
+    values[key] = values.get(key, 0) + amount
+
+  def observe(self, name, labels, seconds):
+    values = self.shard()
+    for key in ((name + '_bucket', labels + (('le', bucket_for(seconds)),)), (name + '_count', labels)):
+      values[key] = values.get(key, 0) + 1
+    key = (name + '_sum', labels)
+    values[key] = values.get(key, 0.0) + seconds
+
+  def count_error(self, code):
+    self.inc('fyyur_http_errors_total', (('code', str(code)),))
+
+  def start_request(self):
+    g.metrics_started = time.perf_counter()
+
+  def note_status(self, response):
+    g.metrics_status = response.status_code
+    return response
+
+  def finish_request(self, exception=None):
+    started = g.pop('metrics_started', None)
+    if started is None:
+      return
+    endpoint = request.endpoint or 'unmatched'
+    status = g.pop('metrics_status', None) if exception is None else 500
+    self.inc('fyyur_http_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', str(status))))
+    self.observe('fyyur_http_request_duration_seconds', (('endpoint', endpoint),), time.perf_counter() - started)
+    if self.directory and time.time() - self.last_flush >= self.flush_interval:
+      self.flush()
+
+  def observe_render(self, template, seconds):
+    if has_request_context():
+      self.observe('fyyur_template_render_seconds', (('template', template),), seconds)
+
+  def watch_engine(self, engine):
+    pool = engine.pool
+    self.engines.append(engine)
+    event.listen(pool, 'checkout', lambda *args: self.inc('fyyur_db_pool_checkouts_total'))
+    # the pool has no event before a checkout starts, so the wait is timed around connect() itself
+    connect = pool.connect
+    def timed_connect():
+      started = time.perf_counter()
+      try:
+        return connect()
+      finally:
+        self.observe('fyyur_db_pool_checkout_wait_seconds', (), time.perf_counter() - started)
+    pool.connect = timed_connect
+
+  #  Collecting
+  #  ----------------------------------------------------------------
+
+  def totals(self):
+    # this process's counters summed over its threads. dict() copies a shard in one step under the GIL
+    with self.shards_lock:
+      live = []
+      for thread, values in self.shards:
+        if thread.is_alive():
+          live.append((thread, values))
+        else:
+          add_values(self.retired, values)
+      self.shards = live
+      totals = dict(self.retired)
+    for thread, values in live:
+      add_values(totals, dict(values))
+    return totals
+
+  def gauges(self):
+    gauges = {}
+    for engine in self.engines:
+      pool = engine.pool
+      for name, method in (('fyyur_db_pool_size', 'size'), ('fyyur_db_pool_checked_out', 'checkedout'), ('fyyur_db_pool_overflow', 'overflow')):
+        if hasattr(pool, method):
+          gauges[(name, ())] = gauges.get((name, ()), 0) + getattr(pool, method)()
+    return gauges
+
+  def flush(self):
+    # written to a temporary file and renamed, so a scrape never reads half a file
+    self.last_flush = time.time()
+    path = os.path.join(self.directory, 'metrics-%d.json' % os.getpid())
+    data = {
+      'counters': [[name, list(labels), value] for (name, labels), value in self.totals().items()],
+      'gauges': [[name, list(labels), value] for (name, labels), value in self.gauges().items()],
+    }
+    with open(path + '.tmp', 'w') as stream:
+      json.dump(data, stream)
+    os.replace(path + '.tmp', path)
+
+  def collect(self):
+    if not self.directory:
+      return self.totals(), self.gauges()
+    self.flush()
+    counters, gauges = {}, {}
+    for filename in os.listdir(self.directory):
+      if not (filename.startswith('metrics-') and filename.endswith('.json')):
+        continue
+      try:
+        with open(os.path.join(self.directory, filename)) as stream:
+          data = json.load(stream)
+      except (IOError, ValueError):
+        continue
+      for name, labels, value in data['counters']:
+        key = (name, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+      if process_alive(int(filename[len('metrics-'):-len('.json')])):
+        for name, labels, value in data['gauges']:
+          key = (name, tuple(tuple(label) for label in labels))
+          gauges[key] = gauges.get(key, 0) + value
+    return counters, gauges
+
+  def exposition(self):
+    counters, gauges = self.collect()
+    series = {}
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+      family = name
+      for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in HELP:
+          family = name[:-len(suffix)]
+      series.setdefault(family, []).append((name, labels, value))
+
+    lines = []
+    for family in sorted(series):
+      kind, text = HELP.get(family, ('untyped', ''))
+      lines.append('# HELP %s %s' % (family, text))
+      lines.append('# TYPE %s %s' % (family, kind))
+      if kind == 'histogram':
+        lines.extend(histogram_lines(family, series[family]))
+      else:
+        for name, labels, value in sorted(series[family], key=lambda item: item[1]):
+          lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+  def response(self):
+    return Response(self.exposition(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def histogram_lines(family, samples):
+  # buckets are stored per bucket; prometheus wants them cumulative, with every bound present
+  by_labels = {}
+  for name, labels, value in samples:
+    if name.endswith('_bucket'):
+      base = tuple(label for label in labels if label[0] != 'le')
+      le = dict(labels)['le']
+      by_labels.setdefault(base, {}).setdefault('buckets', {})[le] = value
+    else:
+      by_labels.setdefault(labels, {})[name[len(family):]] = value
+  lines = []
+  for labels in sorted(by_labels):
+    entry = by_labels[labels]
+    running = 0
+    for le in BUCKETS:
+      running += entry.get('buckets', {}).get(le, 0)
+      lines.append('%s_bucket%s %s' % (family, format_labels(labels + (('le', format_value(le)),)), format_value(running)))
+    lines.append('%s_sum%s %s' % (family, format_labels(labels), format_value(entry.get('_sum', 0.0))))
+    lines.append('%s_count%s %s' % (family, format_labels(labels), format_value(entry.get('_count', 0))))
+  return lines
+
+
+def add_values(totals, values):
+  for key, value in values.items():
+    totals[key] = totals.get(key, 0) + value
+
+
+def process_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+  return True
@@ -0,0 +1,35 @@
+"""trigram and full text search indexes on venue and artist names
+
+Revision ID: 3c5e7a1d9b20
+Revises: 1a2569e42a9f
+Create Date: 2020-03-24 10:12:41.204118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e7a1d9b20'
+down_revision = '1a2569e42a9f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # these are postgres index types, other databases fall back to plain ILIKE scans
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('venue', 'artist'):
+        # serves ILIKE '%term%' and similarity() ranking for the sql backend
+        op.execute('CREATE INDEX ix_{0}_name_trgm ON {0} USING gin (name gin_trgm_ops)'.format(table))
+        # serves word-prefix to_tsquery matches for the fts backend
+        op.execute("CREATE INDEX ix_{0}_name_tsv ON {0} USING gin (to_tsvector('simple', coalesce(name, '')))".format(table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ('venue', 'artist'):
+        op.execute('DROP INDEX IF EXISTS ix_{0}_name_tsv'.format(table))
+        op.execute('DROP INDEX IF EXISTS ix_{0}_name_trgm'.format(table))
@@ -0,0 +1,98 @@
+"""normalize genres into a genre table with venue/artist association tables
+
+Revision ID: 5b8d2f4e6a31
+Revises: 3c5e7a1d9b20
+Create Date: 2020-03-28 14:03:52.771930
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8d2f4e6a31'
+down_revision = '3c5e7a1d9b20'
+branch_labels = None
+depends_on = None
+
+# the old columns hold postgres array literals such as {Jazz,"Rock n Roll"}
+ARRAY_ITEM = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,{}]+)')
+
+
+def parse_genres(value):
+    if not value:
+        return []
+    names = []
+    for quoted, bare in ARRAY_ITEM.findall(value):
+        name = (quoted.replace('\\"', '"').replace('\\\\', '\\') if quoted else bare).strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def format_genres(names):
+    return '{' + ','.join('"%s"' % name.replace('\\', '\\\\').replace('"', '\\"') for name in names) + '}'
+
+
+def upgrade():
+    op.create_table('genre',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table('venue_genres',
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_venue_genres_genre_id_venue_id', 'venue_genres', ['genre_id', 'venue_id'], unique=False)
+    op.create_table('artist_genres',
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_artist_genres_genre_id_artist_id', 'artist_genres', ['genre_id', 'artist_id'], unique=False)
+
+    # data migration: decode the stringified arrays once, here, instead of on every page render
+    bind = op.get_bind()
+    links = {'venue': [], 'artist': []}
+    for table in links:
+        for row_id, value in bind.execute(sa.text('SELECT id, genres FROM %s' % table)):
+            links[table].extend((row_id, name) for name in parse_genres(value))
+
+    names = sorted(set(name for rows in links.values() for _, name in rows))
+    genre_table = sa.table('genre', sa.column('id', sa.Integer), sa.column('name', sa.String))
+    if names:
+        op.bulk_insert(genre_table, [{'name': name} for name in names])
+    genre_ids = dict((name, genre_id) for genre_id, name in bind.execute(sa.text('SELECT id, name FROM genre')))
+
+    for table in links:
+        rows = [{table + '_id': row_id, 'genre_id': genre_ids[name]} for row_id, name in links[table]]
+        if rows:
+            op.bulk_insert(sa.table(table + '_genres', sa.column(table + '_id', sa.Integer), sa.column('genre_id', sa.Integer)), rows)
+        op.drop_column(table, 'genres')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('genres', sa.String(), nullable=True))
+        grouped = {}
+        query = sa.text('SELECT link.{0}_id, genre.name FROM {0}_genres link JOIN genre ON genre.id = link.genre_id ORDER BY genre.name'.format(table))
+        for row_id, name in bind.execute(query):
+            grouped.setdefault(row_id, []).append(name)
+        for row_id, names in grouped.items():
+            bind.execute(sa.text('UPDATE %s SET genres = :genres WHERE id = :id' % table), {'genres': format_genres(names), 'id': row_id})
+
+    op.drop_index('ix_artist_genres_genre_id_artist_id', table_name='artist_genres')
+    op.drop_table('artist_genres')
+    op.drop_index('ix_venue_genres_genre_id_venue_id', table_name='venue_genres')
+    op.drop_table('venue_genres')
+    op.drop_table('genre')
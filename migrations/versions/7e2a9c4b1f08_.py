@@ -0,0 +1,47 @@
+"""denormalized upcoming/past show counters on venue and artist
+
+Revision ID: 7e2a9c4b1f08
+Revises: 5b8d2f4e6a31
+Create Date: 2020-04-02 09:41:17.503662
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2a9c4b1f08'
+down_revision = '5b8d2f4e6a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_counter_rollover',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill against the same watermark the app will use from now on
+    now = datetime.now()
+    bind = op.get_bind()
+    bind.execute(sa.text('INSERT INTO show_counter_rollover (id, rolled_over_at) VALUES (1, :now)'), {'now': now})
+    for table in ('venue', 'artist'):
+        bind.execute(sa.text(
+            'UPDATE {0} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM show WHERE show.{0}_id = {0}.id AND show.start_time > :now), '
+            'past_shows_count = (SELECT count(*) FROM show WHERE show.{0}_id = {0}.id AND show.start_time <= :now)'.format(table)
+        ), {'now': now})
+
+
+def downgrade():
+    for table in ('artist', 'venue'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
+    op.drop_table('show_counter_rollover')
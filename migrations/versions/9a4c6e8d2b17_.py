@@ -0,0 +1,72 @@
+"""show indexes and not null constraints
+
+Revision ID: 9a4c6e8d2b17
+Revises: 7e2a9c4b1f08
+Create Date: 2020-04-06 16:25:08.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c6e8d2b17'
+down_revision = '7e2a9c4b1f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows the app can never display: shows missing a side of the booking were already dropped
+    # by every joined query, and venues/artists without a name or location break the listings
+    bind = op.get_bind()
+    touched = dict((table, [row[0] for row in bind.execute(sa.text(
+        'SELECT DISTINCT {0}_id FROM show WHERE {0}_id IS NOT NULL AND (artist_id IS NULL OR venue_id IS NULL)'.format(table)))])
+        for table in ('venue', 'artist'))
+    op.execute('DELETE FROM show WHERE artist_id IS NULL OR venue_id IS NULL')
+
+    # the previous revision already counted those shows on their one known side; recount that side
+    # against the same rollover watermark the backfill used
+    now = bind.execute(sa.text('SELECT rolled_over_at FROM show_counter_rollover WHERE id = 1')).scalar()
+    for table, ids in touched.items():
+        for offset in range(0, len(ids), 1000):
+            bind.execute(sa.text(
+                'UPDATE {0} SET '
+                'upcoming_shows_count = (SELECT count(*) FROM show WHERE show.{0}_id = {0}.id AND show.start_time > :now), '
+                'past_shows_count = (SELECT count(*) FROM show WHERE show.{0}_id = {0}.id AND show.start_time <= :now) '
+                'WHERE id IN :ids'.format(table)
+            ).bindparams(sa.bindparam('ids', expanding=True)), {'now': now, 'ids': ids[offset:offset + 1000]})
+
+    for table in ('venue', 'artist'):
+        for column in ('name', 'city', 'state'):
+            op.execute("UPDATE {0} SET {1} = '' WHERE {1} IS NULL".format(table, column))
+
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.alter_column('artist_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('venue_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index('ix_show_venue_id_start_time', ['venue_id', 'start_time'], unique=False)
+        batch_op.create_index('ix_show_artist_id_start_time', ['artist_id', 'start_time'], unique=False)
+        batch_op.create_index('ix_show_start_time_id', ['start_time', 'id'], unique=False)
+
+    for table in ('venue', 'artist'):
+        with op.batch_alter_table(table) as batch_op:
+            for column in ('name', 'city', 'state'):
+                batch_op.alter_column(column, existing_type=sa.String(), nullable=False)
+
+    op.create_index('ix_venue_city_state_id', 'venue', ['city', 'state', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_city_state_id', table_name='venue')
+
+    for table in ('artist', 'venue'):
+        with op.batch_alter_table(table) as batch_op:
+            for column in ('name', 'city', 'state'):
+                batch_op.alter_column(column, existing_type=sa.String(), nullable=True)
+
+    with op.batch_alter_table('show') as batch_op:
+        batch_op.drop_index('ix_show_start_time_id')
+        batch_op.drop_index('ix_show_artist_id_start_time')
+        batch_op.drop_index('ix_show_venue_id_start_time')
+        batch_op.alter_column('venue_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('artist_id', existing_type=sa.Integer(), nullable=True)
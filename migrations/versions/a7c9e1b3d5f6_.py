@@ -0,0 +1,28 @@
+"""version column on venue and artist for optimistic concurrency on edits
+
+Revision ID: a7c9e1b3d5f6
+Revises: f4a6c8e0b2d5
+Create Date: 2020-04-09 16:02:44.506139
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c9e1b3d5f6'
+down_revision = 'f4a6c8e0b2d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows start at version 1, as new ones do
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    for table in ('venue', 'artist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
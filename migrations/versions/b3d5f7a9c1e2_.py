@@ -0,0 +1,32 @@
+"""updated_at on venue and artist for conditional GET
+
+Revision ID: b3d5f7a9c1e2
+Revises: 9a4c6e8d2b17
+Create Date: 2020-04-08 11:42:37.506113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d5f7a9c1e2'
+down_revision = '9a4c6e8d2b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # added nullable and backfilled first: sqlite can't add a column with a non-constant default
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE {0} SET updated_at = CURRENT_TIMESTAMP'.format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False,
+                server_default=sa.func.now())
+
+
+def downgrade():
+    for table in ('artist', 'venue'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
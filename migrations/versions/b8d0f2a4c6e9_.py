@@ -0,0 +1,25 @@
+"""updated_at indexes for the api listing validators
+
+Revision ID: b8d0f2a4c6e9
+Revises: a7c9e1b3d5f6
+Create Date: 2020-04-10 10:12:35.641207
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d0f2a4c6e9'
+down_revision = 'a7c9e1b3d5f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venue_updated_at', 'venue', ['updated_at'], unique=False)
+    op.create_index('ix_artist_updated_at', 'artist', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artist_updated_at', table_name='artist')
+    op.drop_index('ix_venue_updated_at', table_name='venue')
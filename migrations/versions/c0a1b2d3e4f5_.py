@@ -0,0 +1,63 @@
+"""venue, artist and show tables as the app first created them
+
+Revision ID: c0a1b2d3e4f5
+Revises: 
+Create Date: 2020-03-10 17:20:41.309127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c0a1b2d3e4f5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the app used to run db.create_all() at startup, so the revisions after this one assume these
+    # tables already exist. databases created that way are already past it; on a fresh one
+    # "flask db upgrade" now builds the whole schema
+    op.create_table('venue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('genres', sa.String(), nullable=True),
+        sa.Column('address', sa.String(), nullable=True),
+        sa.Column('city', sa.String(), nullable=True),
+        sa.Column('state', sa.String(), nullable=True),
+        sa.Column('phone', sa.String(), nullable=True),
+        sa.Column('website', sa.String(), nullable=True),
+        sa.Column('image_link', sa.String(), nullable=True),
+        sa.Column('facebook_link', sa.String(), nullable=True),
+        sa.Column('seeking_talent', sa.Boolean(), nullable=True),
+        sa.Column('seeking_description', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('artist',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('city', sa.String(), nullable=True),
+        sa.Column('state', sa.String(), nullable=True),
+        sa.Column('phone', sa.String(), nullable=True),
+        sa.Column('genres', sa.String(), nullable=True),
+        sa.Column('image_link', sa.String(), nullable=True),
+        sa.Column('facebook_link', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('show',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=True),
+        sa.Column('venue_id', sa.Integer(), nullable=True),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ),
+        sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('show')
+    op.drop_table('artist')
+    op.drop_table('venue')
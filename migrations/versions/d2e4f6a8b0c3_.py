@@ -0,0 +1,30 @@
+"""latitude and longitude on venue for proximity search
+
+Revision ID: d2e4f6a8b0c3
+Revises: b3d5f7a9c1e2
+Create Date: 2020-04-09 15:08:12.330571
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2e4f6a8b0c3'
+down_revision = 'b3d5f7a9c1e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # left NULL here; "flask geocode" fills them in from the bundled gazetteer
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.create_index('ix_venue_latitude_longitude', 'venue', ['latitude', 'longitude'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_latitude_longitude', table_name='venue')
+    with op.batch_alter_table('venue') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
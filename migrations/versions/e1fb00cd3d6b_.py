@@ -1,7 +1,7 @@
 """empty message
 
 Revision ID: e1fb00cd3d6b
-Revises: 
+Revises: c0a1b2d3e4f5
 Create Date: 2020-03-10 17:30:00.438859
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = 'e1fb00cd3d6b'
-down_revision = None
+down_revision = 'c0a1b2d3e4f5'
 branch_labels = None
 depends_on = None
 
@@ -0,0 +1,62 @@
+"""daily show rollups for the booking reports
+
+Revision ID: f4a6c8e0b2d5
+Revises: d2e4f6a8b0c3
+Create Date: 2020-04-09 15:41:27.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a6c8e0b2d5'
+down_revision = 'd2e4f6a8b0c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # created empty; "flask reports rollup --full" fills them from the show table
+    op.create_table('rollup_venue_day',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('venue_id', sa.Integer(), nullable=False),
+        sa.Column('shows', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'venue_id')
+    )
+    op.create_index('ix_rollup_venue_day_venue_id_day', 'rollup_venue_day', ['venue_id', 'day', 'shows'], unique=False)
+    op.create_table('rollup_artist_day',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('artist_id', sa.Integer(), nullable=False),
+        sa.Column('shows', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'artist_id')
+    )
+    op.create_index('ix_rollup_artist_day_artist_id_day', 'rollup_artist_day', ['artist_id', 'day', 'shows'], unique=False)
+    op.create_table('rollup_state_genre_day',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('state', sa.String(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.Column('shows', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'state', 'genre_id')
+    )
+    op.create_table('report_rollup',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('show_watermark', sa.Integer(), nullable=False),
+        sa.Column('rolled_up_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('rollup_dirty_day',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_dirty_day')
+    op.drop_table('report_rollup')
+    op.drop_table('rollup_state_genre_day')
+    op.drop_index('ix_rollup_artist_day_artist_id_day', table_name='rollup_artist_day')
+    op.drop_table('rollup_artist_day')
+    op.drop_index('ix_rollup_venue_day_venue_id_day', table_name='rollup_venue_day')
+    op.drop_table('rollup_venue_day')
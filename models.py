@@ -0,0 +1,324 @@
+#----------------------------------------------------------------------------#
+# Models and the show counters that are kept in step with them.
+#
+# db is bound to the app with db.init_app() in app.py, so this module can be
+# imported by the app, the CLI commands and the scripts alike.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime, timedelta
+
+from routing import RoutingSQLAlchemy
+
+# a flask-sqlalchemy instance whose session sends read-only views to the replica, if there is one
+db = RoutingSQLAlchemy()
+
+# genres live in their own table, linked to venues and artists through association tables.
+# the (genre_id, ...) indexes serve the "by genre" listings, the primary keys serve the detail pages
+class Genre(db.Model):
+    __tablename__ = 'genre'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(), nullable=False, unique=True)
+
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id')
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id')
+)
+
+class Venue(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(), nullable=False)
+    genres = db.relationship('Genre', secondary=venue_genres, lazy=True, order_by='Genre.name')
+    address = db.Column(db.String())
+    city = db.Column(db.String(), nullable=False)
+    state = db.Column(db.String(), nullable=False)
+    phone = db.Column(db.String())
+    website = db.Column(db.String())
+    image_link = db.Column(db.String())
+    facebook_link = db.Column(db.String())
+    seeking_talent = db.Column(db.Boolean(),default=False)
+    seeking_description = db.Column(db.String())
+
+    # location from the bundled gazetteer (geo.py), NULL until the venue is geocoded
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+
+    # denormalized show counters, kept in step by the Show mapper events and the rollover job below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # last write to the row, including the counter updates every show insert/delete makes, so it also
+    # moves when a show is booked or removed. drives the page's ETag / Last-Modified, see queries.py
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now())
+
+    # bumped by every edit. edits and deletes name the version they were made against and are refused
+    # once the row has moved past it, see editing.py. show bookings don't bump it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # /venues walks the table in this order, the index saves sorting it on every request.
+    # the latitude/longitude index serves the bounding boxes of the sql proximity backend, and
+    # updated_at the newest-write lookup of the api's listing validators (queries.listing_state)
+    __table_args__ = (
+        db.Index('ix_venue_city_state_id', 'city', 'state', 'id'),
+        db.Index('ix_venue_latitude_longitude', 'latitude', 'longitude'),
+        db.Index('ix_venue_updated_at', 'updated_at'),
+    )
+
+    # build the venue to show relationship
+    venue_shows = db.relationship('Show', cascade="all,delete", backref='venue', lazy=True)
+
+    # implement any missing fields, as a database migration using Flask-Migrate
+
+class Artist(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(), nullable=False)
+    city = db.Column(db.String(), nullable=False)
+    state = db.Column(db.String(), nullable=False)
+    phone = db.Column(db.String())
+    website = db.Column(db.String())
+    genres = db.relationship('Genre', secondary=artist_genres, lazy=True, order_by='Genre.name')
+    image_link = db.Column(db.String())
+    facebook_link = db.Column(db.String())
+    seeking_venue = db.Column(db.Boolean(),default=False)
+    seeking_description = db.Column(db.String())
+
+    # denormalized show counters, kept in step by the Show mapper events and the rollover job below
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # last write to the row, including the counter updates every show insert/delete makes, so it also
+    # moves when a show is booked or removed. drives the page's ETag / Last-Modified, see queries.py
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now, server_default=db.func.now())
+
+    # bumped by every edit. edits and deletes name the version they were made against and are refused
+    # once the row has moved past it, see editing.py. show bookings don't bump it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # the newest-write lookup of the api's listing validators (queries.listing_state)
+    __table_args__ = (
+        db.Index('ix_artist_updated_at', 'updated_at'),
+    )
+
+    # build the artist to show relationship
+    artist_shows = db.relationship('Show', cascade="all,delete", backref='artist', lazy=True)
+
+    # implement any missing fields, as a database migration using Flask-Migrate
+
+# Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+
+# build the show class with foreign keys on both artist and venue
+class Show(db.Model):
+    __tablename__ = 'show'
+    id = db.Column('id', db.Integer, primary_key=True)
+    artist_id = db.Column('artist_id', db.Integer, db.ForeignKey('artist.id'), nullable=False)
+    venue_id = db.Column('venue_id', db.Integer, db.ForeignKey('venue.id'), nullable=False)
+    start_time = db.Column('start_time', db.DateTime, nullable=False)
+
+    # every hot query filters one side of the relationship plus a start_time range, and these
+    # also serve as the foreign key indexes. (start_time, id) is the /shows keyset and rollover order
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+    )
+
+# single row holding the point in time up to which shows have been moved from upcoming to past.
+# shows starting after it count as upcoming, everything else as past
+class ShowCounterRollover(db.Model):
+    __tablename__ = 'show_counter_rollover'
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
+
+#----------------------------------------------------------------------------#
+# Daily report rollups, see reports.py.
+#----------------------------------------------------------------------------#
+
+# shows per day and venue, artist, and venue state and artist genre. "flask reports rollup" rewrites
+# the days that changed; the reports sum these instead of the show table. the primary keys lead with
+# the day for those rewrites, the (id, day, shows) indexes cover the per venue and per artist sums
+class VenueDayRollup(db.Model):
+    __tablename__ = 'rollup_venue_day'
+    day = db.Column(db.Date, primary_key=True)
+    venue_id = db.Column(db.Integer, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_rollup_venue_day_venue_id_day', 'venue_id', 'day', 'shows'),
+    )
+
+class ArtistDayRollup(db.Model):
+    __tablename__ = 'rollup_artist_day'
+    day = db.Column(db.Date, primary_key=True)
+    artist_id = db.Column(db.Integer, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_rollup_artist_day_artist_id_day', 'artist_id', 'day', 'shows'),
+    )
+
+class StateGenreDayRollup(db.Model):
+    __tablename__ = 'rollup_state_genre_day'
+    day = db.Column(db.Date, primary_key=True)
+    state = db.Column(db.String(), primary_key=True)
+    genre_id = db.Column(db.Integer, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False)
+
+# single row: the highest show id already counted in the rollups, so a refresh only looks at the days
+# of shows added since
+class ReportRollup(db.Model):
+    __tablename__ = 'report_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    show_watermark = db.Column(db.Integer, nullable=False)
+    rolled_up_at = db.Column(db.DateTime, nullable=False)
+
+# days that lost a show since the last refresh. appended to, never updated, so deletes running at
+# the same time don't contend for a row; the refresh recomputes these days and clears what it read
+class RollupDirtyDay(db.Model):
+    __tablename__ = 'rollup_dirty_day'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+
+def mark_rollup_days(connection, days):
+  # bulk write paths that delete shows bypassing the orm must call this themselves
+  days = set(days)
+  if days:
+    connection.execute(RollupDirtyDay.__table__.insert(), [{'day': day} for day in sorted(days)])
+
+@db.event.listens_for(Show, 'after_delete')
+def mark_deleted_show_day(mapper, connection, show):
+  mark_rollup_days(connection, [show.start_time.date()])
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+def rollover_watermark(connection):
+  # reads (creating on first use) the rollover watermark
+  table = ShowCounterRollover.__table__
+  watermark = connection.execute(db.select([table.c.rolled_over_at]).where(table.c.id == 1)).scalar()
+  if watermark is None:
+    watermark = datetime.now()
+    connection.execute(table.insert().values(id=1, rolled_over_at=watermark))
+  return watermark
+
+def bump_show_counters(connection, model, amounts, column):
+  # amounts maps entity id -> delta; one UPDATE per distinct delta rather than per entity
+  by_delta = {}
+  for entity_id, delta in amounts.items():
+    if delta:
+      by_delta.setdefault(delta, []).append(entity_id)
+  table = model.__table__
+  for delta, ids in by_delta.items():
+    connection.execute(table.update().where(table.c.id.in_(ids)).values({column: table.c[column] + delta}))
+
+def apply_show_counters(connection, shows, sign):
+  # shows are (venue_id, artist_id, start_time) tuples being added (sign=1) or removed (sign=-1).
+  # bulk write paths that bypass the orm must call this themselves
+  watermark = rollover_watermark(connection)
+  for column, upcoming in (('upcoming_shows_count', True), ('past_shows_count', False)):
+    venue_amounts, artist_amounts = {}, {}
+    for venue_id, artist_id, start_time in shows:
+      if (start_time > watermark) == upcoming:
+        venue_amounts[venue_id] = venue_amounts.get(venue_id, 0) + sign
+        artist_amounts[artist_id] = artist_amounts.get(artist_id, 0) + sign
+    bump_show_counters(connection, Venue, venue_amounts, column)
+    bump_show_counters(connection, Artist, artist_amounts, column)
+
+@db.event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+  apply_show_counters(connection, [(show.venue_id, show.artist_id, show.start_time)], 1)
+
+@db.event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+  apply_show_counters(connection, [(show.venue_id, show.artist_id, show.start_time)], -1)
+
+def rollover_show_counters(now=None):
+  # moves every show that started since the last rollover from upcoming to past, in one transaction.
+  # the watermark row is locked so two jobs running at once can't move the same shows twice
+  if now is None:
+    now = datetime.now()
+  connection = db.session.connection()
+  rollover_watermark(connection)
+  watermark = db.session.query(ShowCounterRollover).filter_by(id=1).with_for_update().one()
+  moved = 0
+  if now > watermark.rolled_over_at:
+    for model, column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+      crossed = db.session.query(column, db.func.count(Show.id)) \
+        .filter(Show.start_time > watermark.rolled_over_at, Show.start_time <= now) \
+        .group_by(column) \
+        .all()
+      amounts = dict(crossed)
+      bump_show_counters(connection, model, dict((entity_id, -n) for entity_id, n in amounts.items()), 'upcoming_shows_count')
+      bump_show_counters(connection, model, amounts, 'past_shows_count')
+      if model is Venue:
+        moved = sum(amounts.values())
+    watermark.rolled_over_at = now
+  db.session.commit()
+  return moved
+
+def show_counter_mismatches(model, fix=False):
+  # compares the stored counters with a live count of Show rows and optionally repairs them
+  watermark = rollover_watermark(db.session.connection())
+  column = Show.venue_id if model is Venue else Show.artist_id
+  upcoming = db.func.count(db.case([(Show.start_time > watermark, Show.id)]))
+  past = db.func.count(db.case([(Show.start_time <= watermark, Show.id)]))
+  rows = db.session.query(model.id, model.upcoming_shows_count, model.past_shows_count, upcoming, past) \
+    .outerjoin(Show, column == model.id) \
+    .group_by(model.id, model.upcoming_shows_count, model.past_shows_count) \
+    .all()
+  mismatches = [row for row in rows if (row[1], row[2]) != (row[3], row[4])]
+  if fix and mismatches:
+    db.session.bulk_update_mappings(model, [{
+      "id": row[0],
+      "upcoming_shows_count": row[3],
+      "past_shows_count": row[4]
+    } for row in mismatches])
+    db.session.commit()
+  return mismatches
+
+#----------------------------------------------------------------------------#
+# In-process copies of venue and artist columns.
+#----------------------------------------------------------------------------#
+
+class TableSync(object):
+  # keeps an index held in one process (the grid proximity index, the ngram search index) in step
+  # with writes made anywhere: other workers, "flask bulk", "flask geocode". each call compares
+  # (newest updated_at, row count) with the last one and re-reads only the rows written since,
+  # OVERLAP earlier to catch transactions that committed late. a count that doesn't add up means
+  # rows were deleted elsewhere, and every row is read again. not thread-safe: callers lock
+  OVERLAP = timedelta(seconds=60)
+
+  def __init__(self, db, model, *columns):
+    self.db = db
+    self.model = model
+    self.columns = columns
+    self.state = None
+    self.ids = set()
+
+  def changed(self):
+    # None when nothing changed, else (rebuild, rows of (id, *columns)). rebuild means rows is
+    # the whole table and replaces the index rather than updating it
+    db, model = self.db, self.model
+    state = tuple(db.session.query(db.func.max(model.updated_at), db.func.count(model.id)).one())
+    if state == self.state:
+      return None
+    query = db.session.query(model.id, *self.columns)
+    if self.state is not None and self.state[0] is not None:
+      rows = query.filter(model.updated_at >= self.state[0] - self.OVERLAP).all()
+      ids = self.ids.union(row[0] for row in rows)
+      if len(ids) == state[1]:
+        self.ids, self.state = ids, state
+        return False, rows
+    rows = query.all()
+    self.ids, self.state = set(row[0] for row in rows), state
+    return True, rows
+
+  def forget(self, entity_id):
+    # a row this process deleted, so its own delete doesn't look like one made elsewhere
+    self.ids.discard(entity_id)
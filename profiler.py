@@ -0,0 +1,171 @@
+#----------------------------------------------------------------------------#
+# Request profiler.
+#
+# For every request it records the number of SQL statements and the time
+# spent in them (SQLAlchemy engine events), the template render time (a
+# timed Template class on the app's jinja environment) and the total
+# latency. It also flags N+1 patterns: the same statement executed
+# PROFILER_REPEAT_THRESHOLD or more times in one request.
+#
+# Each finished request is written to the 'fyyur.profiler' logger as one
+# JSON object. Slow requests (over PROFILER_SLOW_MS) and N+1 requests are
+# logged at WARNING, everything else at DEBUG. The last PROFILER_WINDOW
+# requests per endpoint are kept for percentiles, see Profiler.get_stats().
+#----------------------------------------------------------------------------#
+
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter, deque
+
+from flask import g, request, has_app_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('fyyur.profiler')
+
+
+class RequestProfile(object):
+  __slots__ = ('started', 'queries', 'db_time', 'render_time', 'statements', 'status')
+
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.queries = 0
+    self.db_time = 0.0
+    self.render_time = 0.0
+    self.statements = Counter()
+    self.status = None
+
+
+def current_profile():
+  if has_app_context():
+    return g.get('profile')
+  return None
+
+
+# callables taking (template name, seconds), called after every top-level render. metrics.py listens here
+render_listeners = []
+
+
+class ProfiledTemplate(Template):
+  # adds its render time to the current request's profile. extended and included templates render
+  # inside the outer render call, so they are counted once
+  def render(self, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+      return super(ProfiledTemplate, self).render(*args, **kwargs)
+    finally:
+      elapsed = time.perf_counter() - started
+      profile = current_profile()
+      if profile is not None:
+        profile.render_time += elapsed
+      for listener in render_listeners:
+        listener(self.name, elapsed)
+
+
+def percentiles(values):
+  # nearest-rank percentiles of a non-empty list
+  values = sorted(values)
+  def rank(p):
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+  return {'p50': round(rank(50), 2), 'p95': round(rank(95), 2), 'p99': round(rank(99), 2), 'max': round(values[-1], 2)}
+
+
+class Profiler(object):
+  def __init__(self, app=None):
+    self.lock = threading.Lock()
+    self.samples = {}
+    self.counts = {}
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.enabled = app.config['PROFILER_ENABLED']
+    self.window = app.config['PROFILER_WINDOW']
+    self.slow_ms = app.config['PROFILER_SLOW_MS']
+    self.repeat_threshold = app.config['PROFILER_REPEAT_THRESHOLD']
+    app.extensions['profiler'] = self
+    if not self.enabled:
+      return
+    app.jinja_env.template_class = ProfiledTemplate
+    app.before_request(self.start_request)
+    app.after_request(self.note_status)
+    # teardown rather than after_request, so streamed responses are measured to their last byte
+    app.teardown_request(self.finish_request)
+    # every engine, so replicas or extra binds are covered too; once, however many apps are created
+    if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+      event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+      event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+  def start_request(self):
+    g.profile = RequestProfile()
+
+  def note_status(self, response):
+    profile = current_profile()
+    if profile is not None:
+      profile.status = response.status_code
+    return response
+
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+      conn.info['profiler_started'] = time.perf_counter()
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    started = conn.info.pop('profiler_started', None)
+    if profile is None or started is None:
+      return
+    profile.db_time += time.perf_counter() - started
+    profile.queries += 1
+    profile.statements[statement] += 1
+
+  def finish_request(self, exception=None):
+    profile = current_profile()
+    if profile is None:
+      return
+    g.profile = None
+    total_ms = (time.perf_counter() - profile.started) * 1000
+    endpoint = request.endpoint or 'unmatched'
+    repeated = [{'statement': ' '.join(statement.split()), 'count': count}
+      for statement, count in profile.statements.most_common() if count >= self.repeat_threshold]
+    record = {
+      'event': 'request',
+      'endpoint': endpoint,
+      'method': request.method,
+      'path': request.path,
+      'status': profile.status if exception is None else 500,
+      'total_ms': round(total_ms, 2),
+      'db_ms': round(profile.db_time * 1000, 2),
+      'render_ms': round(profile.render_time * 1000, 2),
+      'queries': profile.queries,
+    }
+    if repeated:
+      record['repeated_statements'] = repeated
+    slow = total_ms >= self.slow_ms
+    logger.log(logging.WARNING if slow or repeated else logging.DEBUG, json.dumps(record))
+
+    with self.lock:
+      if endpoint not in self.samples:
+        self.samples[endpoint] = deque(maxlen=self.window)
+        self.counts[endpoint] = {'requests': 0, 'slow': 0, 'n_plus_one': 0}
+      self.samples[endpoint].append((record['total_ms'], record['db_ms'], record['render_ms'], profile.queries))
+      counts = self.counts[endpoint]
+      counts['requests'] += 1
+      counts['slow'] += int(slow)
+      counts['n_plus_one'] += int(bool(repeated))
+
+  def get_stats(self):
+    # per endpoint: request counts since start and percentiles over the last window of requests
+    with self.lock:
+      snapshot = dict((endpoint, (list(samples), dict(self.counts[endpoint]))) for endpoint, samples in self.samples.items())
+    stats = {}
+    for endpoint, (samples, counts) in sorted(snapshot.items()):
+      columns = list(zip(*samples))
+      counts['window'] = len(samples)
+      for name, values in zip(('total_ms', 'db_ms', 'render_ms', 'queries'), columns):
+        counts[name] = percentiles(values)
+      stats[endpoint] = counts
+    return stats
@@ -0,0 +1,203 @@
+#----------------------------------------------------------------------------#
+# Read queries shared by the html views (app.py) and the json api (api.py).
+#----------------------------------------------------------------------------#
+
+import itertools
+import functools
+import contextlib
+from datetime import datetime
+
+from flask import g, current_app
+
+from models import *
+from viewmodels import *
+
+def upcoming_shows_per_venue():
+  # venues with their stored upcoming show counter - no join or aggregate over the show table.
+  # ordered by city/state so the rows can be grouped into areas in a single pass
+  num_upcoming_shows = Venue.upcoming_shows_count.label('num_upcoming_shows')
+  return db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, num_upcoming_shows) \
+    .order_by(Venue.city, Venue.state, Venue.id)
+
+def group_venues_by_area(rows):
+  # rows must be sorted by city then state - builds the same areas structure the template always expected
+  areas = []
+  for (city, state), venues in itertools.groupby(rows, key=lambda row: (row.city, row.state)):
+    areas.append(Area(city=city, state=state, venues=[
+      VenueSummary(id=venue.id, name=venue.name, num_upcoming_shows=venue.num_upcoming_shows) for venue in venues
+    ]))
+  return areas
+
+def genres_from_names(names):
+  # maps submitted genre names to Genre rows with one lookup, creating any that don't exist yet
+  names = set(name.strip() for name in names if name and name.strip())
+  if not names:
+    return []
+  genres = db.session.query(Genre).filter(Genre.name.in_(names)).all()
+  missing = names - set(genre.name for genre in genres)
+  genres.extend(Genre(name=name) for name in sorted(missing))
+  return genres
+
+def partition_shows(rows, now, view_model):
+  # splits show rows into past and upcoming against a single captured timestamp.
+  # rows become read-only view models so the template never touches (or mutates) orm objects
+  past_shows = []
+  upcoming_shows = []
+  for row in rows:
+    show = view_model.from_row(row)
+    if row.start_time < now:
+      past_shows.append(show)
+    else:
+      upcoming_shows.append(show)
+  return past_shows, upcoming_shows
+
+def genre_names(link_table, column, entity_id):
+  return [name for name, in db.session.query(Genre.name)
+    .join(link_table, link_table.c.genre_id == Genre.id)
+    .filter(column == entity_id)
+    .order_by(Genre.name)]
+
+@contextlib.contextmanager
+def reading():
+  # marks the queries run inside as read-only, which lets routing.py send them to the replica
+  previous = g.get('read_only', False)
+  g.read_only = True
+  try:
+    yield
+  finally:
+    g.read_only = previous
+
+def read_only_view(view):
+  # page views only read: autoflush is off so nothing pending can be flushed by a query, and
+  # the transaction is rolled back afterwards so nothing done while rendering can be committed
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    try:
+      with reading(), db.session.no_autoflush:
+        return view(*args, **kwargs)
+    finally:
+      db.session.rollback()
+  return wrapper
+
+def encode_show_cursor(show):
+  # cursor for keyset pagination over shows: the last row's start time and id
+  return '%s_%d' % (show.start_time.isoformat(), show.id)
+
+def decode_show_cursor(cursor):
+  # raises ValueError on a malformed cursor
+  if not cursor:
+    return None
+  start_time, show_id = cursor.rsplit('_', 1)
+  return (datetime.fromisoformat(start_time), int(show_id))
+
+def show_listing_query(upcoming_only=False, after=None):
+  # the /shows feed: only the columns it needs, venue and artist joined in the same query,
+  # in (start_time, id) keyset order starting after the given cursor. the updated_at columns
+  # key each row's template fragment
+  query = db.session.query(Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+      Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'),
+      Venue.updated_at.label('venue_updated_at'), Artist.updated_at.label('artist_updated_at')) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id)
+  if upcoming_only:
+    query = query.filter(Show.start_time > datetime.now())
+  if after is not None:
+    query = query.filter(db.tuple_(Show.start_time, Show.id) > after)
+  return query.order_by(Show.start_time, Show.id)
+
+def venue_detail(venue_id):
+  # everything the venue page shows, as a read-only view model, or None if there is no such venue
+  venue = db.session.query(Venue.id, Venue.name, Venue.address, Venue.city, Venue.state, Venue.phone, Venue.website,
+      Venue.facebook_link, Venue.seeking_talent, Venue.seeking_description, Venue.image_link, Venue.updated_at) \
+    .filter(Venue.id == venue_id) \
+    .first()
+  if venue is None:
+    return None
+  # one joined query fetches every show with the artist fields the page needs, split into past/upcoming in python
+  shows = db.session.query(Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'), Show.start_time) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(Show.venue_id == venue_id) \
+    .order_by(Show.start_time) \
+    .all()
+  past_shows, upcoming_shows = partition_shows(shows, datetime.now(), VenueShow)
+
+  # assemble the view model using the above queries
+  return VenueDetail.from_row(venue,
+    genres=genre_names(venue_genres, venue_genres.c.venue_id, venue_id),
+    past_shows=past_shows,
+    upcoming_shows=upcoming_shows,
+    past_shows_count=len(past_shows),
+    upcoming_shows_count=len(upcoming_shows),
+    similar=similar_entities('venues', venue_id))
+
+def artist_detail(artist_id):
+  # everything the artist page shows, as a read-only view model, or None if there is no such artist
+  artist = db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone, Artist.website,
+      Artist.facebook_link, Artist.seeking_venue, Artist.seeking_description, Artist.image_link, Artist.updated_at) \
+    .filter(Artist.id == artist_id) \
+    .first()
+  if artist is None:
+    return None
+  # one joined query fetches every show with the venue fields the page needs, split into past/upcoming in python
+  shows = db.session.query(Show.venue_id, Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'), Show.start_time) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .filter(Show.artist_id == artist_id) \
+    .order_by(Show.start_time) \
+    .all()
+  past_shows, upcoming_shows = partition_shows(shows, datetime.now(), ArtistShow)
+
+  # assemble the view model using the above queries
+  return ArtistDetail.from_row(artist,
+    genres=genre_names(artist_genres, artist_genres.c.artist_id, artist_id),
+    past_shows=past_shows,
+    upcoming_shows=upcoming_shows,
+    past_shows_count=len(past_shows),
+    upcoming_shows_count=len(upcoming_shows),
+    similar=similar_entities('artists', artist_id))
+
+def similar_entities(kind, entity_id):
+  # the page's "similar" panel, from the offline similarity index (similarity.py) - no query
+  return current_app.extensions['similarity'].similar(kind, entity_id, current_app.config['SIMILAR_PANEL_SIZE'])
+
+def last_modified(model, column, entity_id):
+  # when the entity's page last changed, or None if there is no such entity. that's its updated_at,
+  # unless one of its shows has started since - that moved the show from upcoming to past on the
+  # page without writing anything. one query: a primary key lookup plus an index range on show
+  now = datetime.now()
+  # read from the same database the page itself will be, so the validator never runs ahead of it
+  with reading():
+    row = db.session.query(model.updated_at, db.func.max(Show.start_time)) \
+      .outerjoin(Show, db.and_(column == model.id, Show.start_time > model.updated_at, Show.start_time <= now)) \
+      .filter(model.id == entity_id) \
+      .group_by(model.updated_at) \
+      .first()
+  if row is None:
+    return None
+  return max(value for value in row if value is not None)
+
+def with_similar_modified(modified, kind, entity_id):
+  # a refreshed similarity index changes the page's "similar" panel too
+  similar = current_app.extensions['similarity'].modified(kind, entity_id) if modified is not None else None
+  return max(modified, similar) if similar is not None else modified
+
+def venue_last_modified(venue_id):
+  return with_similar_modified(last_modified(Venue, Show.venue_id, venue_id), 'venues', venue_id)
+
+def artist_last_modified(artist_id):
+  return with_similar_modified(last_modified(Artist, Show.artist_id, artist_id), 'artists', artist_id)
+
+def listing_state(*models, started=False):
+  # a validator for listings over the models: each one's row count and highest id, and the newest
+  # updated_at of those that have one - an insert, a delete and an edit each move at least one of
+  # them. started adds the start of the latest show that has begun, for listings split at now.
+  # one query of scalar subqueries, read from the same database as the listing
+  aggregates = []
+  for model in models:
+    aggregates.extend([db.func.count(model.id), db.func.max(model.id)])
+    if hasattr(model, 'updated_at'):
+      aggregates.append(db.func.max(model.updated_at))
+  subqueries = [db.session.query(aggregate).scalar_subquery() for aggregate in aggregates]
+  if started:
+    subqueries.append(db.session.query(db.func.max(Show.start_time)).filter(Show.start_time <= datetime.now()).scalar_subquery())
+  with reading():
+    return tuple(db.session.query(*subqueries).one())
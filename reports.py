@@ -0,0 +1,333 @@
+#----------------------------------------------------------------------------#
+# Booking reports.
+#
+#   venue-months        - shows per venue per month
+#   busiest-cities      - shows and venues with shows per city
+#   genre-demand        - shows per venue state and artist genre
+#   artist-utilization  - share of the window's days each artist played on
+#
+# Every report is one aggregate query, streamed with a server side cursor
+# (yield_per) and written batch by batch, so no report is ever held in
+# memory. By default they sum the daily rollup tables in models.py rather
+# than the show table; "flask reports rollup" keeps those up to date by
+# recomputing only the days that gained a show (show id above the
+# watermark) or lost one (rollup_dirty_day), each day range with one
+# INSERT ... SELECT per rollup. ?source=live aggregates the show table
+# instead, for checking the rollups or when they haven't been built.
+#
+#   flask reports rollup [--full] [--every N]
+#   flask reports export venue-months venue-months.csv --start 2020-01-01
+#   GET /admin/reports/busiest-cities?start=2020-01-01&end=2021-01-01&format=json
+#
+# The rollups fix a show's state and genres when its day is rolled up, so
+# editing a venue's state or an artist's genres only moves the rollups at
+# the next --full run.
+#----------------------------------------------------------------------------#
+
+import sys
+import json
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models import *
+from bulk import chunks, dialect
+
+reports_cli = AppGroup('reports', help='Booking reports and the daily rollups behind them.')
+
+SOURCES = ('rollup', 'live')
+
+
+#  Dialect specific date expressions
+#  ----------------------------------------------------------------
+
+def day_of(column):
+  # the calendar day of a timestamp, read back as a date on every backend
+  if dialect() == 'postgresql':
+    return db.cast(column, db.Date)
+  return db.type_coerce(db.func.date(column), db.Date)
+
+
+def month_of(column):
+  # 'YYYY-MM' of a date or timestamp. the format is a literal, not a parameter, so postgres sees the
+  # same expression in the select list and the GROUP BY
+  if dialect() == 'postgresql':
+    return db.func.to_char(column, db.literal_column("'YYYY-MM'"))
+  return db.func.strftime(db.literal_column("'%Y-%m'"), column)
+
+
+#  Rollups
+#  ----------------------------------------------------------------
+
+ROLLUPS = (VenueDayRollup, ArtistDayRollup, StateGenreDayRollup)
+
+
+def day_ranges(days, gap=7):
+  # sorted days folded into [start, end) ranges; days up to gap apart share a range, as recomputing
+  # a few unchanged days costs less than another round of statements
+  ranges = []
+  for day in sorted(days):
+    if ranges and (day - ranges[-1][1]).days < gap:
+      ranges[-1][1] = day + timedelta(days=1)
+    else:
+      ranges.append([day, day + timedelta(days=1)])
+  return [tuple(day_range) for day_range in ranges]
+
+
+def recompute_days(connection, start, end):
+  # rewrites the rollups of the days in [start, end) from the show table, over the start_time index
+  lower, upper = datetime(start.year, start.month, start.day), datetime(end.year, end.month, end.day)
+  for model in ROLLUPS:
+    table = model.__table__
+    connection.execute(table.delete().where(db.and_(table.c.day >= start, table.c.day < end)))
+  day = day_of(Show.start_time)
+  in_range = db.and_(Show.start_time >= lower, Show.start_time < upper)
+  connection.execute(VenueDayRollup.__table__.insert().from_select(['day', 'venue_id', 'shows'],
+    db.select([day, Show.venue_id, db.func.count(Show.id)]).where(in_range).group_by(day, Show.venue_id)))
+  connection.execute(ArtistDayRollup.__table__.insert().from_select(['day', 'artist_id', 'shows'],
+    db.select([day, Show.artist_id, db.func.count(Show.id)]).where(in_range).group_by(day, Show.artist_id)))
+  connection.execute(StateGenreDayRollup.__table__.insert().from_select(['day', 'state', 'genre_id', 'shows'],
+    db.select([day, Venue.state, artist_genres.c.genre_id, db.func.count(Show.id)])
+      .select_from(Show.__table__
+        .join(Venue.__table__, Venue.id == Show.venue_id)
+        .join(artist_genres, artist_genres.c.artist_id == Show.artist_id))
+      .where(in_range)
+      .group_by(day, Venue.state, artist_genres.c.genre_id)))
+
+
+def refresh_rollups(full=False):
+  # brings the rollups up to date in one transaction and returns the day ranges recomputed. the
+  # watermark row is locked so two refreshes can't interleave. a show whose id was allocated before
+  # the refresh but committed after it is below the new watermark; the next --full run counts it
+  connection = db.session.connection()
+  state = db.session.query(ReportRollup).filter_by(id=1).with_for_update().first()
+  top = db.session.query(db.func.max(Show.id)).scalar() or 0
+  last_dirty = db.session.query(db.func.max(RollupDirtyDay.id)).scalar() or 0
+  if full or state is None:
+    for model in ROLLUPS:
+      connection.execute(model.__table__.delete())
+    first, last = db.session.query(db.func.min(Show.start_time), db.func.max(Show.start_time)).one()
+    ranges = [(first.date(), last.date() + timedelta(days=1))] if first is not None else []
+  else:
+    days = set(day for day, in db.session.query(day_of(Show.start_time)).filter(
+      Show.id > state.show_watermark, Show.id <= top).distinct())
+    days.update(day for day, in db.session.query(RollupDirtyDay.day).filter(RollupDirtyDay.id <= last_dirty).distinct())
+    ranges = day_ranges(days)
+  for start, end in ranges:
+    recompute_days(connection, start, end)
+  connection.execute(RollupDirtyDay.__table__.delete().where(RollupDirtyDay.id <= last_dirty))
+  if state is None:
+    db.session.add(ReportRollup(id=1, show_watermark=top, rolled_up_at=datetime.now()))
+  else:
+    state.show_watermark = top
+    state.rolled_up_at = datetime.now()
+  db.session.commit()
+  return ranges
+
+
+#  Reports
+#  ----------------------------------------------------------------
+#  each takes the source and a [start, end) window of dates and returns the report's columns, as
+#  (name, kind) pairs, and a query yielding rows in that column order
+
+def in_window(day_column, time_column, source, start, end):
+  if source == 'rollup':
+    return db.and_(day_column >= start, day_column < end)
+  return db.and_(time_column >= datetime(start.year, start.month, start.day),
+    time_column < datetime(end.year, end.month, end.day))
+
+
+def total(column):
+  # sum() of an integer column, as an integer. postgres sums integers to numeric, which psycopg2
+  # returns as Decimal - json.dumps can't write those
+  return db.cast(db.func.sum(column), db.Integer)
+
+
+def venue_shows(source, start, end, by_month):
+  # shows per venue, or per venue and month, in the window. the reports aggregate this first and
+  # join venue to the (much shorter) result rather than to every rollup or show row
+  if source == 'rollup':
+    venue_id, shows, when = VenueDayRollup.venue_id, total(VenueDayRollup.shows), VenueDayRollup.day
+  else:
+    venue_id, shows, when = Show.venue_id, db.func.count(Show.id), Show.start_time
+  group = [venue_id, month_of(when)] if by_month else [venue_id]
+  return db.session.query(venue_id.label('venue_id'), shows.label('shows'),
+      *([group[1].label('month')] if by_month else [])) \
+    .filter(in_window(VenueDayRollup.day, Show.start_time, source, start, end)) \
+    .group_by(*group) \
+    .subquery()
+
+
+def venue_months(source, start, end):
+  columns = [('venue_id', 'int'), ('venue_name', 'text'), ('month', 'text'), ('shows', 'int')]
+  per_month = venue_shows(source, start, end, by_month=True)
+  query = db.session.query(per_month.c.venue_id, Venue.name, per_month.c.month, per_month.c.shows) \
+    .join(Venue, Venue.id == per_month.c.venue_id) \
+    .order_by(per_month.c.venue_id, per_month.c.month)
+  return columns, query
+
+
+def busiest_cities(source, start, end):
+  columns = [('city', 'text'), ('state', 'text'), ('shows', 'int'), ('venues', 'int')]
+  per_venue = venue_shows(source, start, end, by_month=False)
+  shows = total(per_venue.c.shows)
+  query = db.session.query(Venue.city, Venue.state, shows, db.func.count(per_venue.c.venue_id)) \
+    .join(Venue, Venue.id == per_venue.c.venue_id) \
+    .group_by(Venue.city, Venue.state) \
+    .order_by(shows.desc(), Venue.state, Venue.city)
+  return columns, query
+
+
+def genre_demand(source, start, end):
+  columns = [('state', 'text'), ('genre', 'text'), ('shows', 'int')]
+  if source == 'rollup':
+    shows = total(StateGenreDayRollup.shows)
+    query = db.session.query(StateGenreDayRollup.state, Genre.name, shows) \
+      .join(Genre, Genre.id == StateGenreDayRollup.genre_id) \
+      .group_by(StateGenreDayRollup.state, Genre.name)
+    state = StateGenreDayRollup.state
+  else:
+    shows = db.func.count(Show.id)
+    query = db.session.query(Venue.state, Genre.name, shows) \
+      .select_from(Show) \
+      .join(Venue, Venue.id == Show.venue_id) \
+      .join(artist_genres, artist_genres.c.artist_id == Show.artist_id) \
+      .join(Genre, Genre.id == artist_genres.c.genre_id) \
+      .group_by(Venue.state, Genre.name)
+    state = Venue.state
+  query = query.filter(in_window(StateGenreDayRollup.day, Show.start_time, source, start, end)) \
+    .order_by(state, shows.desc(), Genre.name)
+  return columns, query
+
+
+def artist_utilization(source, start, end):
+  # every artist, including those without a show in the window
+  columns = [('artist_id', 'int'), ('artist_name', 'text'), ('shows', 'int'), ('days_booked', 'int'),
+    ('utilization', 'float')]
+  if source == 'rollup':
+    booked = db.session.query(ArtistDayRollup.artist_id.label('artist_id'),
+        total(ArtistDayRollup.shows).label('shows'), db.func.count().label('days')) \
+      .filter(in_window(ArtistDayRollup.day, None, source, start, end)) \
+      .group_by(ArtistDayRollup.artist_id)
+  else:
+    booked = db.session.query(Show.artist_id.label('artist_id'), db.func.count(Show.id).label('shows'),
+        db.func.count(db.distinct(day_of(Show.start_time))).label('days')) \
+      .filter(in_window(None, Show.start_time, source, start, end)) \
+      .group_by(Show.artist_id)
+  booked = booked.subquery()
+  days = db.func.coalesce(booked.c.days, 0)
+  query = db.session.query(Artist.id, Artist.name, db.func.coalesce(booked.c.shows, 0), days,
+      db.cast(days, db.Float) / (end - start).days) \
+    .outerjoin(booked, booked.c.artist_id == Artist.id) \
+    .order_by(days.desc(), Artist.id)
+  return columns, query
+
+
+REPORTS = {
+  'venue-months': venue_months,
+  'busiest-cities': busiest_cities,
+  'genre-demand': genre_demand,
+  'artist-utilization': artist_utilization,
+}
+
+
+def report_window(start, end, default_days):
+  # ISO dates, end exclusive; without them the last default_days days up to and including today.
+  # raises ValueError for anything else
+  end = date.fromisoformat(end) if end else date.today() + timedelta(days=1)
+  start = date.fromisoformat(start) if start else end - timedelta(days=default_days)
+  if end <= start:
+    raise ValueError('end must be after start')
+  return start, end
+
+
+#  Writers
+#  ----------------------------------------------------------------
+#  rows arrive in batches from the server side cursor and each batch is formatted a column at a
+#  time: one map() per column with that column's formatter, then the formatted columns are zipped
+#  back into lines. there is no per-row dict or per-field type check, which is most of what
+#  csv.DictWriter spends its time on. the output is what csv.writer would write
+
+def csv_text(value):
+  if value is None:
+    return ''
+  if ',' in value or '"' in value or '\n' in value or '\r' in value:
+    return '"' + value.replace('"', '""') + '"'
+  return value
+
+FORMATTERS = {
+  'int': str,
+  'float': repr,
+  'text': csv_text,
+}
+
+
+def csv_chunks(columns, rows, batch_size):
+  yield ','.join(name for name, kind in columns) + '\r\n'
+  formatters = [FORMATTERS[kind] for name, kind in columns]
+  for batch in chunks(rows, batch_size):
+    formatted = [list(map(formatter, values)) for formatter, values in zip(formatters, zip(*batch))]
+    yield '\r\n'.join(map(','.join, zip(*formatted))) + '\r\n'
+
+
+def json_chunks(columns, rows, batch_size):
+  # {"columns": [...], "rows": [[...], ...]}, the shape dashboards chart from
+  yield '{"columns":%s,"rows":[' % json.dumps([name for name, kind in columns])
+  separator = ''
+  for batch in chunks(rows, batch_size):
+    yield separator + ','.join(json.dumps(list(row), separators=(',', ':')) for row in batch)
+    separator = ','
+  yield ']}'
+
+
+def run_report(name, source, start, end, batch_size, fmt='csv'):
+  # the report's output, a chunk per batch of rows
+  columns, query = REPORTS[name](source, start, end)
+  rows = query.yield_per(batch_size)
+  if fmt == 'json':
+    return json_chunks(columns, rows, batch_size)
+  return csv_chunks(columns, rows, batch_size)
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+@reports_cli.command('rollup')
+@click.option('--full', is_flag=True, help='Recompute every day rather than the days that changed.')
+@click.option('--every', type=int, default=0, help='Keep running, refreshing every N seconds.')
+def rollup_command(full, every):
+  """Bring the daily report rollups up to date with the show table."""
+  while True:
+    started = time.perf_counter()
+    ranges = refresh_rollups(full=full)
+    days = sum((end - start).days for start, end in ranges)
+    click.echo('recomputed %d days in %d ranges, %.1f s' % (days, len(ranges), time.perf_counter() - started))
+    if not every:
+      break
+    full = False
+    time.sleep(every)
+
+
+@reports_cli.command('export')
+@click.argument('name', type=click.Choice(sorted(REPORTS)))
+@click.argument('path')
+@click.option('--start', help='First day, YYYY-MM-DD.')
+@click.option('--end', help='Day after the last, YYYY-MM-DD.')
+@click.option('--source', type=click.Choice(SOURCES), default='rollup', help='Sum the rollups or the show table.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default='csv')
+def export_command(name, path, start, end, source, fmt):
+  """Write a report to a file ('-' for stdout)."""
+  try:
+    start, end = report_window(start, end, current_app.config['REPORTS_DEFAULT_DAYS'])
+  except ValueError as error:
+    raise click.BadParameter(str(error))
+  stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+  try:
+    for chunk in run_report(name, source, start, end, current_app.config['REPORTS_BATCH_SIZE'], fmt):
+      stream.write(chunk)
+  finally:
+    if stream is not sys.stdout:
+      stream.close()
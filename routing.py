@@ -0,0 +1,121 @@
+#----------------------------------------------------------------------------#
+# Database routing and statement timeouts.
+#
+# RoutingSession sends the queries of read-only work (read_only_view and
+# reading() in queries.py) to the 'replica' bind when one is configured,
+# and everything else to the primary. When a request commits, its response
+# sets a short-lived cookie. While the cookie is present that visitor's
+# reads also go to the primary, so they see their own write even if the
+# replica lags behind.
+#
+# Every transaction begun while handling a request gets a statement timeout
+# from STATEMENT_TIMEOUT_MS or the endpoint's entry in STATEMENT_TIMEOUTS:
+# SET LOCAL statement_timeout on postgres, a progress handler that
+# interrupts the statement on sqlite.
+#----------------------------------------------------------------------------#
+
+import time
+
+from flask import g, request, current_app, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+
+STICKY_COOKIE = 'fyyur_primary_until'
+
+
+def reads_from_primary():
+  # read-your-writes: this request, or this visitor a moment ago, committed something
+  if not has_request_context():
+    return False
+  if g.get('wrote'):
+    return True
+  try:
+    return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+  except ValueError:
+    return False
+
+
+class RoutingSession(SignallingSession):
+  def __init__(self, db, **options):
+    self.db = db
+    SignallingSession.__init__(self, db, **options)
+
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    if has_app_context() and g.get('read_only') and 'replica' in (self.app.config['SQLALCHEMY_BINDS'] or {}) \
+        and not reads_from_primary():
+      return self.db.get_engine(self.app, bind='replica')
+    return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def note_write(session):
+  if has_request_context():
+    g.wrote = True
+
+
+def start_request():
+  # before_request hook; an app context can outlive a request (scripts, tests)
+  g.wrote = False
+
+
+def stick_to_primary(response):
+  # after_request hook
+  if g.get('wrote'):
+    seconds = current_app.config['REPLICA_STICKY_SECONDS']
+    response.set_cookie(STICKY_COOKIE, '%.3f' % (time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+  return response
+
+
+def init_routing(app):
+  app.before_request(start_request)
+  app.after_request(stick_to_primary)
+
+
+#  Statement timeouts
+#  ----------------------------------------------------------------
+
+def statement_timeout_ms():
+  config = current_app.config
+  return config['STATEMENT_TIMEOUTS'].get(request.endpoint, config['STATEMENT_TIMEOUT_MS'])
+
+
+@event.listens_for(Engine, 'begin')
+def apply_statement_timeout(conn):
+  if not has_request_context():
+    return
+  timeout = statement_timeout_ms()
+  if not timeout:
+    return
+  dbapi_connection = conn.connection.connection
+  if conn.dialect.name == 'postgresql':
+    # straight on the dbapi connection, so it isn't counted as one of the request's statements
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET LOCAL statement_timeout = %d' % timeout)
+    cursor.close()
+  elif conn.dialect.name == 'sqlite':
+    # the deadline moves with every statement (see below); sqlite calls the handler every 10000
+    # virtual machine steps and a true return aborts the statement with "interrupted"
+    conn.info['statement_timeout'] = timeout / 1000.0
+    conn.info['statement_deadline'] = time.perf_counter() + timeout / 1000.0
+    info = conn.info
+    dbapi_connection.set_progress_handler(lambda: time.perf_counter() > info['statement_deadline'], 10000)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def restart_statement_deadline(conn, cursor, statement, parameters, context, executemany):
+  if 'statement_timeout' in conn.info:
+    conn.info['statement_deadline'] = time.perf_counter() + conn.info['statement_timeout']
+
+
+@event.listens_for(Engine, 'commit')
+@event.listens_for(Engine, 'rollback')
+def clear_statement_timeout(conn):
+  # postgres drops SET LOCAL with the transaction; the sqlite handler has to be removed by hand
+  if conn.info.pop('statement_timeout', None) is not None:
+    conn.connection.connection.set_progress_handler(None, 0)
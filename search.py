@@ -0,0 +1,202 @@
+#----------------------------------------------------------------------------#
+# Search backends for venues and artists.
+#
+# Every backend returns the matching page of results *and* the total count
+# from a single query (for the in-process index, one check that it is
+# current), ranked with prefix matches first and capped at a result limit.
+#
+#   sql    - ILIKE in the database. On Postgres it ranks with pg_trgm
+#            similarity and is served by the trigram GIN indexes added in
+#            migration 3c5e7a1d9b20.
+#   fts    - Postgres only: word-prefix full text search over the
+#            to_tsvector('simple', name) GIN index from the same migration.
+#   ngram  - a pure python n-gram inverted index held in the process. Meant
+#            for sqlite and tests; each worker keeps its own copy, brought up
+#            to date before each search with the rows written since by any
+#            worker or cli command (models.TableSync).
+#----------------------------------------------------------------------------#
+
+import re
+import heapq
+import threading
+from collections import defaultdict
+
+from models import TableSync
+
+
+class SearchResults(object):
+  # what the search templates expect: results.count and results.data
+  __slots__ = ('count', 'data')
+
+  def __init__(self, count, data):
+    self.count = count
+    self.data = data
+
+
+def escape_like(term):
+  # a user typing % or _ should match those characters literally
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def rank_key(name, term):
+  # sort key shared by the backends: whole-name prefix, then word prefix, then shorter (tighter) names
+  lowered = name.lower()
+  return (not lowered.startswith(term), not any(word.startswith(term) for word in lowered.split()), len(name), lowered)
+
+
+class SqlSearchBackend(object):
+  def __init__(self, db, model, limit):
+    self.db = db
+    self.model = model
+    self.limit = limit
+
+  def add(self, entity_id, name):
+    # the database indexes itself
+    pass
+
+  def remove(self, entity_id):
+    pass
+
+  def search(self, term):
+    db, model = self.db, self.model
+    term = term.strip()
+    escaped = escape_like(term)
+    # the window count is evaluated before LIMIT, so the first row carries the full match count
+    total = db.func.count().over().label('total')
+    is_prefix = db.case([(model.name.ilike(escaped + '%', escape='\\'), 0)], else_=1)
+    order_by = [is_prefix]
+    if db.engine.dialect.name == 'postgresql':
+      order_by.append(db.func.similarity(model.name, term).desc())
+    order_by.extend([db.func.length(model.name), model.name])
+
+    rows = db.session.query(model.id, model.name, total) \
+      .filter(model.name.ilike('%' + escaped + '%', escape='\\')) \
+      .order_by(*order_by) \
+      .limit(self.limit) \
+      .all()
+    return SearchResults(rows[0].total if rows else 0, [{"id": row.id, "name": row.name} for row in rows])
+
+
+class FullTextSearchBackend(SqlSearchBackend):
+  # postgres only - matches every word of the term as a word prefix ("mus hop" finds "The Musical Hop")
+  def search(self, term):
+    db, model = self.db, self.model
+    words = re.findall(r'\w+', term.lower())
+    if not words:
+      return SearchResults(0, [])
+    document = db.func.to_tsvector('simple', db.func.coalesce(model.name, ''))
+    query = db.func.to_tsquery('simple', ' & '.join(word + ':*' for word in words))
+    total = db.func.count().over().label('total')
+
+    rows = db.session.query(model.id, model.name, total) \
+      .filter(document.op('@@')(query)) \
+      .order_by(db.func.ts_rank(document, query).desc(), db.func.length(model.name), model.name) \
+      .limit(self.limit) \
+      .all()
+    return SearchResults(rows[0].total if rows else 0, [{"id": row.id, "name": row.name} for row in rows])
+
+
+class NgramIndex(object):
+  # inverted index from character n-grams to ids. a term's candidates are the intersection of
+  # the postings of its n-grams, which are then confirmed with a substring check
+  def __init__(self, n=3):
+    self.n = n
+    self.names = {}
+    self.lowered = {}
+    self.postings = defaultdict(set)
+    self.lock = threading.Lock()
+
+  def grams(self, text):
+    return set(text[i:i + self.n] for i in range(len(text) - self.n + 1))
+
+  def add(self, entity_id, name):
+    name = name or ''
+    with self.lock:
+      self._remove(entity_id)
+      self.names[entity_id] = name
+      self.lowered[entity_id] = name.lower()
+      for gram in self.grams(name.lower()):
+        self.postings[gram].add(entity_id)
+
+  def remove(self, entity_id):
+    with self.lock:
+      self._remove(entity_id)
+
+  def _remove(self, entity_id):
+    lowered = self.lowered.pop(entity_id, None)
+    if lowered is None:
+      return
+    del self.names[entity_id]
+    for gram in self.grams(lowered):
+      self.postings[gram].discard(entity_id)
+      if not self.postings[gram]:
+        del self.postings[gram]
+
+  def candidates(self, term):
+    if len(term) < self.n:
+      # too short to have an n-gram, every entry is a candidate
+      return list(self.lowered)
+    postings = sorted((self.postings.get(gram, set()) for gram in self.grams(term)), key=len)
+    if not postings[0]:
+      return []
+    return set.intersection(*postings)
+
+  def search(self, term, limit):
+    term = term.strip().lower()
+    with self.lock:
+      matches = [(self.names[entity_id], entity_id) for entity_id in self.candidates(term) if term in self.lowered[entity_id]]
+    best = heapq.nsmallest(limit, matches, key=lambda match: rank_key(match[0], term) + (match[1],))
+    return SearchResults(len(matches), [{"id": entity_id, "name": name} for name, entity_id in best])
+
+
+class NgramSearchBackend(object):
+  def __init__(self, db, model, limit, n=3):
+    self.db = db
+    self.model = model
+    self.limit = limit
+    self.n = n
+    self.index = NgramIndex(n)
+    self.table = TableSync(db, model, model.name)
+    self.lock = threading.Lock()
+
+  def sync(self):
+    # built from the table on the first search in this process, then kept up to date from it
+    with self.lock:
+      changes = self.table.changed()
+      if changes is None:
+        return
+      rebuild, rows = changes
+      # a rebuilt index is filled before it replaces the old one, which searches keep using until then
+      index = NgramIndex(self.n) if rebuild else self.index
+      for entity_id, name in rows:
+        index.add(entity_id, name)
+      self.index = index
+
+  def add(self, entity_id, name):
+    # this process's own writes show up at once, without waiting for the next search's sync
+    if self.table.state is not None:
+      self.index.add(entity_id, name)
+
+  def remove(self, entity_id):
+    with self.lock:
+      self.index.remove(entity_id)
+      self.table.forget(entity_id)
+
+  def search(self, term):
+    self.sync()
+    return self.index.search(term, self.limit)
+
+
+BACKENDS = {
+  'sql': SqlSearchBackend,
+  'fts': FullTextSearchBackend,
+  'ngram': NgramSearchBackend,
+}
+
+
+def make_search_backend(name, db, model, limit):
+  try:
+    backend = BACKENDS[name]
+  except KeyError:
+    raise ValueError('unknown SEARCH_BACKEND %r, expected one of %s' % (name, ', '.join(sorted(BACKENDS))))
+  return backend(db, model, limit)
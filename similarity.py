@@ -0,0 +1,351 @@
+#----------------------------------------------------------------------------#
+# Similar artists and venues.
+#
+# Computed offline by "flask build-similarity" and kept in one .npz file
+# (SIMILARITY_PATH) that the pages read:
+#
+#   features - each artist is a sparse vector of its genres and of the
+#              venues it has played (log-damped show counts), each block
+#              scaled to unit length and weighted by SIMILARITY_GENRE_WEIGHT,
+#              and venues likewise with genres and the artists they booked
+#   top k    - cosine similarity is a sparse matrix product of the
+#              normalized rows; rows are multiplied in chunks of at most
+#              SIMILARITY_CHUNK_CELLS scores and each chunk's k best are
+#              picked with one argpartition
+#   storage  - per kind: ids, the k neighbours as row positions (int32),
+#              their scores (float16), when each row last changed, and the
+#              names as one utf-8 blob with offsets - a few bytes per pair
+#
+# Refreshes are incremental. Only entities with new shows (show ids past the
+# stored watermark), edits (updated_at past the last build) or no row yet
+# have new vectors, so only their rows are recomputed. Every other row
+# changes only through its score with one of those, so it is recomputed
+# just when it listed one of them or one of them now beats its kth score.
+#
+# At request time SimilarityIndex.similar() is an array lookup by id: no
+# query, and numpy is only imported once the file exists.
+#----------------------------------------------------------------------------#
+
+import os
+import time
+import tempfile
+import threading
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import *
+from viewmodels import SimilarEntity
+
+# kind -> (model, genre link table, its id column, the kind's column on show, the other side's column)
+KINDS = {
+  'artists': (Artist, artist_genres, artist_genres.c.artist_id, Show.artist_id, Show.venue_id),
+  'venues': (Venue, venue_genres, venue_genres.c.venue_id, Show.venue_id, Show.artist_id),
+}
+
+
+#  Building
+#  ----------------------------------------------------------------
+
+def normalize_rows(matrix):
+  from scipy import sparse
+  import numpy as np
+  norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+  norms[norms == 0] = 1
+  return sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+class Vectors(object):
+  # unit length feature rows in two blocks: genres, a few dozen columns, held dense so their part
+  # of a product is a plain matrix multiply; bookings, many columns and few per row, held sparse
+  def __init__(self, genres, bookings):
+    import numpy as np
+    norms = np.sqrt((genres ** 2).sum(axis=1) + np.asarray(bookings.multiply(bookings).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    self.genres = (genres / norms[:, None]).astype(np.float32)
+    self.bookings = bookings.multiply(1 / norms[:, None]).tocsr().astype(np.float32)
+    self.bookings_columns = self.bookings.T.tocsc()
+
+  def __len__(self):
+    return self.genres.shape[0]
+
+  def similarity(self, positions):
+    # the cosine similarity of the given rows with every row, as a dense (len(positions), n) array
+    return self.genres[positions].dot(self.genres.T) + self.bookings[positions].dot(self.bookings_columns).toarray()
+
+
+def feature_matrix(kind, genre_weight):
+  # (ids, names, vectors) with vectors the feature rows in id order. two aggregate queries: the
+  # genre links, and the show counts per (entity, other side) pair
+  from scipy import sparse
+  import numpy as np
+  model, link_table, link_column, column, other = KINDS[kind]
+  entities = db.session.query(model.id, model.name).order_by(model.id).all()
+  ids = np.array([row[0] for row in entities], dtype=np.int64)
+  names = [row[1] or '' for row in entities]
+
+  links = np.array([tuple(row) for row in db.session.query(link_column, link_table.c.genre_id)], dtype=np.int64).reshape(-1, 2)
+  genre_count = int(links[:, 1].max()) + 1 if len(links) else 1
+  genres = np.zeros((len(ids), genre_count), dtype=np.float32)
+  genres[np.searchsorted(ids, links[:, 0]), links[:, 1]] = 1
+  norms = np.sqrt(genres.sum(axis=1))
+  norms[norms == 0] = 1
+
+  pairs = np.array([tuple(row) for row in db.session.query(column, other, db.func.count()).group_by(column, other)],
+    dtype=np.int64).reshape(-1, 3)
+  other_count = int(pairs[:, 1].max()) + 1 if len(pairs) else 1
+  bookings = sparse.csr_matrix((np.log1p(pairs[:, 2]), (np.searchsorted(ids, pairs[:, 0]), pairs[:, 1])),
+    shape=(len(ids), other_count))
+
+  return ids, names, Vectors(genres / norms[:, None] * np.sqrt(genre_weight), normalize_rows(bookings) * np.sqrt(1 - genre_weight))
+
+
+def top_k(vectors, positions, k, chunk_cells):
+  # the k most similar rows to each of the given row positions, as (neighbours, scores) arrays of
+  # shape (len(positions), k); missing neighbours are -1 with a score of 0
+  import numpy as np
+  count = len(vectors)
+  neighbours = np.full((len(positions), k), -1, dtype=np.int32)
+  scores = np.zeros((len(positions), k), dtype=np.float32)
+  if count < 2 or not len(positions):
+    return neighbours, scores
+  width = min(k, count - 1)
+  step = max(1, chunk_cells // count)
+  for start in range(0, len(positions), step):
+    chunk = positions[start:start + step]
+    similarity = vectors.similarity(chunk)
+    similarity[np.arange(len(chunk)), chunk] = -1
+    best = np.argpartition(-similarity, width - 1, axis=1)[:, :width]
+    best_scores = np.take_along_axis(similarity, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    # nothing in common is not similar
+    best[best_scores <= 0] = -1
+    neighbours[start:start + len(chunk), :width] = best
+    scores[start:start + len(chunk), :width] = np.maximum(best_scores, 0)
+  return neighbours, scores
+
+
+def affected_rows(vectors, dirty, neighbours, scores, chunk_cells):
+  # the rows outside dirty whose top k may change now that the dirty rows have new vectors: those
+  # listing a dirty row, and those a dirty row now beats their kth score for
+  import numpy as np
+  count = len(vectors)
+  is_dirty = np.zeros(count, dtype=bool)
+  is_dirty[dirty] = True
+  listed = (neighbours >= 0) & is_dirty[np.maximum(neighbours, 0)]
+  affected = listed.any(axis=1)
+  kth = np.where(neighbours[:, -1] >= 0, scores[:, -1], 0)
+  step = max(1, chunk_cells // count)
+  for start in range(0, len(dirty), step):
+    chunk = dirty[start:start + step]
+    similarity = vectors.similarity(chunk)
+    similarity[np.arange(len(chunk)), chunk] = 0
+    affected |= (similarity > kth).any(axis=0)
+  affected &= ~is_dirty
+  return np.flatnonzero(affected)
+
+
+def changed_ids(kind, since, watermark):
+  # ids whose vectors may differ from the last build: edited since then, or with shows added after
+  # the watermark
+  import numpy as np
+  model, _, _, column, _ = KINDS[kind]
+  edited = db.session.query(model.id).filter(model.updated_at >= since)
+  booked = db.session.query(column).filter(Show.id > watermark)
+  return np.array(sorted(set(row[0] for row in edited.union(booked))), dtype=np.int64)
+
+
+def pack_names(names):
+  import numpy as np
+  encoded = [name.encode('utf-8') for name in names]
+  offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(name) for name in encoded])
+  return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def build_kind(kind, previous, since, watermark, config, now):
+  # (arrays to store, ids of rows that changed). previous is the last build's arrays for the kind
+  # or None for a full build
+  import numpy as np
+  k = config['SIMILARITY_K']
+  chunk_cells = config['SIMILARITY_CHUNK_CELLS']
+  ids, names, vectors = feature_matrix(kind, config['SIMILARITY_GENRE_WEIGHT'])
+  everything = np.arange(len(ids))
+
+  if previous is None or previous['neighbours'].shape[1] != k:
+    neighbours, scores = top_k(vectors, everything, k, chunk_cells)
+    updated = np.full(len(ids), now, dtype=np.int64)
+    changed = ids
+  else:
+    # carry the previous rows over to the new positions. remap has a trailing -1, so empty slots
+    # (-1) and neighbours that were deleted both map to -1; rows that lost one are recomputed
+    old_ids = previous['ids']
+    old_positions = np.minimum(np.searchsorted(old_ids, ids), max(len(old_ids) - 1, 0))
+    known = old_ids[old_positions] == ids if len(old_ids) else np.zeros(len(ids), dtype=bool)
+    remap = np.full(len(old_ids) + 1, -1, dtype=np.int32)
+    remap[old_positions[known]] = np.flatnonzero(known)
+    old_neighbours = previous['neighbours'][old_positions[known]]
+    neighbours = np.full((len(ids), k), -1, dtype=np.int32)
+    scores = np.zeros((len(ids), k), dtype=np.float32)
+    updated = np.full(len(ids), now, dtype=np.int64)
+    neighbours[known] = remap[old_neighbours]
+    scores[known] = previous['scores'][old_positions[known]]
+    updated[known] = previous['updated'][old_positions[known]]
+    lost = np.flatnonzero(known)[((old_neighbours >= 0) & (neighbours[known] < 0)).any(axis=1)]
+
+    dirty_ids = changed_ids(kind, since, watermark)
+    dirty = np.union1d(np.flatnonzero(~known), np.searchsorted(ids, dirty_ids[np.isin(dirty_ids, ids)]))
+    affected = np.union1d(affected_rows(vectors, dirty, neighbours, scores, chunk_cells), lost)
+    recompute = np.union1d(dirty, affected).astype(np.int64)
+    before = (neighbours[recompute].copy(), scores[recompute].copy())
+    neighbours[recompute], scores[recompute] = top_k(vectors, recompute, k, chunk_cells)
+    # a row's page changes when its list does, or when it lists a dirty row (whose name may have)
+    differs = (neighbours[recompute] != before[0]).any(axis=1) | (np.abs(scores[recompute] - before[1]) > 1e-3).any(axis=1)
+    is_dirty = np.zeros(len(ids), dtype=bool)
+    is_dirty[dirty] = True
+    lists_dirty = ((neighbours >= 0) & is_dirty[np.maximum(neighbours, 0)]).any(axis=1)
+    changed_rows = np.union1d(recompute[differs], np.flatnonzero(lists_dirty | is_dirty))
+    updated[changed_rows] = now
+    changed = ids[changed_rows]
+
+  blob, offsets = pack_names(names)
+  arrays = {'ids': ids, 'neighbours': neighbours, 'scores': scores.astype(np.float16),
+    'updated': updated, 'names': blob, 'name_offsets': offsets}
+  return arrays, changed
+
+
+def load_arrays(path):
+  # {name: array} from the stored file, or None when there is none
+  import numpy as np
+  if not os.path.exists(path):
+    return None
+  with np.load(path) as stored:
+    return dict((name, stored[name]) for name in stored.files)
+
+
+def save_arrays(path, arrays):
+  # written next to the target and renamed over it, so readers never see half a file
+  import numpy as np
+  directory = os.path.dirname(os.path.abspath(path))
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  fd, temporary = tempfile.mkstemp(dir=directory, suffix='.npz')
+  try:
+    with os.fdopen(fd, 'wb') as stream:
+      np.savez(stream, **arrays)
+    os.replace(temporary, path)
+  except Exception:
+    os.unlink(temporary)
+    raise
+
+
+def build_similarity(config, full=False):
+  # builds or refreshes the stored index; returns {kind: ids of the rows that changed}
+  import numpy as np
+  path = config['SIMILARITY_PATH']
+  stored = None if full else load_arrays(path)
+  started = time.time()
+  now = int(started)
+  watermark = db.session.query(db.func.max(Show.id)).scalar() or 0
+  since = datetime.fromtimestamp(float(stored['built_at'])) if stored is not None else None
+  arrays = {'built_at': np.array(started), 'show_watermark': np.array(watermark)}
+  changed = {}
+  for kind in sorted(KINDS):
+    previous = None
+    if stored is not None and kind + '_ids' in stored:
+      previous = dict((name[len(kind) + 1:], value) for name, value in stored.items() if name.startswith(kind + '_'))
+    kind_arrays, changed[kind] = build_kind(kind, previous, since,
+      int(stored['show_watermark']) if stored is not None else 0, config, now)
+    arrays.update(('%s_%s' % (kind, name), value) for name, value in kind_arrays.items())
+  save_arrays(path, arrays)
+  return changed
+
+
+@click.command('build-similarity')
+@click.option('--full', is_flag=True, help='Recompute every row instead of refreshing the ones that changed.')
+@with_appcontext
+def build_similarity_command(full):
+  """Build or refresh the similar artists and venues shown on their pages."""
+  started = time.time()
+  changed = build_similarity(current_app.config, full)
+  # the pages of changed rows carry their new panels
+  page_cache = current_app.extensions.get('page_cache')
+  if page_cache is not None:
+    keys = ['artist:%d' % artist_id for artist_id in changed['artists']] + ['venue:%d' % venue_id for venue_id in changed['venues']]
+    for start in range(0, len(keys), 1000):
+      page_cache.invalidate(keys=keys[start:start + 1000])
+  click.echo('%d artists and %d venues changed, in %.1f s; written to %s' % (len(changed['artists']),
+    len(changed['venues']), time.time() - started, current_app.config['SIMILARITY_PATH']))
+
+
+#  Lookups
+#  ----------------------------------------------------------------
+
+class SimilarityIndex(object):
+  # the stored index, loaded on first use and again whenever the file is replaced
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.version = None
+    self.kinds = {}
+
+  def current(self):
+    try:
+      stat = os.stat(self.path)
+    except OSError:
+      return {}
+    version = (stat.st_mtime_ns, stat.st_size)
+    if version != self.version:
+      with self.lock:
+        if version != self.version:
+          self.kinds = self.load()
+          self.version = version
+    return self.kinds
+
+  def load(self):
+    import numpy as np
+    arrays = load_arrays(self.path) or {}
+    kinds = {}
+    for kind in KINDS:
+      if kind + '_ids' not in arrays:
+        continue
+      data = dict((name[len(kind) + 1:], value) for name, value in arrays.items() if name.startswith(kind + '_'))
+      # position of each id, so a lookup is one index into an array
+      slots = np.full(int(data['ids'].max()) + 1 if len(data['ids']) else 0, -1, dtype=np.int32)
+      slots[data['ids']] = np.arange(len(data['ids']), dtype=np.int32)
+      data['slots'] = slots
+      data['names'] = data['names'].tobytes()
+      kinds[kind] = data
+    return kinds
+
+  def position(self, kind, entity_id):
+    data = self.current().get(kind)
+    if data is None or not 0 <= entity_id < len(data['slots']):
+      return None, None
+    position = int(data['slots'][entity_id])
+    return (data, position) if position >= 0 else (None, None)
+
+  def similar(self, kind, entity_id, limit=None):
+    # the stored neighbours of the entity as SimilarEntity view models, most similar first
+    data, position = self.position(kind, entity_id)
+    if data is None:
+      return []
+    similar = []
+    offsets = data['name_offsets']
+    for neighbour, score in zip(data['neighbours'][position][:limit].tolist(), data['scores'][position][:limit].tolist()):
+      if neighbour < 0:
+        break
+      similar.append(SimilarEntity(id=int(data['ids'][neighbour]), score=round(score, 3),
+        name=data['names'][offsets[neighbour]:offsets[neighbour + 1]].decode('utf-8')))
+    return similar
+
+  def modified(self, kind, entity_id):
+    # when the entity's row last changed, or None
+    data, position = self.position(kind, entity_id)
+    if data is None:
+      return None
+    return datetime.fromtimestamp(int(data['updated'][position]))
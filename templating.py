@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Template loading and fragment caching.
+#
+# Compiled templates are kept in a bytecode cache on disk
+# (TEMPLATE_BYTECODE_CACHE_DIR, by default a per-user directory under the
+# system temp dir), so every worker on the host, and every restart, loads
+# the compiled code instead of parsing and compiling the template source
+# again. Jinja checks each entry against the template source and the python
+# version, so a stale entry is simply recompiled.
+#
+# {% cache name, value, ... %}...{% endcache %} caches the rendered block in
+# the page cache backend under its name and the values after it. Those must
+# come from the database and change whenever the block would - updated_at of
+# the rows it shows - so every worker, and every cli command writing to the
+# database, retires the fragment, not just the process that made the edit:
+#
+#   {% cache 'show-row:%d' % show.id, show.start_time, show.venue_updated_at, show.artist_updated_at %}
+#
+# With CACHE_BACKEND 'none', or outside an app context, the block is
+# rendered every time.
+#----------------------------------------------------------------------------#
+
+import os
+import tempfile
+
+from flask import current_app, has_app_context
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+  # several workers may compile the same template at once: entries are written to a temporary file
+  # and renamed into place, and an unreadable entry is recompiled instead of failing the request
+  def load_bytecode(self, bucket):
+    try:
+      FileSystemBytecodeCache.load_bytecode(self, bucket)
+    except (EOFError, ValueError, TypeError):
+      bucket.reset()
+
+  def dump_bytecode(self, bucket):
+    filename = self._get_cache_filename(bucket)
+    handle, temporary = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+    try:
+      with os.fdopen(handle, 'wb') as stream:
+        bucket.write_bytecode(stream)
+      os.replace(temporary, filename)
+    except BaseException:
+      os.unlink(temporary)
+      raise
+
+
+class FragmentCacheExtension(Extension):
+  tags = {'cache'}
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [parser.parse_expression()]
+    while parser.stream.skip_if('comma'):
+      args.append(parser.parse_expression())
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(self.call_method('render_fragment', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+  def render_fragment(self, args, caller):
+    page_cache = current_app.extensions.get('page_cache') if has_app_context() else None
+    if page_cache is None or page_cache.backend is None:
+      return caller()
+    # cached fragments come back as plain strings; they were escaped when first rendered
+    return Markup(page_cache.fragment(args[0], args[1:], caller))
+
+
+def init_templates(app):
+  env = app.jinja_env
+  env.add_extension(FragmentCacheExtension)
+  if app.config['TEMPLATE_BYTECODE_CACHE']:
+    directory = app.config['TEMPLATE_BYTECODE_CACHE_DIR']
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    # with no directory jinja picks (and safely creates) a per-user one under the temp dir
+    env.bytecode_cache = SharedBytecodeCache(directory or None, 'fyyur-%s.cache')
+  if app.config['WARM_TEMPLATES']:
+    warm_templates(app)
+
+
+def warm_templates(app):
+  # compiles every page template now, after the profiler has set the template class, so the
+  # first request to each page in a fresh worker doesn't pay for parsing and compiling it
+  env = app.jinja_env
+  for name in env.list_templates(filter_func=lambda name: name.endswith('.html')):
+    env.get_template(name)
@@ -0,0 +1,78 @@
+#----------------------------------------------------------------------------#
+# Read-only view models.
+#
+# Pages are rendered from these instead of ORM instances. They are built
+# straight from column projections, hold no session or identity-map state,
+# and __slots__ keeps each one a fixed-size object with no per-instance
+# __dict__, which matters on pages listing hundreds of shows.
+#----------------------------------------------------------------------------#
+
+
+class ViewModel(object):
+  __slots__ = ()
+
+  def __init__(self, **fields):
+    for name in self.__slots__:
+      object.__setattr__(self, name, fields.get(name))
+
+  def __setattr__(self, name, value):
+    raise AttributeError('%s is read-only' % type(self).__name__)
+
+  def __repr__(self):
+    return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+  @classmethod
+  def from_row(cls, row, **extra):
+    # row is a query result whose labels match the slot names
+    fields = row._asdict()
+    fields.update(extra)
+    return cls(**fields)
+
+  def _asdict(self):
+    return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class VenueShow(ViewModel):
+  # a show as listed on a venue page
+  __slots__ = ('artist_id', 'artist_name', 'artist_image_link', 'start_time')
+
+
+class ArtistShow(ViewModel):
+  # a show as listed on an artist page
+  __slots__ = ('venue_id', 'venue_name', 'venue_image_link', 'start_time')
+
+
+class ShowListing(ViewModel):
+  # a row of the /shows feed
+  __slots__ = ('id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link',
+    'venue_updated_at', 'artist_updated_at')
+
+
+class VenueSummary(ViewModel):
+  __slots__ = ('id', 'name', 'num_upcoming_shows')
+
+
+class ArtistSummary(ViewModel):
+  __slots__ = ('id', 'name')
+
+
+class Area(ViewModel):
+  # a city/state group on /venues
+  __slots__ = ('city', 'state', 'venues')
+
+
+class VenueDetail(ViewModel):
+  __slots__ = ('id', 'name', 'genres', 'address', 'city', 'state', 'phone', 'website', 'facebook_link',
+    'seeking_talent', 'seeking_description', 'image_link', 'updated_at',
+    'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count', 'similar')
+
+
+class ArtistDetail(ViewModel):
+  __slots__ = ('id', 'name', 'genres', 'city', 'state', 'phone', 'website', 'facebook_link',
+    'seeking_venue', 'seeking_description', 'image_link', 'updated_at',
+    'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count', 'similar')
+
+
+class SimilarEntity(ViewModel):
+  # a venue or artist in the "similar" panel of another's page (similarity.py)
+  __slots__ = ('id', 'name', 'score')